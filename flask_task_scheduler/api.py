@@ -0,0 +1,261 @@
+"""
+JSON API, mounted at /api/v1.
+
+Lists are keyset paginated: a page holds at most `limit` items, plus a
+`next` cursor to pass back as `cursor` for the following page (null on
+the last one). Every query is bounded by the page size and reads only the
+columns asked for with `fields`. Responses carry an ETag derived from the
+data version, so unchanged pages can be revalidated with If-None-Match.
+"""
+from datetime import date, datetime
+
+from flask import (
+    Blueprint, Response, abort, current_app, jsonify, request,
+    stream_with_context, url_for
+)
+from werkzeug.exceptions import HTTPException
+
+import bulk
+from caching import conditional, get_work_plan
+from models import json_value, decode_cursor, encode_cursor
+from storage import get_storage
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+TASK_FIELDS = ('id', 'title', 'description', 'due_date', 'estimated_hours',
+               'hours_completed', 'status', 'rrule')
+LOG_FIELDS = ('id', 'task_id', 'log_date', 'hours')
+SCHEDULE_FIELDS = ('schedule', 'late')
+
+TASK_STATUSES = ('pending', 'completed')
+
+
+# Request parsing
+def selected_fields(allowed):
+    """Return the fields named in the `fields` argument, or all of them."""
+    value = request.args.get('fields')
+    if not value:
+        return allowed
+
+    fields = tuple(dict.fromkeys(field.strip() for field in value.split(',') if field.strip()))
+    unknown = [field for field in fields if field not in allowed]
+    if unknown or not fields:
+        abort(400, f"Unknown fields: {', '.join(unknown)}. Choose from {', '.join(allowed)}.")
+    return fields
+
+
+def page_size():
+    """Return the requested page size, capped at API_MAX_PAGE_SIZE."""
+    limit = request.args.get('limit', current_app.config['API_PAGE_SIZE'], type=int)
+    if limit is None or limit < 1:
+        abort(400, 'limit must be a positive integer.')
+    return min(limit, current_app.config['API_MAX_PAGE_SIZE'])
+
+
+def cursor_keyset(types):
+    """Return the keyset in the `cursor` argument, or None on the first page."""
+    value = request.args.get('cursor')
+    if not value:
+        return None
+    try:
+        return decode_cursor(value, types)
+    except ValueError as e:
+        abort(400, str(e))
+
+
+# Serialization
+def row_json(row, fields):
+    """Return the chosen fields of a row as a dict."""
+    return {field: json_value(row[field]) for field in fields}
+
+
+def page_json(rows, fields, limit, sort_key):
+    """
+    Return a page of rows, fetched with one row beyond `limit` so we can
+    tell whether there is another page. `sort_key` gives a row's cursor values.
+    """
+    page = rows[:limit]
+    cursor = None
+    if len(rows) > limit:
+        cursor = encode_cursor([json_value(value) for value in sort_key(page[-1])])
+
+    next_url = None
+    if cursor is not None:
+        args = request.args.to_dict()
+        args['cursor'] = cursor
+        next_url = url_for(request.endpoint, **{**args, **request.view_args})
+
+    return {
+        'data': [row_json(row, fields) for row in page],
+        'next': cursor,
+        'next_url': next_url,
+    }
+
+
+# Endpoints
+@api.route('/tasks')
+@conditional
+def list_tasks():
+    """List tasks in due date order, optionally only those with a given status."""
+    fields = selected_fields(TASK_FIELDS)
+    limit = page_size()
+    after = cursor_keyset((date, int))
+
+    status = request.args.get('status')
+    if status is not None and status not in TASK_STATUSES:
+        abort(400, f"status must be one of {', '.join(TASK_STATUSES)}.")
+
+    rows = get_storage().tasks.page(fields, status=status, sort='due', after=after, limit=limit)
+    return jsonify(page_json(rows, fields, limit, lambda row: (row['due_date'], row['id'])))
+
+
+@api.route('/tasks/<int:task_id>')
+@conditional
+def get_task(task_id):
+    """Return one task."""
+    fields = selected_fields(TASK_FIELDS)
+    task = get_storage().tasks.get(task_id, fields)
+    if task is None:
+        abort(404, 'Task not found.')
+    return jsonify(row_json(task, fields))
+
+
+@api.route('/tasks/<int:task_id>/logs')
+@conditional
+def list_task_logs(task_id):
+    """List a task's logs, newest first."""
+    fields = selected_fields(LOG_FIELDS)
+    limit = page_size()
+    after = cursor_keyset((date, int))
+
+    storage = get_storage()
+    if storage.tasks.get(task_id, ('id',)) is None:
+        abort(404, 'Task not found.')
+
+    rows = storage.logs.task_page(task_id, fields, after=after, limit=limit)
+    return jsonify(page_json(rows, fields, limit, lambda row: (row['log_date'], row['id'])))
+
+
+@api.route('/task_logs')
+@conditional
+def list_logs():
+    """List every log of the user's tasks in the order they were recorded."""
+    fields = selected_fields(LOG_FIELDS)
+    limit = page_size()
+    after = cursor_keyset((int,))
+
+    rows = get_storage().logs.page(fields, after=after, limit=limit)
+    return jsonify(page_json(rows, fields, limit, lambda row: (row['id'],)))
+
+
+@api.route('/schedule')
+@conditional
+def schedule():
+    """Return the planner's schedule for the next `days` days and the tasks that will be late."""
+    fields = selected_fields(SCHEDULE_FIELDS)
+    days_ahead = request.args.get('days', 7, type=int)
+    max_days = current_app.config['API_MAX_SCHEDULE_DAYS']
+    if days_ahead is None or not 1 <= days_ahead <= max_days:
+        abort(400, f'days must be between 1 and {max_days}.')
+
+    plan = get_work_plan(days_ahead)
+    result = {
+        'start': datetime.now().date().isoformat(),
+        'days': days_ahead,
+    }
+    if 'schedule' in fields:
+        result['schedule'] = [
+            {
+                'date': day.isoformat(),
+                'hours': sum(session['hours'] for session in sessions),
+                'sessions': sessions,
+            }
+            for day, sessions in plan.schedule.items()
+        ]
+    if 'late' in fields:
+        result['late'] = [
+            {
+                'task_id': task.task_id,
+                'title': task.title,
+                'due_date': task.due_date.isoformat(),
+                'shortfall': task.shortfall,
+            }
+            for task in plan.late
+        ]
+    return jsonify(result)
+
+
+# Bulk import and export
+def upload():
+    """Return the binary stream and format of an upload, raw or as a `file` form field."""
+    file = request.files.get('file')
+    if file is not None:
+        stream, filename, content_type = file.stream, file.filename, file.content_type
+    else:
+        stream, filename, content_type = request.stream, None, request.content_type
+
+    fmt = request.args.get('format') or bulk.detect_format(filename, content_type)
+    if fmt not in bulk.FORMATS:
+        abort(400, f"format must be one of {', '.join(bulk.FORMATS)}.")
+    return stream, fmt
+
+
+def import_response(run):
+    """Run an import and report what was imported and which rows were rejected."""
+    try:
+        result = run()
+    except UnicodeDecodeError:
+        abort(400, 'Uploads must be UTF-8 encoded.')
+    return jsonify(result.as_dict())
+
+
+def export_response(rows, name, fmt):
+    """Stream an export as a CSV or NDJSON download."""
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    response = Response(stream_with_context(rows), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename={name}.{fmt}'
+    return response
+
+
+def export_format():
+    fmt = request.args.get('format', 'csv')
+    if fmt not in bulk.FORMATS:
+        abort(400, f"format must be one of {', '.join(bulk.FORMATS)}.")
+    return fmt
+
+
+@api.route('/tasks/import', methods=('POST',))
+def import_tasks():
+    """Import tasks from an uploaded CSV or NDJSON file."""
+    stream, fmt = upload()
+    return import_response(lambda: bulk.import_tasks(stream, fmt))
+
+
+@api.route('/task_logs/import', methods=('POST',))
+def import_logs():
+    """Import task logs from an uploaded CSV or NDJSON file."""
+    stream, fmt = upload()
+    update_totals = request.args.get('totals', '1') not in ('0', 'false')
+    return import_response(lambda: bulk.import_logs(stream, fmt, update_totals=update_totals))
+
+
+@api.route('/tasks/export')
+@conditional
+def export_tasks():
+    """Download every task as CSV or NDJSON."""
+    fmt = export_format()
+    return export_response(bulk.export_tasks(fmt), 'tasks', fmt)
+
+
+@api.route('/task_logs/export')
+@conditional
+def export_logs():
+    """Download every task log as CSV or NDJSON."""
+    fmt = export_format()
+    return export_response(bulk.export_logs(fmt), 'task_logs', fmt)
+
+
+@api.errorhandler(HTTPException)
+def handle_exception(e):
+    """Report errors as JSON rather than the HTML error page."""
+    return jsonify(error=e.description), e.code
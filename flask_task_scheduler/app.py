@@ -1,234 +1,220 @@
 #!/usr/bin/env python3
+"""
+The task scheduler application.
+
+create_app() builds and configures the Flask app. Nothing heavy is done at
+import time: the database is set up when an app is created, and the PDF
+renderers and NumPy are only imported when a PDF or a large plan is first
+needed, so workers start quickly and run without them.
+"""
 import os
-import sqlite3
-from datetime import datetime, timedelta, date
-import math
+from datetime import date, datetime, timedelta
 from flask import (
-    Flask, render_template, request, redirect, url_for, flash,
-    g, send_file, make_response, jsonify, abort, after_this_request
+    Blueprint, Flask, render_template, request, redirect, url_for, flash,
+    current_app, jsonify, abort, Response, stream_with_context
 )
 from werkzeug.exceptions import HTTPException
-from icalendar import Calendar, Event
-from dateutil import rrule
-import tempfile
-from weasyprint import HTML, CSS
-from flask import render_template
-
-# Initialize Flask application
-app = Flask(__name__)
-app.config.from_mapping(
-    SECRET_KEY='dev',
-    DATABASE=os.path.join(app.instance_path, 'database.db'),
-)
-
-# Ensure the instance folder exists
-try:
-    os.makedirs(app.instance_path)
-except OSError:
-    pass
-
-
-# Database helper functions
-def get_db():
-    """Connect to the database."""
-    if 'db' not in g:
-        g.db = sqlite3.connect(
-            app.config['DATABASE'],
-            detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES
-        )
-        g.db.row_factory = sqlite3.Row
-    return g.db
-
-
-def close_db(e=None):
-    """Close the database connection."""
-    db = g.pop('db', None)
-    if db is not None:
-        db.close()
 
+import bulk
+import history
+import profiling
+import querylog
+import refresher
+from api import api
+from auth import auth
+from caching import (
+    conditional, get_data_version, get_today_schedule, get_work_plan,
+    get_work_schedule, schedule_cache
+)
+from db import init_app, init_db
+from ics import stream_calendar
+from models import decode_cursor, encode_cursor, json_value, parse_due_date
+from pdf_jobs import PDFJobs, available_renderer
+from profiling import timed, timed_iter
+from recurrence import check_rule
+from scheduler import DEFAULT_DAILY_CAPACITY, DEFAULT_WEEKEND_FACTOR
+from storage import get_storage, init_app as init_storage
+from storage.base import TASK_SORTS
+from tenants import tenant_id
+
+# The dashboard, task, schedule and export pages
+main = Blueprint('main', __name__)
+
+
+def create_app(test_config=None):
+    """
+    Create and configure the application. Settings can be overridden from
+    `config.py` in the instance folder, or with `test_config`.
+    """
+    app = Flask(__name__, instance_relative_config=True)
+    app.config.from_mapping(
+        SECRET_KEY='dev',
+        DATABASE=os.path.join(app.instance_path, 'database.db'),
+        DAILY_CAPACITY_HOURS=DEFAULT_DAILY_CAPACITY,
+        WEEKEND_CAPACITY_FACTOR=DEFAULT_WEEKEND_FACTOR,
+        LOGS_PER_PAGE=20,
+        DASHBOARD_PAGE_SIZE=25,
+        # JSON API
+        API_PAGE_SIZE=50,
+        API_MAX_PAGE_SIZE=500,
+        API_MAX_SCHEDULE_DAYS=366,
+        # Bulk import and export
+        BULK_BATCH_SIZE=1000,
+        BULK_MAX_ERRORS=1000,  # per-row errors reported per import
+        # Background PDF rendering
+        PDF_WORKERS=2,
+        PDF_CACHE_BYTES=64 * 1024 * 1024,
+        PDF_RENDER_TIMEOUT=60,  # seconds
+        PDF_SPOOL_BYTES=8 * 1024 * 1024,
+        # Threads for blocking work when served through asgi.py
+        ASGI_THREADS=16,
+        # Server-Timing headers and /metrics
+        PROFILING=False,
+        # Statement timings and the slow-query log
+        QUERY_STATS=False,
+        SLOW_QUERY_MS=100,
+        QUERY_STATS_FLUSH_SECONDS=10,
+        QUERY_STATS_DATABASE=os.path.join(app.instance_path, 'query_stats.db'),
+        # Accounts, and a database per tenant when TENANT_STORAGE is 'sharded'
+        MULTI_TENANT=False,
+        TENANT_STORAGE='shared',
+        TENANT_FOLDER=os.path.join(app.instance_path, 'tenants'),
+        TENANT_DATABASES=32,  # tenant files kept open per process
+        # Where tasks and logs are kept: 'sqlite', 'server' or 'standin'
+        STORAGE_BACKEND='sqlite',
+        STORAGE_DSN=None,
+        STORAGE_POOL_SIZE=8,
+        # The materialized schedule: horizons kept planned, and the
+        # background thread that re-plans them after writes and at midnight
+        SCHEDULE_HORIZONS=(7, 14),
+        SCHEDULE_REFRESHER=True,
+        SCHEDULE_REFRESH_DELAY=0.5,  # seconds to let a burst of writes settle
+        # Logged hours history, and raw logs kept before `flask compact-logs`
+        # folds them into the daily and weekly rollups
+        HISTORY_DAYS=28,
+        HISTORY_WEEKS=52,
+        LOG_RETENTION_DAYS=90,
+        # SQLite connection pool and pragmas
+        SQLITE_POOL_SIZE=8,
+        SQLITE_JOURNAL_MODE='WAL',
+        SQLITE_SYNCHRONOUS='NORMAL',
+        SQLITE_CACHE_SIZE=-16000,  # KiB when negative
+        SQLITE_MMAP_SIZE=64 * 1024 * 1024,
+        SQLITE_BUSY_TIMEOUT=5000,  # milliseconds
+    )
 
-def init_db():
-    """Initialize the database with schema."""
-    db = get_db()
-    with app.open_resource('schema.sql') as f:
-        db.executescript(f.read().decode('utf8'))
-    db.commit()
+    if test_config is None:
+        app.config.from_pyfile('config.py', silent=True)
+    else:
+        app.config.from_mapping(test_config)
 
+    # Ensure the instance folder exists
+    try:
+        os.makedirs(app.instance_path)
+    except OSError:
+        pass
 
-@app.cli.command('init-db')
-def init_db_command():
-    """Clear the existing data and create new tables."""
-    init_db()
-    click.echo('Initialized the database.')
+    # Set up the database, creating or upgrading it as needed
+    querylog.init_app(app)
+    init_app(app)
+    init_storage(app)
 
+    # Accounts, pages, JSON API and bulk import/export commands
+    app.register_blueprint(auth)
+    app.register_blueprint(main)
+    app.register_blueprint(api)
+    bulk.init_app(app)
+    history.init_app(app)
+    refresher.init_app(app)
+    profiling.init_app(app)
 
-# Automatically check if database exists, if not create it
-def init_app(app):
-    app.teardown_appcontext(close_db)
-    app.cli.add_command(init_db_command)
+    return app
 
-    # Check if database exists, initialize if not
-    if not os.path.exists(app.config['DATABASE']):
-        with app.app_context():
-            init_db()
-            print("Database initialized.")
 
+def parse_date(value):
+    """Return a YYYY-MM-DD string as a date, or None if it isn't one."""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        return None
 
-# Register the init_app function
-init_app(app)
 
+def schedule_days(default=7):
+    """Return the schedule horizon asked for in `days`, limited to 1..API_MAX_SCHEDULE_DAYS."""
+    days = request.args.get('days', default, type=int)
+    return min(max(1, days), current_app.config['API_MAX_SCHEDULE_DAYS'])
 
-# Helper functions for scheduling algorithm
-def get_all_tasks():
-    """Get all tasks from the database."""
-    db = get_db()
-    tasks = db.execute('SELECT * FROM tasks ORDER BY due_date').fetchall()
-    return tasks
 
+def dashboard_filters():
+    """Read the dashboard's filters and sort order from the query string."""
+    args = request.args
+    filters = {
+        'status': args.get('status') if args.get('status') in ('pending', 'completed') else None,
+        'overdue': args.get('overdue') == '1',
+        'sort': args.get('sort') if args.get('sort') in TASK_SORTS else 'due',
+    }
+    for name in ('due_from', 'due_to'):
+        filters[name] = parse_date(args.get(name, ''))
+    return filters
 
-def get_task(task_id):
-    """Get a specific task by ID."""
-    db = get_db()
-    task = db.execute('SELECT * FROM tasks WHERE id = ?', (task_id,)).fetchone()
-    return task
 
+# Routes
+@main.route('/')
+def index():
+    """Show dashboard with a page of tasks and today's schedule."""
+    filters = dashboard_filters()
+
+    # The cursor holds the last task's sort column and id. An unreadable
+    # one just starts again from the first page
+    column = TASK_SORTS[filters['sort']][0]
+    keyset = (str if column == 'title' else date, int)
+    after = None
+    if request.args.get('cursor'):
+        try:
+            after = decode_cursor(request.args['cursor'], keyset)
+        except ValueError:
+            pass
 
-def get_logs_for_task(task_id):
-    """Get all logs for a specific task."""
-    db = get_db()
-    logs = db.execute(
-        'SELECT * FROM task_logs WHERE task_id = ? ORDER BY log_date DESC',
-        (task_id,)
-    ).fetchall()
-    return logs
+    per_page = current_app.config['DASHBOARD_PAGE_SIZE']
+    tasks = get_storage().tasks.page(after=after, limit=per_page, **filters)
 
+    next_cursor = None
+    if len(tasks) > per_page:
+        tasks = tasks[:per_page]
+        next_cursor = encode_cursor([json_value(tasks[-1][column]), tasks[-1]['id']])
 
-def calculate_work_schedule(days_ahead=14):
-    """
-    Calculate a work schedule for the next X days.
-    Returns a dictionary mapping dates to tasks and suggested hours.
-    """
-    tasks = get_all_tasks()
-    schedule = {}
+    # The filters as query arguments, to carry over to the next page
+    filter_args = {name: json_value(value) for name, value in filters.items()
+                   if value and not (name == 'sort' and value == 'due')}
+    if filters['overdue']:
+        filter_args['overdue'] = '1'
 
-    # Initialize schedule with empty lists for each day
+    # Only today's share of the week's plan is shown
     today = datetime.now().date()
-    for i in range(days_ahead):
-        current_date = today + timedelta(days=i)
-        schedule[current_date] = []
-
-    # For each task, calculate remaining work and distribute across days
-    for task in tasks:
-        # Skip completed tasks
-        if task['status'] == 'completed':
-            continue
-
-        # Calculate remaining hours
-        remaining_hours = task['estimated_hours'] - task['hours_completed']
-        if remaining_hours <= 0:
-            continue
-
-        # Calculate days until due date
-        # Handle due_date correctly whether it's a string or a date object
-        if isinstance(task['due_date'], str):
-            due_date = datetime.strptime(task['due_date'], '%Y-%m-%d').date()
-        else:
-            due_date = task['due_date']
-
-        days_until_due = (due_date - today).days + 1  # Include today
-
-        # If due date has passed or is today, schedule all remaining work today
-        if days_until_due <= 0:
-            if today in schedule:
-                schedule[today].append({
-                    'task_id': task['id'],
-                    'title': task['title'],
-                    'hours': round(remaining_hours * 2) / 2  # Round to nearest 0.5
-                })
-            continue
-
-        # If due date is within our planning horizon
-        if days_until_due <= days_ahead:
-            # Distribute hours evenly
-            daily_hours = remaining_hours / days_until_due
-
-            # Round to nearest 0.5 hour, minimum 0.5 hour
-            daily_hours = max(0.5, round(daily_hours * 2) / 2)
-
-            # Ensure we don't allocate more hours than remaining
-            total_allocated = 0
-
-            for i in range(days_until_due):
-                current_date = today + timedelta(days=i)
-
-                # Skip if we've already allocated all hours
-                if total_allocated >= remaining_hours:
-                    break
-
-                # Adjust for weekends (reduce weekend work by 20% if possible)
-                adjusted_hours = daily_hours
-                if current_date.weekday() >= 5:  # Saturday (5) or Sunday (6)
-                    adjusted_hours = max(0.5, round(daily_hours * 0.8 * 2) / 2)
-
-                # Don't exceed remaining hours
-                hours_today = min(adjusted_hours, remaining_hours - total_allocated)
-
-                # Round to nearest 0.5 hour
-                hours_today = round(hours_today * 2) / 2
-
-                # Add to schedule
-                if hours_today > 0 and current_date in schedule:
-                    schedule[current_date].append({
-                        'task_id': task['id'],
-                        'title': task['title'],
-                        'hours': hours_today
-                    })
-                    total_allocated += hours_today
-
-    # Calculate total hours per day
-    for date, tasks in schedule.items():
-        total_hours = sum(task['hours'] for task in tasks)
-
-        # If a day has more than 5 hours, redistribute
-        if total_hours > 5:
-            # Sort tasks by due date (priority)
-            tasks_sorted = sorted(tasks, key=lambda x: get_task(x['task_id'])['due_date'])
-
-            # Reset hours allocation
-            total_allocated = 0
-            for task in tasks_sorted:
-                # Allocate at most 5 hours per day, prioritizing tasks with earlier due dates
-                remaining = 5 - total_allocated
-                if remaining <= 0:
-                    task['hours'] = 0
-                else:
-                    task['hours'] = min(task['hours'], remaining)
-                    task['hours'] = round(task['hours'] * 2) / 2  # Round to nearest 0.5
-                    total_allocated += task['hours']
-
-    return schedule
-
+    today_schedule = get_today_schedule(days_ahead=7)
+
+    with timed('template'):
+        return render_template(
+            'index.html',
+            tasks=tasks,
+            filters=filters,
+            filter_args=filter_args,
+            next_cursor=next_cursor,
+            first_page=after is None,
+            today_schedule=today_schedule,
+            today=today
+        )
 
-# Routes
-@app.route('/')
-def index():
-    """Show dashboard with tasks and today's schedule."""
-    tasks = get_all_tasks()
 
-    # Get today's schedule
-    today = datetime.now().date()
-    schedule = calculate_work_schedule(days_ahead=7)
-    today_schedule = schedule.get(today, [])
-
-    return render_template(
-        'index.html',
-        tasks=tasks,
-        today_schedule=today_schedule,
-        today=today
-    )
+def repeat_rule(rule, due_date):
+    """Validate a task form's repeat rule, returning (error, rule)."""
+    try:
+        return None, check_rule(rule, parse_due_date(due_date))
+    except ValueError as e:
+        return str(e), rule
 
 
-@app.route('/tasks/new', methods=('GET', 'POST'))
+@main.route('/tasks/new', methods=('GET', 'POST'))
 def create_task():
     """Create a new task."""
     if request.method == 'POST':
@@ -236,6 +222,7 @@ def create_task():
         description = request.form.get('description', '')
         due_date = request.form['due_date']
         estimated_hours = float(request.form['estimated_hours'])
+        rrule = request.form.get('rrule', '')
 
         error = None
         if not title:
@@ -244,27 +231,25 @@ def create_task():
             error = 'Due date is required.'
         elif estimated_hours <= 0:
             error = 'Estimated hours must be greater than 0.'
+        else:
+            error, rrule = repeat_rule(rrule, due_date)
 
         if error is None:
-            db = get_db()
-            db.execute(
-                'INSERT INTO tasks (title, description, due_date, estimated_hours) '
-                'VALUES (?, ?, ?, ?)',
-                (title, description, due_date, estimated_hours)
-            )
-            db.commit()
+            storage = get_storage()
+            storage.tasks.create(title, description, due_date, estimated_hours, rrule)
+            storage.commit()
             flash('Task created successfully!', 'success')
-            return redirect(url_for('index'))
+            return redirect(url_for('main.index'))
 
         flash(error, 'error')
 
     return render_template('task_form.html', task=None)
 
 
-@app.route('/tasks/<int:task_id>/edit', methods=('GET', 'POST'))
+@main.route('/tasks/<int:task_id>/edit', methods=('GET', 'POST'))
 def edit_task(task_id):
     """Edit an existing task."""
-    task = get_task(task_id)
+    task = get_storage().tasks.get(task_id)
     if task is None:
         abort(404)
 
@@ -274,6 +259,7 @@ def edit_task(task_id):
         due_date = request.form['due_date']
         estimated_hours = float(request.form['estimated_hours'])
         status = request.form.get('status', 'pending')
+        rrule = request.form.get('rrule', '')
 
         error = None
         if not title:
@@ -282,498 +268,351 @@ def edit_task(task_id):
             error = 'Due date is required.'
         elif estimated_hours <= 0:
             error = 'Estimated hours must be greater than 0.'
+        else:
+            error, rrule = repeat_rule(rrule, due_date)
 
         if error is None:
-            db = get_db()
-            db.execute(
-                'UPDATE tasks SET title = ?, description = ?, due_date = ?, '
-                'estimated_hours = ?, status = ? WHERE id = ?',
-                (title, description, due_date, estimated_hours, status, task_id)
-            )
-            db.commit()
+            storage = get_storage()
+            storage.tasks.update(task_id, title, description, due_date, estimated_hours, status, rrule)
+            storage.commit()
             flash('Task updated successfully!', 'success')
-            return redirect(url_for('index'))
+            return redirect(url_for('main.index'))
 
         flash(error, 'error')
 
     return render_template('task_form.html', task=task)
 
 
-@app.route('/tasks/<int:task_id>/delete', methods=('POST',))
+@main.route('/tasks/<int:task_id>/delete', methods=('POST',))
 def delete_task(task_id):
     """Delete a task."""
-    db = get_db()
-
-    # First delete associated logs
-    db.execute('DELETE FROM task_logs WHERE task_id = ?', (task_id,))
+    storage = get_storage()
+    if storage.tasks.get(task_id, ('id',)) is None:
+        abort(404)
 
-    # Then delete the task
-    db.execute('DELETE FROM tasks WHERE id = ?', (task_id,))
-    db.commit()
+    # The task goes with its logs
+    storage.tasks.delete(task_id)
+    storage.commit()
 
     flash('Task deleted successfully!', 'success')
-    return redirect(url_for('index'))
+    return redirect(url_for('main.index'))
 
 
-@app.route('/tasks/<int:task_id>/log', methods=('GET', 'POST'))
+@main.route('/tasks/<int:task_id>/log', methods=('GET', 'POST'))
 def log_progress(task_id):
     """Log progress for a task."""
-    task = get_task(task_id)
+    storage = get_storage()
+    task = storage.tasks.get(task_id)
     if task is None:
         abort(404)
 
-    logs = get_logs_for_task(task_id)
-
     if request.method == 'POST':
         log_date = request.form.get('log_date', datetime.now().strftime('%Y-%m-%d'))
         hours = float(request.form['hours'])
 
         error = None
-        if hours <= 0:
+        if parse_date(log_date) is None:
+            error = 'Log date must be a date (YYYY-MM-DD).'
+        elif hours <= 0:
             error = 'Hours must be greater than 0.'
         elif hours % 0.5 != 0:
             error = 'Hours must be in increments of 0.5.'
 
         if error is None:
-            db = get_db()
-
-            # Add a new log entry
-            db.execute(
-                'INSERT INTO task_logs (task_id, log_date, hours) VALUES (?, ?, ?)',
-                (task_id, log_date, hours)
-            )
-
-            # Update total hours completed
-            total_hours = sum(log['hours'] for log in logs) + hours
-            db.execute(
-                'UPDATE tasks SET hours_completed = ? WHERE id = ?',
-                (total_hours, task_id)
-            )
-
-            # Check if task is complete
-            if total_hours >= task['estimated_hours']:
-                db.execute(
-                    'UPDATE tasks SET status = ? WHERE id = ?',
-                    ('completed', task_id)
-                )
-
-            db.commit()
+            # Adds the hours to the task's total and the history rollups,
+            # and completes it if they reach the estimate
+            storage.logs.add(task_id, log_date, hours)
+            storage.commit()
             flash('Progress logged successfully!', 'success')
-            return redirect(url_for('index'))
+            return redirect(url_for('main.index'))
 
         flash(error, 'error')
 
-    return render_template('log_form.html', task=task, logs=logs)
+    # Only fetch the page of logs being shown, plus one row to tell
+    # whether there is another page
+    page = max(1, request.args.get('page', 1, type=int))
+    per_page = current_app.config['LOGS_PER_PAGE']
+    logs = storage.logs.for_task(task_id, limit=per_page + 1, offset=(page - 1) * per_page)
+
+    with timed('template'):
+        return render_template(
+            'log_form.html',
+            task=task,
+            logs=logs[:per_page],
+            page=page,
+            has_next=len(logs) > per_page
+        )
 
 
-@app.route('/schedule')
+@main.route('/schedule')
 def schedule():
     """Show the study schedule."""
-    days_ahead = int(request.args.get('days', 7))
-    schedule = calculate_work_schedule(days_ahead)
+    days_ahead = schedule_days()
+    plan = get_work_plan(days_ahead)
 
     # Get task details for reference
-    tasks = {task['id']: task for task in get_all_tasks()}
+    tasks = {task['id']: task for task in get_storage().tasks.all()}
 
     # Get dates in order
     today = datetime.now().date()
     dates = [today + timedelta(days=i) for i in range(days_ahead)]
 
-    return render_template(
-        'schedule.html',
-        schedule=schedule,
-        dates=dates,
-        tasks=tasks
-    )
+    with timed('template'):
+        return render_template(
+            'schedule.html',
+            schedule=plan.schedule,
+            late_tasks=plan.late,
+            dates=dates,
+            tasks=tasks
+        )
 
 
-@app.route('/calendar.ics')
-def calendar_export():
-    """Generate an iCalendar file for tasks and study sessions."""
-    cal = Calendar()
-    cal.add('prodid', '-//Flask Task Scheduler//example.com//')
-    cal.add('version', '2.0')
-
-    # Add tasks as events
-    tasks = get_all_tasks()
-    for task in tasks:
-        event = Event()
-        event.add('summary', f"[DUE] {task['title']}")
-
-        # Due date as an all-day event
-        if isinstance(task['due_date'], str):
-            due_date = datetime.strptime(task['due_date'], '%Y-%m-%d').date()
-        else:
-            due_date = task['due_date']
+@main.route('/history')
+def log_history():
+    """Show the hours logged per day, per week and per task, from the rollups."""
+    config = current_app.config
+    days = min(max(1, request.args.get('days', config['HISTORY_DAYS'], type=int)),
+               history.MAX_HISTORY_DAYS)
+    weeks = min(max(1, request.args.get('weeks', config['HISTORY_WEEKS'], type=int)),
+                history.MAX_HISTORY_WEEKS)
+
+    task = None
+    task_id = request.args.get('task_id', type=int)
+    if task_id is not None:
+        task = get_storage().tasks.get(task_id, ('id', 'title'))
+        if task is None:
+            abort(404)
+
+    with timed('template'):
+        return render_template(
+            'history.html',
+            days=days,
+            weeks=weeks,
+            task=task,
+            **history.log_history(days, weeks, task_id)
+        )
 
-        event.add('dtstart', due_date)
-        event.add('dtend', due_date + timedelta(days=1))
 
-        event.add('description', task['description'])
-        event.add('priority', 5)
+@main.route('/schedule/cache-stats')
+def schedule_cache_stats():
+    """Report schedule cache hit/miss counters for this process."""
+    return jsonify(schedule_cache.stats())
 
-        # Add a reminder
-        from icalendar import Alarm
-        alarm = Alarm()
-        alarm.add('action', 'DISPLAY')
-        alarm.add('description', f"Reminder: {task['title']} is due tomorrow!")
-        alarm.add('trigger', timedelta(days=-1))
-        event.add_component(alarm)
 
-        cal.add_component(event)
+@main.route('/calendar.ics')
+@conditional
+def calendar_export():
+    """Generate an iCalendar file for tasks and study sessions."""
+    return calendar_response(stream_with_context(calendar_stream(get_storage())))
 
-    # Add study sessions as events
-    schedule = calculate_work_schedule(days_ahead=14)
-    for date, day_tasks in schedule.items():
-        for task_info in day_tasks:
-            event = Event()
-            task_title = task_info['title']
-            hours = task_info['hours']
 
-            event.add('summary', f"[STUDY] {task_title} ({hours} hours)")
+def calendar_stream(storage):
+    """
+    Return the calendar as a generator of chunks. The study sessions are
+    planned up front; tasks are read from a cursor of `storage` as it goes.
+    """
+    # Study sessions
+    schedule = get_work_schedule(days_ahead=14)
 
-            # Study session from 9 AM to 9 AM + hours
-            start_time = datetime.combine(date, datetime.min.time()) + timedelta(hours=9)
-            end_time = start_time + timedelta(hours=hours)
+    # Tasks as events, streamed straight from the cursor; a recurring task
+    # is one event with its rule
+    cursor = storage.tasks.for_calendar()
+    tasks = ((task['title'], task['description'], parse_due_date(task['due_date']), task['rrule'])
+             for task in cursor)
 
-            event.add('dtstart', start_time)
-            event.add('dtend', end_time)
+    return timed_iter('serialize', stream_calendar(tasks, schedule))
 
-            cal.add_component(event)
 
-    # Create response with calendar data
-    response = make_response(cal.to_ical())
+def calendar_response(body):
+    """Create the calendar download response around its body."""
+    response = Response(body)
     response.headers['Content-Type'] = 'text/calendar'
     response.headers['Content-Disposition'] = 'attachment; filename=task_schedule.ics'
-
     return response
 
 
-@app.route('/export/pdf')
-def export_pdf():
-    """Export the schedule as PDF using xhtml2pdf as an alternative."""
-    try:
-        # Import xhtml2pdf
-        from xhtml2pdf import pisa
-
-        days_ahead = int(request.args.get('days', 7))
-        schedule = calculate_work_schedule(days_ahead)
-
-        # Get task details for reference
-        tasks = {task['id']: task for task in get_all_tasks()}
-
-        # Get dates in order
-        today = datetime.now().date()
-        dates = [today + timedelta(days=i) for i in range(days_ahead)]
-
-        # Create HTML content
-        html_content = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="UTF-8">
-            <title>Study Schedule</title>
-            <style>
-                @page {{ size: letter; margin: 1cm; }}
-                body {{ font-family: Helvetica, Arial, sans-serif; margin: 20px; font-size: 12px; }}
-                h1 {{ color: #0d6efd; text-align: center; font-size: 24px; }}
-                h2 {{ color: #0d6efd; margin-top: 20px; font-size: 18px; }}
-                h3 {{ font-size: 16px; margin: 0; }}
-                .day {{ 
-                    border: 1px solid #ddd; 
-                    margin-bottom: 15px; 
-                    padding: 10px;
-                }}
-                .day-header {{ 
-                    background-color: #f0f0f0; 
-                    padding: 5px 10px;
-                    margin: -10px -10px 10px -10px;
-                }}
-                .today {{ background-color: #0d6efd; color: white; }}
-                .task {{ margin-bottom: 8px; padding-bottom: 8px; border-bottom: 1px dashed #eee; }}
-                .total {{ margin-top: 10px; font-weight: bold; }}
-                table {{ width: 100%; border-collapse: collapse; margin: 20px 0; }}
-                th, td {{ border: 1px solid #ddd; padding: 8px; text-align: left; }}
-                th {{ background-color: #f0f0f0; }}
-                .footer {{ text-align: center; font-size: 10px; color: #777; margin-top: 30px; }}
-            </style>
-        </head>
-        <body>
-            <h1>Study Schedule</h1>
-            <p style="text-align: center;">Generated on {today.strftime('%A, %B %d, %Y')}</p>
-        """
-
-        # Add each day's schedule
-        html_content += "<h2>Daily Schedule</h2>"
-
-        for date in dates:
-            day_name = date.strftime('%A')
-            day_tasks = schedule[date]
-            is_today = date == today
-            is_weekend = day_name in ['Saturday', 'Sunday']
-
-            html_content += f"""
-            <div class="day">
-                <div class="day-header {'today' if is_today else ''}">
-                    <h3>{'Today - ' if is_today else ''}{date.strftime('%A, %B %d, %Y')}</h3>
-                </div>
-                <div class="day-body">
-            """
-
-            if day_tasks:
-                for task_info in day_tasks:
-                    if task_info['hours'] > 0:
-                        html_content += f"""
-                        <div class="task">
-                            <div><strong>{task_info['title']}</strong></div>
-                            <div>{task_info['hours']} hours</div>
-                        </div>
-                        """
-
-                total_hours = sum(task['hours'] for task in day_tasks)
-                html_content += f"""
-                <div class="total">
-                    Total: {total_hours} hours
-                    {'<span style="color: #d9534f;"> (Heavy workload)</span>' if total_hours > 4 else ''}
-                </div>
-                """
-            else:
-                html_content += "<p>No tasks scheduled for this day.</p>"
-
-            html_content += """
-                </div>
-            </div>
-            """
-
-        # Add task table
-        html_content += """
-        <h2>Task Overview</h2>
-        <table>
-            <thead>
-                <tr>
-                    <th>Task</th>
-                    <th>Due Date</th>
-                    <th>Hours Completed</th>
-                    <th>Total Hours</th>
-                </tr>
-            </thead>
-            <tbody>
-        """
-
-        for task_id, task in tasks.items():
-            due_date = task['due_date']
-            if isinstance(due_date, datetime):
-                due_date = due_date.strftime('%Y-%m-%d')
-            elif isinstance(due_date, date):
-                due_date = due_date.strftime('%Y-%m-%d')
-            html_content += f"""
-            <tr>
-                <td>{task['title']}</td>
-                <td>{due_date}</td>
-                <td>{task['hours_completed']} hours</td>
-                <td>{task['estimated_hours']} hours</td>
-            </tr>
-            """
-
-        html_content += """
-            </tbody>
-        </table>
-
-        <div class="footer">
-            <p>TaskScheduler - Keep Your Studies on Track</p>
-        </div>
-        </body>
-        </html>
-        """
-
-        # Create a temporary file for the output PDF
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
-        temp_filename = temp_file.name
-        temp_file.close()
-
-        # Convert HTML to PDF
-        with open(temp_filename, "wb") as pdf_file:
-            pisa_status = pisa.CreatePDF(html_content, dest=pdf_file)
-
-        # Check if conversion was successful
-        if pisa_status.err:
-            # If PDF conversion fails, provide HTML instead
-            response = make_response(html_content)
-            response.headers["Content-Type"] = "text/html"
-            response.headers["Content-Disposition"] = "attachment; filename=study_schedule.html"
-            return response
-
-        # Send the PDF file
-        response = send_file(
-            temp_filename,
-            as_attachment=True,
-            download_name='study_schedule.pdf',
-            mimetype='application/pdf'
+class ScheduleExport:
+    """
+    The data and markup for one schedule export.
+
+    The schedule and task list are gathered once, and the page is rendered
+    once from the compiled export template, however many renderers or
+    fallbacks end up using it.
+    """
+
+    template_name = 'schedule_pdf.html'
+
+    def __init__(self, days_ahead):
+        self.days_ahead = days_ahead
+        self._context = None
+        self._html = None
+
+    @property
+    def context(self):
+        """The template context: the schedule, its dates and every task."""
+        if self._context is None:
+            today = datetime.now().date()
+            self._context = {
+                'schedule': get_work_schedule(self.days_ahead),
+                'dates': [today + timedelta(days=i) for i in range(self.days_ahead)],
+                'tasks': get_storage().tasks.all(),
+                'today': today,
+            }
+        return self._context
+
+    def template_context(self):
+        """Return the context with Flask's template globals added."""
+        context = dict(self.context)
+        current_app.update_template_context(context)
+        return context
+
+    @property
+    def html(self):
+        """The export rendered to a string, as the PDF renderers need it."""
+        if self._html is None:
+            with timed('template'):
+                template = current_app.jinja_env.get_template(self.template_name)
+                self._html = template.render(self.template_context())
+        return self._html
+
+    def stream(self):
+        """Yield the export HTML in chunks, reusing the rendered page if there is one."""
+        if self._html is not None:
+            yield self._html
+            return
+        template = current_app.jinja_env.get_template(self.template_name)
+        yield from template.generate(self.template_context())
+
+
+# PDF rendering
+def get_pdf_jobs():
+    """Return this process's background PDF renderer."""
+    pdf_jobs = current_app.extensions.get('pdf_jobs')
+    if pdf_jobs is None:
+        pdf_jobs = current_app.extensions['pdf_jobs'] = PDFJobs(
+            workers=current_app.config['PDF_WORKERS'],
+            cache_bytes=current_app.config['PDF_CACHE_BYTES'],
+            spool_bytes=current_app.config['PDF_SPOOL_BYTES']
         )
+    return pdf_jobs
 
-        # Clean up the temporary file after sending
-        @after_this_request
-        def cleanup(response):
-            try:
-                os.unlink(temp_filename)
-            except:
-                pass
-            return response
 
-        return response
+def submit_schedule_pdf(export):
+    """
+    Submit the PDF of a schedule export to the worker pool, or join the
+    render already running for it. The export is only rendered to HTML if
+    the PDF isn't cached. Returns None if no renderer is installed.
+    """
+    renderer = available_renderer()
+    if renderer is None:
+        return None
 
-    except ImportError:
-        # If xhtml2pdf is not installed, try WeasyPrint
-        try:
-            from weasyprint import HTML
+    key = ('schedule', tenant_id(), export.days_ahead, datetime.now().date(),
+           get_data_version(), renderer)
+    return get_pdf_jobs().submit(key, lambda: export.html, renderer)
 
-            days_ahead = int(request.args.get('days', 7))
-            schedule = calculate_work_schedule(days_ahead)
 
-            # Get task details for reference
-            tasks = {task['id']: task for task in get_all_tasks()}
+def get_own_pdf_job(job_id):
+    """Return one of the current tenant's PDF jobs by id, or None."""
+    job = get_pdf_jobs().get_job(job_id)
+    # Keys are ('schedule', tenant, ...), see submit_schedule_pdf()
+    if job is None or job.key[1] != tenant_id():
+        return None
+    return job
 
-            # Get dates in order
-            today = datetime.now().date()
-            dates = [today + timedelta(days=i) for i in range(days_ahead)]
-
-            # Create a simple HTML structure directly
-            html_content = f"""
-            <!DOCTYPE html>
-            <html>
-            <head>
-                <meta charset="UTF-8">
-                <title>Study Schedule</title>
-                <style>
-                    body {{ font-family: Arial, sans-serif; margin: 20px; }}
-                    h1 {{ color: #0d6efd; text-align: center; }}
-                    h2 {{ color: #0d6efd; margin-top: 20px; }}
-                    .day {{ 
-                        border: 1px solid #ddd; 
-                        margin-bottom: 15px; 
-                        padding: 10px;
-                        border-radius: 5px;
-                    }}
-                    .day-header {{ 
-                        background-color: #f0f0f0; 
-                        padding: 5px 10px;
-                        margin: -10px -10px 10px -10px;
-                        border-radius: 5px 5px 0 0;
-                    }}
-                    .today {{ background-color: #0d6efd; color: white; }}
-                    .task {{ margin-bottom: 8px; padding-bottom: 8px; border-bottom: 1px dashed #eee; }}
-                    .total {{ margin-top: 10px; font-weight: bold; }}
-                    table {{ width: 100%; border-collapse: collapse; margin: 20px 0; }}
-                    th, td {{ border: 1px solid #ddd; padding: 8px; text-align: left; }}
-                    th {{ background-color: #f0f0f0; }}
-                </style>
-            </head>
-            <body>
-                <h1>Study Schedule</h1>
-                <p style="text-align: center;">Generated on {today.strftime('%A, %B %d, %Y')}</p>
-            """
-
-            # Add each day's schedule
-            for date in dates:
-                day_name = date.strftime('%A')
-                day_tasks = schedule[date]
-                is_today = date == today
-
-                html_content += f"""
-                <div class="day">
-                    <div class="day-header {'today' if is_today else ''}">
-                        <h3>{'Today - ' if is_today else ''}{date.strftime('%A, %B %d, %Y')}</h3>
-                    </div>
-                    <div class="day-body">
-                """
-
-                if day_tasks:
-                    for task_info in day_tasks:
-                        if task_info['hours'] > 0:
-                            html_content += f"""
-                            <div class="task">
-                                <div><strong>{task_info['title']}</strong></div>
-                                <div>{task_info['hours']} hours</div>
-                            </div>
-                            """
-
-                    total_hours = sum(task['hours'] for task in day_tasks)
-                    html_content += f"""
-                    <div class="total">
-                        Total: {total_hours} hours
-                        {'<span style="color: #d9534f;"> (Heavy workload)</span>' if total_hours > 4 else ''}
-                    </div>
-                    """
-                else:
-                    html_content += "<p>No tasks scheduled for this day.</p>"
-
-                html_content += """
-                    </div>
-                </div>
-                """
-
-            html_content += """
-            </body>
-            </html>
-            """
-
-            # Create a temporary file
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
-            temp_filename = temp_file.name
-            temp_file.close()
-
-            # Generate PDF
-            HTML(string=html_content).write_pdf(temp_filename)
-
-            # Send the file as response
-            response = send_file(
-                temp_filename,
-                as_attachment=True,
-                download_name='study_schedule.pdf',
-                mimetype='application/pdf'
-            )
-
-            # Clean up the temporary file after sending
-            @after_this_request
-            def cleanup(response):
-                try:
-                    os.unlink(temp_filename)
-                except:
-                    pass
-                return response
-
-            return response
 
+def pdf_response(pdf):
+    """Send PDF bytes as the study schedule download."""
+    response = Response(pdf, mimetype='application/pdf')
+    response.headers['Content-Disposition'] = 'attachment; filename=study_schedule.pdf'
+    return response
+
+
+def html_export_response(body):
+    """
+    Send the export HTML, for when no PDF can be made. It is never stored
+    or revalidated, so the next request tries to make the PDF again.
+    """
+    response = Response(body)
+    response.headers["Content-Type"] = "text/html; charset=utf-8"
+    response.headers["Content-Disposition"] = "attachment; filename=study_schedule.html"
+    response.cache_control.no_store = True
+    return response
+
+
+def pdf_job_json(job):
+    """Describe a PDF job for the job API."""
+    return {
+        'id': job.id,
+        'status': job.status,
+        'error': job.error,
+        'status_url': url_for('main.pdf_job_status', job_id=job.id),
+        'download_url': url_for('main.download_pdf_job', job_id=job.id),
+    }
+
+
+@main.route('/export/pdf')
+@conditional
+def export_pdf():
+    """Export the schedule as PDF, rendered by the background worker pool."""
+    export = ScheduleExport(schedule_days())
+
+    job = submit_schedule_pdf(export)
+    if job is not None:
+        try:
+            with timed('serialize'):
+                pdf = get_pdf_jobs().result(job, timeout=current_app.config['PDF_RENDER_TIMEOUT'])
+            return pdf_response(pdf)
         except Exception as e:
             print(f"PDF generation error: {e}")
 
-            # If both PDF methods fail, return HTML directly
-            days_ahead = int(request.args.get('days', 7))
-            schedule = calculate_work_schedule(days_ahead)
+    # If PDF conversion fails, stream the same page as HTML instead
+    return html_export_response(stream_with_context(export.stream()))
 
-            # Get task details for reference
-            tasks = {task['id']: task for task in get_all_tasks()}
 
-            # Get dates in order
-            today = datetime.now().date()
-            dates = [today + timedelta(days=i) for i in range(days_ahead)]
+@main.route('/export/pdf/jobs', methods=('POST',))
+def submit_pdf_job():
+    """Start rendering the schedule PDF in the background."""
+    job = submit_schedule_pdf(ScheduleExport(schedule_days()))
+    if job is None:
+        return jsonify(error='No PDF renderer is installed.'), 503
+
+    return jsonify(pdf_job_json(job)), 202, {
+        'Location': url_for('main.pdf_job_status', job_id=job.id)
+    }
+
+
+@main.route('/export/pdf/jobs/<job_id>')
+def pdf_job_status(job_id):
+    """Report the status of a background PDF render."""
+    job = get_own_pdf_job(job_id)
+    if job is None:
+        return jsonify(error='Unknown job.'), 404
+    return jsonify(pdf_job_json(job))
+
+
+@main.route('/export/pdf/jobs/<job_id>/download')
+def download_pdf_job(job_id):
+    """Download the PDF of a finished background render."""
+    pdf_jobs = get_pdf_jobs()
+    job = get_own_pdf_job(job_id)
+    if job is None:
+        return jsonify(error='Unknown job.'), 404
 
-            # Render template to HTML
-            html_content = render_template(
-                'schedule_pdf.html',
-                schedule=schedule,
-                dates=dates,
-                tasks=tasks
-            )
+    status = job.status
+    if status in ('pending', 'running'):
+        return jsonify(pdf_job_json(job)), 202
+    if status == 'failed':
+        return jsonify(pdf_job_json(job)), 500
 
-            response = make_response(html_content)
-            response.headers["Content-Type"] = "text/html"
-            response.headers["Content-Disposition"] = "attachment; filename=study_schedule.html"
-            return response
+    pdf = pdf_jobs.get_cached(job.key)
+    if pdf is None:
+        return jsonify(error='The PDF has expired, submit the job again.'), 410
+    return pdf_response(pdf)
 
 
 # Error handling
-@app.errorhandler(HTTPException)
+@main.app_errorhandler(HTTPException)
 def handle_exception(e):
     """Handle HTTP exceptions."""
     return render_template('error.html', error=e), e.code
@@ -781,7 +620,7 @@ def handle_exception(e):
 
 # Function to check and initialize the database on startup
 def check_db_initialized():
-    if not os.path.exists(app.config['DATABASE']):
+    if not os.path.exists(current_app.config['DATABASE']):
         print("Database not found, initializing now...")
         try:
             init_db()
@@ -794,6 +633,7 @@ def check_db_initialized():
 
 # Run the application
 if __name__ == '__main__':
+    app = create_app()
     with app.app_context():
         check_db_initialized()
     app.run(debug=True)
\ No newline at end of file
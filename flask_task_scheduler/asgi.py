@@ -0,0 +1,389 @@
+"""
+ASGI entry point, for serving many slow or long-polling clients from one
+process:
+
+    uvicorn asgi:application --host 0.0.0.0 --port 8000
+
+Every request is handled on the event loop, and all blocking work
+(database queries, planning, template rendering) runs on a bounded pool
+of ASGI_THREADS threads, so a slow request never holds up the loop.
+
+The calendar and PDF exports have their own async handlers. The calendar
+is sent as it is generated, and only holds a thread while it produces the
+next batch of events, not while a slow client reads it. The PDF export
+awaits the render in the PDF process pool without holding a thread at
+all. Every other route, including the schedule views and the JSON API,
+runs the Flask view on the thread pool.
+"""
+import asyncio
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from flask import Response
+
+import app as app_module
+from caching import is_not_modified, request_validators, set_validators
+from storage import open_storage
+
+app = app_module.create_app()
+
+# Request bodies larger than this are spooled to a temporary file
+BODY_SPOOL_BYTES = 1024 * 1024
+
+# Chunks of a streamed response buffered ahead of a slow client
+STREAM_QUEUE_SIZE = 8
+
+# Calendar events generated per trip to the thread pool
+CALENDAR_EVENTS_PER_CHUNK = 256
+
+_executor = None
+
+
+def get_executor():
+    """Return the thread pool that blocking work runs on."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=app.config['ASGI_THREADS'],
+                                       thread_name_prefix='asgi')
+    return _executor
+
+
+async def run_blocking(fn, *args):
+    """Run a blocking call on the thread pool."""
+    return await asyncio.get_running_loop().run_in_executor(get_executor(), fn, *args)
+
+
+class EarlyResponse(Exception):
+    """Ends a request with a response from a before_request hook."""
+
+    def __init__(self, response):
+        super().__init__(response)
+        self.response = response
+
+
+class InRequest:
+    """
+    Runs the blocking steps of an async handler on the thread pool, each
+    inside a Flask request context for `environ`. The steps share one app
+    context, so what the before_request hooks put on `g` (the signed-in
+    user, the request's profile) carries over from one to the next.
+    """
+
+    def __init__(self, environ):
+        self.environ = environ
+        self.app_context = app.app_context()
+        self.preprocessed = False
+
+    async def run(self, fn):
+        """
+        Run `fn`, after the app's before_request hooks on the first step.
+        Raises EarlyResponse if a hook answers the request, with a redirect
+        to the sign-in page, say.
+        """
+        def run():
+            with self.app_context, app.request_context(self.environ):
+                if not self.preprocessed:
+                    self.preprocessed = True
+                    rv = app.preprocess_request()
+                    if rv is not None:
+                        raise EarlyResponse(app.finalize_request(rv))
+                return fn()
+        return await run_blocking(run)
+
+    async def finish(self, response):
+        """Return the response once the after_request hooks have seen it, as Flask does."""
+        return await self.run(lambda: app.finalize_request(response))
+
+
+# ASGI <-> WSGI
+def wsgi_environ(scope, body):
+    """Build a WSGI environ for an ASGI HTTP scope."""
+    script_name = scope.get('root_path', '')
+    path = scope['path']
+    if script_name and path.startswith(script_name):
+        path = path[len(script_name):]
+    server = scope.get('server') or ('localhost', 80)
+
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': script_name.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1] or 80),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        # The whole body is buffered, so it can be read to the end even
+        # without a Content-Length (a chunked upload)
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        if name in environ:
+            value = environ[name] + ',' + value
+        environ[name] = value
+    return environ
+
+
+async def read_body(receive):
+    """Read the whole request body into a (spooled) file."""
+    body = tempfile.SpooledTemporaryFile(max_size=BODY_SPOOL_BYTES)
+    while True:
+        message = await receive()
+        if message['type'] != 'http.request':
+            break
+        body.write(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    body.seek(0)
+    return body
+
+
+def response_start(status, headers):
+    """Return the ASGI start message for a status code and (name, value) headers."""
+    return {
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                    for name, value in headers],
+    }
+
+
+async def send_response(send, response, body=None):
+    """
+    Send a complete (not streamed) Flask response, and close it, as a WSGI
+    server would, so its call_on_close callbacks (the request metrics) run.
+    """
+    try:
+        await send(response_start(response.status_code, response.headers.to_wsgi_list()))
+        await send({
+            'type': 'http.response.body',
+            'body': response.get_data() if body is None else body,
+        })
+    finally:
+        response.close()
+
+
+async def serve_wsgi(environ, send):
+    """
+    Run the Flask app for a request on the thread pool and send what it
+    produces as it comes. A bounded queue between the two keeps a slow
+    client from making the thread buffer the whole response.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+
+    def put(message):
+        asyncio.run_coroutine_threadsafe(queue.put(message), loop).result()
+
+    def run():
+        def start_response(status, headers, exc_info=None):
+            put(('start', int(status.split(' ', 1)[0]), headers))
+            return lambda data: put(('body', data))
+
+        try:
+            result = app(environ, start_response)
+            try:
+                for chunk in result:
+                    if chunk:
+                        put(('body', chunk))
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+        except BaseException as e:
+            put(('error', e))
+        else:
+            put(('end', None))
+
+    loop.run_in_executor(get_executor(), run)
+
+    kind = start = None
+    started = False
+    try:
+        while True:
+            kind, *message = await queue.get()
+            if kind == 'start':
+                start = message
+                continue
+            if kind == 'error':
+                raise message[0]
+            if not started:
+                await send(response_start(*start))
+                started = True
+            if kind == 'end':
+                await send({'type': 'http.response.body', 'body': b''})
+                return
+            await send({'type': 'http.response.body', 'body': message[0], 'more_body': True})
+    finally:
+        # If the client went away, let the thread run to completion
+        if kind not in ('end', 'error'):
+            asyncio.ensure_future(drain(queue))
+
+
+async def drain(queue):
+    while True:
+        kind, *_ = await queue.get()
+        if kind in ('end', 'error'):
+            return
+
+
+# Async handlers
+def next_chunk(body, events=CALENDAR_EVENTS_PER_CHUNK):
+    """Return the next batch of a calendar body's chunks, joined."""
+    return b''.join(islice(body, events))
+
+
+async def calendar_export(environ, send):
+    """Stream the iCalendar export, generating it a batch of events at a time."""
+    def start():
+        etag, last_modified = request_validators()
+        if is_not_modified(etag, last_modified):
+            response = set_validators(Response(status=304), etag, last_modified)
+            return app.finalize_request(response), None
+
+        # The cursor outlives this request context, so it gets a storage
+        # with a connection of its own rather than the context's
+        storage = open_storage()
+        try:
+            body = app_module.calendar_stream(storage)
+        except Exception:
+            storage.close()
+            raise
+        # The headers are sent before the body is generated, as with a
+        # streamed response under WSGI
+        response = app_module.calendar_response(None)
+        return app.finalize_request(set_validators(response, etag, last_modified)), (storage, body)
+
+    response, stream = await InRequest(environ).run(start)
+    if stream is None:
+        await send_response(send, response)
+        return
+
+    storage, body = stream
+
+    def close():
+        body.close()
+        storage.close()
+        # Only now is the request done, as far as its metrics go
+        response.close()
+
+    try:
+        await send(response_start(response.status_code, response.headers.to_wsgi_list()))
+        while True:
+            chunk = await run_blocking(next_chunk, body)
+            if not chunk:
+                break
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        await run_blocking(close)
+
+
+async def export_pdf(environ, send):
+    """Export the schedule PDF, awaiting the render without holding a thread."""
+    def start():
+        etag, last_modified = request_validators()
+        if is_not_modified(etag, last_modified):
+            return (etag, last_modified), None, None
+        export = app_module.ScheduleExport(app_module.schedule_days())
+        return (etag, last_modified), export, app_module.submit_schedule_pdf(export)
+
+    steps = InRequest(environ)
+    validators, export, job = await steps.run(start)
+    if export is None:
+        response = set_validators(Response(status=304), *validators)
+        await send_response(send, await steps.finish(response))
+        return
+
+    pdf = None
+    if job is not None:
+        future = job.future
+        try:
+            if future is not None:
+                # shield() keeps a timeout here from cancelling a render
+                # other requests may be waiting for
+                pdf = await asyncio.wait_for(
+                    asyncio.shield(asyncio.wrap_future(future)),
+                    timeout=app.config['PDF_RENDER_TIMEOUT']
+                )
+            else:
+                with app.app_context():
+                    pdf = app_module.get_pdf_jobs().result(job)
+        except Exception:
+            app.logger.exception('PDF generation error')
+
+    if pdf is not None:
+        response = app_module.pdf_response(pdf)
+    else:
+        # Fall back to the export's HTML
+        response = app_module.html_export_response(await steps.run(lambda: export.html))
+    await send_response(send, await steps.finish(set_validators(response, *validators)))
+
+
+ASYNC_ROUTES = {
+    '/calendar.ics': calendar_export,
+    '/export/pdf': export_pdf,
+}
+
+
+async def application(scope, receive, send):
+    """The ASGI application."""
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    environ = wsgi_environ(scope, await read_body(receive))
+    handler = ASYNC_ROUTES.get(environ['PATH_INFO'])
+    if handler is None or scope['method'] != 'GET':
+        await serve_wsgi(environ, send)
+        return
+
+    started = False
+
+    async def send_message(message):
+        nonlocal started
+        started = started or message['type'] == 'http.response.start'
+        await send(message)
+
+    try:
+        await handler(environ, send_message)
+    except EarlyResponse as e:
+        await send_response(send, e.response)
+    except Exception:
+        app.logger.exception('Exception on %s [GET]', environ['PATH_INFO'])
+        if not started:
+            await send_response(send, Response('Internal Server Error', status=500))
+
+
+async def lifespan(receive, send):
+    """Start the thread pool with the server, and stop it and the PDF workers after."""
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            get_executor()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            global _executor
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+                _executor = None
+            with app.app_context():
+                app_module.get_pdf_jobs().shutdown()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
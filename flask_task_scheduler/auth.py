@@ -0,0 +1,99 @@
+"""
+Sign-up, sign-in and sign-out for multi-tenant mode.
+
+The signed-in user is loaded into g.user before every request. With
+MULTI_TENANT enabled, pages redirect anonymous visitors to the sign-in
+form and the JSON API answers 401; API clients may also send their
+username and password with HTTP Basic authentication.
+"""
+from flask import (
+    Blueprint, current_app, flash, g, jsonify, redirect, render_template,
+    request, session, url_for
+)
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from db import get_users_db
+from tenants import get_user
+
+auth = Blueprint('auth', __name__, url_prefix='/auth')
+
+# Endpoints anyone can reach
+PUBLIC_ENDPOINTS = ('auth.register', 'auth.login', 'static', 'metrics_endpoint')
+
+
+@auth.before_app_request
+def load_user():
+    """Load the signed-in user, and make sure there is one in multi-tenant mode."""
+    g.user = None
+    if not current_app.config['MULTI_TENANT']:
+        return None
+
+    user_id = session.get('user_id')
+    if user_id is not None:
+        g.user = get_user(user_id=user_id)
+    elif request.authorization is not None:
+        user = get_user(username=request.authorization.username)
+        if user is not None and check_password_hash(user['password'], request.authorization.password or ''):
+            g.user = user
+
+    if g.user is None and request.endpoint not in PUBLIC_ENDPOINTS:
+        if request.blueprint == 'api':
+            return jsonify(error='Sign in required.'), 401, {'WWW-Authenticate': 'Basic'}
+        return redirect(url_for('auth.login', next=request.full_path.rstrip('?')))
+    return None
+
+
+@auth.route('/register', methods=('GET', 'POST'))
+def register():
+    """Create an account."""
+    if request.method == 'POST':
+        username = request.form['username'].strip()
+        password = request.form['password']
+
+        error = None
+        if not username:
+            error = 'Username is required.'
+        elif not password:
+            error = 'Password is required.'
+        elif get_user(username=username) is not None:
+            error = f'User {username} is already registered.'
+
+        if error is None:
+            db = get_users_db()
+            db.execute(
+                'INSERT INTO users (username, password) VALUES (?, ?)',
+                (username, generate_password_hash(password))
+            )
+            db.commit()
+            flash('Account created, please sign in.', 'success')
+            return redirect(url_for('auth.login'))
+
+        flash(error, 'error')
+
+    return render_template('auth/register.html')
+
+
+@auth.route('/login', methods=('GET', 'POST'))
+def login():
+    """Sign in."""
+    if request.method == 'POST':
+        user = get_user(username=request.form['username'].strip())
+        if user is None or not check_password_hash(user['password'], request.form['password']):
+            flash('Incorrect username or password.', 'error')
+        else:
+            session.clear()
+            session['user_id'] = user['id']
+            next_url = request.args.get('next', '')
+            # Only follow local paths
+            if not next_url.startswith('/') or next_url.startswith('//'):
+                next_url = url_for('main.index')
+            return redirect(next_url)
+
+    return render_template('auth/login.html')
+
+
+@auth.route('/logout')
+def logout():
+    """Sign out."""
+    session.clear()
+    return redirect(url_for('auth.login'))
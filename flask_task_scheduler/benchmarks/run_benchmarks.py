@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""
+Benchmark the scheduler, dashboard and export endpoints.
+
+Generates synthetic SQLite databases of the requested sizes (tasks with log
+histories), then times the planner and each route through Flask's test
+client over several planning horizons. For every measurement it reports
+p50/p95 latency, SQL statements per call and peak Python memory, and writes
+the results as JSON so two runs can be compared:
+
+    python benchmarks/run_benchmarks.py --sizes 100,10000 -o before.json
+    python benchmarks/run_benchmarks.py --sizes 100,10000 -o after.json
+    python benchmarks/run_benchmarks.py --compare before.json after.json
+
+With --cold-start it instead times how long a fresh interpreter takes to
+import the app and create it, and exits with an error if that is over the
+target or if a PDF renderer or NumPy was imported on the way.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DEFAULT_SIZES = '100,10000'
+DEFAULT_HORIZONS = '7,14,30,365'
+DEFAULT_TARGETS = 'planner,index,schedule,calendar_export,export_pdf,history'
+
+# Cold start: importing the app and creating it must stay under this
+COLD_START_TARGET_MS = 1000
+
+# Modules that must only be imported when first needed
+LAZY_MODULES = ('weasyprint', 'xhtml2pdf', 'icalendar', 'numpy', 'dateutil')
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COLD_START_SCRIPT = '''
+import json, sys
+from app import create_app
+create_app({'DATABASE': sys.argv[1]})
+print(json.dumps([name for name in sys.argv[2:] if name in sys.modules]))
+'''
+
+
+# Synthetic data
+def generate_database(app, path, size, seed=0):
+    """Create a database at `path` with `size` tasks and their log histories."""
+    from db import close_db, init_db
+
+    if os.path.exists(path):
+        os.unlink(path)
+
+    # Let the app create its own schema
+    app.config['DATABASE'] = path
+    with app.app_context():
+        init_db()
+        close_db()
+
+    rng = random.Random(seed)
+    today = date.today()
+    tasks = []
+    logs = []
+
+    for task_id in range(1, size + 1):
+        estimated = rng.choice([0.5, 1, 2, 3, 5, 8, 13, 20, 40])
+        due_date = today + timedelta(days=rng.randint(-14, 400))
+
+        # Log histories of up to a few dozen entries, some tasks finished
+        completed = 0
+        for _ in range(rng.choice([0, 0, 1, 2, 5, 10, 30])):
+            hours = rng.choice([0.5, 1, 1.5, 2])
+            log_date = due_date - timedelta(days=rng.randint(0, 60))
+            logs.append((task_id, log_date.isoformat(), hours))
+            completed += hours
+
+        status = 'completed' if completed >= estimated else 'pending'
+        tasks.append((task_id, f'Task {task_id}', f'Synthetic task number {task_id}',
+                      due_date.isoformat(), estimated, completed, status))
+
+    db = sqlite3.connect(path)
+    with db:
+        db.executemany(
+            'INSERT INTO tasks (id, title, description, due_date, estimated_hours, '
+            'hours_completed, status) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            tasks
+        )
+        db.executemany(
+            'INSERT INTO task_logs (task_id, log_date, hours) VALUES (?, ?, ?)',
+            logs
+        )
+        # The rollups the app keeps as it writes logs
+        db.execute(
+            'INSERT INTO task_log_daily (task_id, day, hours, entries) '
+            'SELECT task_id, log_date, SUM(hours), COUNT(*) FROM task_logs GROUP BY task_id, log_date'
+        )
+        db.execute(
+            "INSERT INTO task_log_weekly (task_id, week, hours, entries) "
+            "SELECT task_id, date(day, 'weekday 0', '-6 days'), SUM(hours), SUM(entries) "
+            "FROM task_log_daily GROUP BY task_id, date(day, 'weekday 0', '-6 days')"
+        )
+    db.close()
+    return len(tasks), len(logs)
+
+
+def clear_materialized(path):
+    """Mark the materialized schedule out of date, so cold runs plan from scratch."""
+    db = sqlite3.connect(path)
+    with db:
+        db.execute('DELETE FROM schedule_state')
+    db.close()
+
+
+# Measurement helpers
+def percentile(samples, fraction):
+    """Return the nearest-rank percentile of a list of samples."""
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+class QueryCounter:
+    """Counts SQL statements run on the request's database connection."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, statement):
+        self.count += 1
+
+
+def measure(run, repeat, counter):
+    """Time `run` `repeat` times, then once more under tracemalloc."""
+    timings = []
+    queries = []
+    status = None
+
+    for _ in range(repeat):
+        counter.count = 0
+        started = time.perf_counter()
+        status = run()
+        timings.append((time.perf_counter() - started) * 1000)
+        queries.append(counter.count)
+
+    # Memory is measured separately, tracemalloc skews the timings
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'p50_ms': round(percentile(timings, 0.50), 3),
+        'p95_ms': round(percentile(timings, 0.95), 3),
+        'mean_ms': round(sum(timings) / len(timings), 3),
+        'queries': max(queries),
+        'peak_kib': round(peak / 1024, 1),
+        'status': status,
+    }
+
+
+# Benchmarks
+def route_path(target, horizon):
+    """Return the URL for a route target, or None if it has no horizon."""
+    if target == 'index':
+        return '/'
+    if target == 'schedule':
+        return f'/schedule?days={horizon}'
+    if target == 'calendar_export':
+        return '/calendar.ics'
+    if target == 'export_pdf':
+        return f'/export/pdf?days={horizon}'
+    if target == 'history':
+        return '/history?weeks=52'
+    raise ValueError(f'Unknown benchmark target: {target}')
+
+
+def run_benchmarks(args):
+    import app as app_module
+    from db import get_db
+    from models import calculate_work_schedule
+
+    # Everything the app writes stays in the data directory, and there is
+    # no background re-planning while requests are being timed
+    os.makedirs(args.data_dir, exist_ok=True)
+    app = app_module.create_app({
+        'TESTING': True,
+        'SCHEDULE_REFRESHER': False,
+        'DATABASE': os.path.join(args.data_dir, 'bench_app.db'),
+        'QUERY_STATS_DATABASE': os.path.join(args.data_dir, 'bench_query_stats.db'),
+        'TENANT_FOLDER': os.path.join(args.data_dir, 'bench_tenants'),
+    })
+
+    counter = QueryCounter()
+
+    # Count statements on every request's connection
+    @app.before_request
+    def trace_queries():
+        get_db().set_trace_callback(counter)
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    horizons = [int(horizon) for horizon in args.horizons.split(',')]
+    targets = args.targets.split(',')
+
+    results = []
+    for size in sizes:
+        path = os.path.join(args.data_dir, f'bench_{size}.db')
+        task_count, log_count = generate_database(app, path, size, seed=args.seed)
+        print(f'# {task_count} tasks, {log_count} logs ({path})', file=sys.stderr)
+        app.config['DATABASE'] = path
+        client = app.test_client()
+
+        for target in targets:
+            # The dashboard, calendar and history use fixed horizons
+            target_horizons = horizons
+            if target in ('index', 'calendar_export', 'history'):
+                target_horizons = [None]
+
+            for horizon in target_horizons:
+                for mode in ('cold', 'warm'):
+                    def run():
+                        if mode == 'cold':
+                            app_module.schedule_cache.entries.clear()
+                            clear_materialized(path)
+                        if target == 'planner':
+                            with app.app_context():
+                                db = get_db()
+                                db.set_trace_callback(counter)
+                                if mode == 'cold':
+                                    calculate_work_schedule(horizon)
+                                else:
+                                    app_module.get_work_schedule(horizon)
+                            return None
+                        # Streamed responses (the calendar, the HTML
+                        # export) do most of their work as the body is read
+                        response = client.get(route_path(target, horizon))
+                        response.get_data()
+                        response.close()
+                        return response.status_code
+
+                    # Prime caches for warm runs
+                    if mode == 'warm':
+                        run()
+
+                    result = {
+                        'size': size,
+                        'target': target,
+                        'horizon': horizon,
+                        'mode': mode,
+                    }
+                    result.update(measure(run, args.repeat, counter))
+                    results.append(result)
+                    print(format_result(result), file=sys.stderr)
+
+    return {
+        'meta': {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeat': args.repeat,
+            'seed': args.seed,
+        },
+        'results': results,
+    }
+
+
+def run_cold_start(args):
+    """
+    Time importing and creating the app in fresh interpreters, and list any
+    modules that should have been left for later but were imported.
+    """
+    os.makedirs(args.data_dir, exist_ok=True)
+    path = os.path.join(args.data_dir, 'cold_start.db')
+    command = [sys.executable, '-c', COLD_START_SCRIPT, path, *LAZY_MODULES]
+
+    # The first run creates the database, which isn't part of a cold start
+    subprocess.run(command, cwd=APP_DIR, check=True, capture_output=True)
+
+    timings = []
+    imported = set()
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        output = subprocess.run(command, cwd=APP_DIR, check=True,
+                                capture_output=True, text=True).stdout
+        timings.append((time.perf_counter() - started) * 1000)
+        imported.update(json.loads(output.strip().splitlines()[-1]))
+
+    return {
+        'p50_ms': round(percentile(timings, 0.50), 3),
+        'p95_ms': round(percentile(timings, 0.95), 3),
+        'target_ms': args.max_cold_start_ms,
+        'imported': sorted(imported),
+    }
+
+
+# Reporting
+def result_key(result):
+    return (result['size'], result['target'], result['horizon'], result['mode'])
+
+
+def format_result(result):
+    horizon = '-' if result['horizon'] is None else result['horizon']
+    return (f"{result['size']:>7} {result['target']:<16} {horizon!s:>4} {result['mode']:<5} "
+            f"p50 {result['p50_ms']:>9.2f} ms  p95 {result['p95_ms']:>9.2f} ms  "
+            f"{result['queries']:>4} queries  {result['peak_kib']:>10.1f} KiB")
+
+
+def compare(before_path, after_path):
+    """Print p50/p95 changes between two result files."""
+    with open(before_path) as f:
+        before = {result_key(r): r for r in json.load(f)['results']}
+    with open(after_path) as f:
+        after = json.load(f)['results']
+
+    for result in after:
+        old = before.get(result_key(result))
+        if old is None:
+            continue
+        changes = []
+        for field in ('p50_ms', 'p95_ms', 'queries', 'peak_kib'):
+            if old[field]:
+                change = (result[field] - old[field]) / old[field] * 100
+                changes.append(f'{field} {old[field]} -> {result[field]} ({change:+.1f}%)')
+            else:
+                changes.append(f'{field} {old[field]} -> {result[field]}')
+        horizon = '-' if result['horizon'] is None else result['horizon']
+        print(f"{result['size']:>7} {result['target']:<16} {horizon!s:>4} {result['mode']:<5} "
+              + '  '.join(changes))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default=DEFAULT_SIZES,
+                        help=f'comma-separated task counts (default {DEFAULT_SIZES})')
+    parser.add_argument('--horizons', default=DEFAULT_HORIZONS,
+                        help=f'comma-separated planning horizons in days (default {DEFAULT_HORIZONS})')
+    parser.add_argument('--targets', default=DEFAULT_TARGETS,
+                        help=f'comma-separated things to time (default {DEFAULT_TARGETS})')
+    parser.add_argument('--repeat', type=int, default=10,
+                        help='timed runs per measurement (default 10)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='random seed for the synthetic data')
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'task_scheduler_bench'),
+                        help='where to write the synthetic databases')
+    parser.add_argument('-o', '--output', help='write JSON results to this file')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'),
+                        help='compare two JSON result files instead of running')
+    parser.add_argument('--cold-start', action='store_true',
+                        help='time app startup in fresh interpreters instead')
+    parser.add_argument('--max-cold-start-ms', type=float, default=COLD_START_TARGET_MS,
+                        help=f'fail if p95 cold start is slower (default {COLD_START_TARGET_MS})')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    if args.cold_start:
+        result = run_cold_start(args)
+        print(json.dumps(result, indent=2))
+        if result['imported']:
+            sys.exit(f"Imported at startup: {', '.join(result['imported'])}")
+        if result['p95_ms'] > args.max_cold_start_ms:
+            sys.exit(f"Cold start p95 {result['p95_ms']} ms is over {args.max_cold_start_ms} ms")
+        return
+
+    report = run_benchmarks(args)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
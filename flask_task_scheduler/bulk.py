@@ -0,0 +1,406 @@
+"""
+Bulk import and export of tasks and logs, as CSV or NDJSON.
+
+Imports read their input a line at a time and validate each row as it
+arrives. Valid rows are written with executemany() in batches of
+BULK_BATCH_SIZE, each batch in its own transaction, so a large file never
+sits in memory and a bad row only costs its own line in the report.
+Exports stream rows straight from a cursor.
+"""
+import csv
+import io
+import json
+import math
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from models import json_value
+from recurrence import check_rule
+from storage import get_storage
+from tenants import user_option
+
+FORMATS = ('csv', 'ndjson')
+
+TASK_COLUMNS = ('id', 'title', 'description', 'due_date', 'estimated_hours',
+                'hours_completed', 'status', 'rrule')
+LOG_COLUMNS = ('id', 'task_id', 'log_date', 'hours')
+
+TASK_STATUSES = ('pending', 'completed')
+
+
+class ImportResult:
+    """Counts imported rows and collects the errors of rejected ones."""
+
+    def __init__(self, max_errors=1000):
+        self.imported = 0
+        self.errors = []
+        self.error_count = 0
+        self.max_errors = max_errors
+
+    def error(self, line, message):
+        """Record that the row on `line` was rejected."""
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'line': line, 'error': str(message)})
+
+    def as_dict(self):
+        return {
+            'imported': self.imported,
+            'rejected': self.error_count,
+            'errors': self.errors,
+        }
+
+
+# Reading
+def detect_format(filename=None, content_type=None):
+    """Guess the format of an upload from its file name or content type."""
+    if filename:
+        extension = filename.rsplit('.', 1)[-1].lower()
+        if extension in ('ndjson', 'jsonl'):
+            return 'ndjson'
+        if extension == 'csv':
+            return 'csv'
+    if content_type and 'ndjson' in content_type:
+        return 'ndjson'
+    return 'csv'
+
+
+def text_lines(stream):
+    """Decode a binary stream one line at a time."""
+    for line in stream:
+        yield line.decode('utf-8-sig')
+
+
+def read_csv(stream):
+    """Yield (line number, row) for each record in a CSV stream with a header."""
+    reader = csv.DictReader(text_lines(stream))
+    for row in reader:
+        yield reader.line_num, row
+
+
+def read_ndjson(stream):
+    """Yield (line number, row) for each line of an NDJSON stream."""
+    for line_number, line in enumerate(text_lines(stream), 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            # Validation reports it against the line
+            row = e
+        yield line_number, row
+
+
+def read_rows(stream, fmt):
+    """Yield (line number, row) pairs from a stream in the given format."""
+    if fmt == 'ndjson':
+        return read_ndjson(stream)
+    return read_csv(stream)
+
+
+# Validation
+def _blank(value):
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def _number(row, name, default=None):
+    value = row.get(name)
+    if _blank(value):
+        if default is None:
+            raise ValueError(f'{name} is required.')
+        return default
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{name} must be a number.')
+    # float() accepts 'inf' and 'nan', which the planner can't work with
+    if not math.isfinite(number):
+        raise ValueError(f'{name} must be a finite number.')
+    return number
+
+
+def _date(row, name):
+    value = row.get(name)
+    if _blank(value):
+        raise ValueError(f'{name} is required.')
+    try:
+        return datetime.strptime(str(value).strip(), '%Y-%m-%d').date().isoformat()
+    except ValueError:
+        raise ValueError(f'{name} must be a date (YYYY-MM-DD).')
+
+
+def _id(row, name, required=False):
+    value = row.get(name)
+    if _blank(value):
+        if required:
+            raise ValueError(f'{name} is required.')
+        return None
+    try:
+        number = int(str(value).strip())
+    except ValueError:
+        raise ValueError(f'{name} must be a whole number.')
+    if number <= 0:
+        raise ValueError(f'{name} must be greater than 0.')
+    return number
+
+
+def check_row(row):
+    if isinstance(row, ValueError):
+        raise ValueError(f'Invalid JSON: {row}')
+    if not isinstance(row, dict):
+        raise ValueError('Each row must be an object.')
+
+
+def task_values(row):
+    """Validate a task row and return its column values, in TASK_COLUMNS order."""
+    check_row(row)
+
+    title = row.get('title')
+    if _blank(title):
+        raise ValueError('Title is required.')
+
+    estimated_hours = _number(row, 'estimated_hours')
+    if estimated_hours <= 0:
+        raise ValueError('Estimated hours must be greater than 0.')
+
+    hours_completed = _number(row, 'hours_completed', default=0.0)
+    if hours_completed < 0:
+        raise ValueError('Hours completed cannot be negative.')
+
+    due_date = _date(row, 'due_date')
+    rrule = row.get('rrule')
+    rrule = check_rule(str(rrule), datetime.strptime(due_date, '%Y-%m-%d').date()) if rrule else None
+
+    # Recurring tasks are only completed by hand
+    status = row.get('status')
+    if _blank(status):
+        status = 'completed' if rrule is None and hours_completed >= estimated_hours else 'pending'
+    elif status not in TASK_STATUSES:
+        raise ValueError(f"Status must be one of {', '.join(TASK_STATUSES)}.")
+
+    return (_id(row, 'id'), str(title).strip(), str(row.get('description') or ''),
+            due_date, estimated_hours, hours_completed, status, rrule)
+
+
+def log_values(row):
+    """Validate a log row and return its column values, in LOG_COLUMNS order."""
+    check_row(row)
+
+    hours = _number(row, 'hours')
+    if hours <= 0:
+        raise ValueError('Hours must be greater than 0.')
+    elif hours % 0.5 != 0:
+        raise ValueError('Hours must be in increments of 0.5.')
+
+    return (_id(row, 'id'), _id(row, 'task_id', required=True),
+            _date(row, 'log_date'), hours)
+
+
+# Writing
+def explicit_ids(batch):
+    return {values[0] for _, values in batch if values[0] is not None}
+
+
+def reject_duplicates(batch, taken, result):
+    """
+    Drop rows whose explicit id is taken, in the table (`taken`, the ids
+    found there) or earlier in the batch.
+    """
+    kept = []
+    for line, values in batch:
+        if values[0] is not None:
+            if values[0] in taken:
+                result.error(line, f'id {values[0]} already exists.')
+                continue
+            taken.add(values[0])
+        kept.append((line, values))
+    return kept
+
+
+def write_tasks(storage, batch, result):
+    """Insert one batch of validated tasks in a single transaction."""
+    storage.begin_write()
+    try:
+        # Task ids are unique across every owner
+        taken = storage.tasks.existing_ids(explicit_ids(batch), owned=False)
+        batch = reject_duplicates(batch, taken, result)
+        if batch:
+            storage.tasks.insert_many([values for _, values in batch], TASK_COLUMNS)
+        storage.commit()
+    except Exception:
+        storage.rollback()
+        raise
+    result.imported += len(batch)
+
+
+def write_logs(storage, batch, result, update_totals=True):
+    """
+    Insert one batch of validated logs in a single transaction, adding
+    their hours to each task's total as logging progress does.
+    """
+    storage.begin_write()
+    try:
+        batch = reject_duplicates(batch, storage.logs.existing_ids(explicit_ids(batch)), result)
+
+        tasks = storage.tasks.existing_ids({values[1] for _, values in batch})
+        kept = []
+        for line, values in batch:
+            if values[1] in tasks:
+                kept.append((line, values))
+            else:
+                result.error(line, f'Task {values[1]} does not exist.')
+        batch = kept
+
+        if batch:
+            storage.logs.insert_many([values for _, values in batch], LOG_COLUMNS)
+
+            totals = {}
+            for _, values in batch:
+                totals[values[1]] = totals.get(values[1], 0) + values[3]
+            if update_totals:
+                storage.tasks.add_hours(totals)
+            else:
+                storage.tasks.record_changes(totals)
+        storage.commit()
+    except Exception:
+        storage.rollback()
+        raise
+    result.imported += len(batch)
+
+
+def import_rows(rows, validate, write, batch_size=None, max_errors=None):
+    """
+    Validate (line number, row) pairs and hand valid rows to `write` in
+    batches. Returns the ImportResult.
+    """
+    config = current_app.config
+    batch_size = batch_size or config['BULK_BATCH_SIZE']
+    result = ImportResult(max_errors or config['BULK_MAX_ERRORS'])
+    storage = get_storage()
+
+    batch = []
+    for line, row in rows:
+        try:
+            batch.append((line, validate(row)))
+        except ValueError as e:
+            result.error(line, e)
+            continue
+        if len(batch) >= batch_size:
+            write(storage, batch, result)
+            batch = []
+    if batch:
+        write(storage, batch, result)
+
+    return result
+
+
+def import_tasks(stream, fmt, **kwargs):
+    """Import tasks from a binary CSV or NDJSON stream."""
+    return import_rows(read_rows(stream, fmt), task_values, write_tasks, **kwargs)
+
+
+def import_logs(stream, fmt, update_totals=True, **kwargs):
+    """Import logs from a binary CSV or NDJSON stream."""
+    def write(storage, batch, result):
+        write_logs(storage, batch, result, update_totals=update_totals)
+
+    return import_rows(read_rows(stream, fmt), log_values, write, **kwargs)
+
+
+# Exporting
+def export_rows(repository, columns, fmt, batch_size=None):
+    """
+    Yield the current user's tasks or logs, from their repository, as UTF-8
+    encoded CSV or NDJSON chunks, in id order.
+    """
+    batch_size = batch_size or current_app.config['BULK_BATCH_SIZE']
+    cursor = repository.export(columns)
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if fmt == 'csv':
+        writer.writerow(columns)
+
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        for row in rows:
+            values = [json_value(value) for value in row]
+            if fmt == 'csv':
+                writer.writerow(values)
+            else:
+                buffer.write(json.dumps(dict(zip(columns, values))) + '\n')
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def export_tasks(fmt):
+    return export_rows(get_storage().tasks, TASK_COLUMNS, fmt)
+
+
+def export_logs(fmt):
+    return export_rows(get_storage().logs, LOG_COLUMNS, fmt)
+
+
+# Command line
+def echo_result(result):
+    for error in result.errors:
+        click.echo(f"line {error['line']}: {error['error']}", err=True)
+    if result.error_count > len(result.errors):
+        click.echo(f'... and {result.error_count - len(result.errors)} more errors.', err=True)
+    click.echo(f'Imported {result.imported} rows, rejected {result.error_count}.')
+
+
+@click.command('import-tasks')
+@click.argument('file', type=click.File('rb'))
+@click.option('--format', 'fmt', type=click.Choice(FORMATS),
+              help='Input format (guessed from the file name by default).')
+@click.option('--batch-size', type=int, help='Rows per transaction.')
+@with_appcontext
+@user_option
+def import_tasks_command(file, fmt, batch_size):
+    """Import tasks from a CSV or NDJSON file ('-' for stdin)."""
+    echo_result(import_tasks(file, fmt or detect_format(file.name), batch_size=batch_size))
+
+
+@click.command('import-logs')
+@click.argument('file', type=click.File('rb'))
+@click.option('--format', 'fmt', type=click.Choice(FORMATS),
+              help='Input format (guessed from the file name by default).')
+@click.option('--batch-size', type=int, help='Rows per transaction.')
+@click.option('--totals/--no-totals', default=True,
+              help="Add the logged hours to each task's total (skip when the "
+                   "tasks were imported with their totals).")
+@with_appcontext
+@user_option
+def import_logs_command(file, fmt, batch_size, totals):
+    """Import task logs from a CSV or NDJSON file ('-' for stdin)."""
+    echo_result(import_logs(file, fmt or detect_format(file.name),
+                            update_totals=totals, batch_size=batch_size))
+
+
+@click.command('export-tasks')
+@click.option('-o', '--output', type=click.File('wb'), default='-',
+              help='File to write (stdout by default).')
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), default='csv')
+@click.option('--logs', is_flag=True, help='Export task logs instead of tasks.')
+@with_appcontext
+@user_option
+def export_tasks_command(output, fmt, logs):
+    """Export every task, or every log, as CSV or NDJSON."""
+    for chunk in (export_logs(fmt) if logs else export_tasks(fmt)):
+        output.write(chunk)
+
+
+def init_app(app):
+    app.cli.add_command(import_tasks_command)
+    app.cli.add_command(import_logs_command)
+    app.cli.add_command(export_tasks_command)
@@ -0,0 +1,271 @@
+"""
+Data versions, conditional GETs and the per-process schedule cache.
+
+Every write gives the task it touches a new version in task_changes, and
+the highest version there is the data version: cached schedules and exports are valid for as long
+as it and today's date stay the same.
+"""
+import functools
+import hashlib
+import threading
+import time
+from datetime import datetime, timezone
+from itertools import chain
+
+from flask import Response, current_app, make_response, request
+
+from models import calculate_today_schedule, work_capacities, work_items
+from profiling import timed
+from storage import get_storage
+from tenants import tenant_id
+from scheduler import plan_schedule
+
+
+# Data versions
+def get_data_version():
+    """Return the current data version, bumped by every task or log write."""
+    return get_storage().tasks.data_version()
+
+
+def get_last_modified():
+    """
+    Return when the data behind the schedule last changed, as an aware UTC
+    datetime. The schedule also changes when the date rolls over, so this
+    is never earlier than the start of today.
+    """
+    changed_at = get_storage().tasks.last_changed()
+
+    last_modified = datetime.combine(datetime.now().date(), datetime.min.time()).astimezone(timezone.utc)
+    if changed_at is not None:
+        last_modified = max(last_modified, changed_at.replace(tzinfo=timezone.utc))
+    return last_modified
+
+
+# Conditional requests
+def request_validators():
+    """
+    Return the (ETag, Last-Modified) of the response to the current request.
+    The ETag is derived from the tenant, the request URL, today's date and
+    the data version, and Last-Modified from the latest change.
+    """
+    validator = f"{tenant_id()}|{request.full_path}|{datetime.now().date()}|{get_data_version()}"
+    etag = hashlib.sha1(validator.encode('utf-8')).hexdigest()
+    last_modified = get_last_modified().replace(microsecond=0)
+    return etag, last_modified
+
+
+def is_not_modified(etag, last_modified):
+    """Whether the client's If-None-Match or If-Modified-Since shows it has this version."""
+    # If-None-Match takes precedence over If-Modified-Since
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    return (request.if_modified_since is not None
+            and last_modified <= request.if_modified_since)
+
+
+def set_validators(response, etag, last_modified):
+    """
+    Add the validators to a response, and make clients revalidate before
+    reuse. A response marked no-store gets none: it is a stand-in for the
+    resource (the HTML sent when no PDF could be made), not this version.
+    """
+    if response.cache_control.no_store:
+        return response
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response
+
+
+def conditional(view):
+    """
+    Answer conditional GETs for an export without running the view.
+
+    When the client already has the current version of the response, it
+    gets a 304 and the export is never rebuilt.
+    """
+    @functools.wraps(view)
+    def wrapped(*args, **kwargs):
+        etag, last_modified = request_validators()
+
+        if is_not_modified(etag, last_modified):
+            response = Response(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+
+        return set_validators(response, etag, last_modified)
+
+    return wrapped
+
+
+# Schedule cache
+class ScheduleCache:
+    """
+    Per-process cache of computed schedules.
+
+    Entries are keyed by (horizon, today's date) and stamped with the data
+    version they were computed at, so a lookup is a hit only for the same
+    (horizon, today, data version). The version lives in the database, which
+    keeps every worker process in step. When the version has moved on, only
+    the tasks recorded in task_changes since then are re-read; the engine
+    then re-plans from the work items held in memory. The items of an entry
+    hold the occurrences of recurring tasks in its window only.
+
+    Behind it is the materialized schedule (storage.schedules): every plan
+    of the SCHEDULE_HORIZONS computed is saved there, so a process that has
+    never seen a horizon reads the plan another process (or the refresher)
+    computed instead of planning it again. Plans for other horizons are
+    only kept in memory, so reads never write and clients can't fill the
+    table with horizons of their choosing.
+    """
+
+    # Above this many changed tasks a refresh falls back to a full read
+    max_changed_tasks = 500
+
+    # Entries kept, across all tenants and horizons
+    max_entries = 1024
+
+    def __init__(self):
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.materialized_hits = 0
+        self.lock = threading.Lock()
+
+    @timed('planner')
+    def get(self, days_ahead):
+        """Return the current tenant's Plan for the next `days_ahead` days."""
+        today = datetime.now().date()
+        key = (tenant_id(), days_ahead, today)
+        version = get_data_version()
+        materialized = days_ahead in current_app.config['SCHEDULE_HORIZONS']
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry['version'] == version:
+                self.hits += 1
+                return entry['plan']
+
+        if entry is None:
+            plan = None
+            if materialized:
+                plan = get_storage().schedules.load(days_ahead, today, version)
+            if plan is not None:
+                # Planned elsewhere; the work items are read if the entry
+                # ever needs refreshing
+                self._store(key, version, None, plan, 'materialized_hits')
+                return plan
+            items = self._load_items(today, days_ahead)
+            counter = 'misses'
+        elif entry['items'] is None:
+            items = self._load_items(today, days_ahead)
+            counter = 'refreshes'
+        else:
+            items = self._refresh(entry, today, days_ahead)
+            counter = 'refreshes'
+
+        plan, elapsed_ms = self._plan(items, today, days_ahead)
+        if materialized:
+            self._save(days_ahead, today, version, plan, elapsed_ms)
+        self._store(key, version, items, plan, counter)
+        return plan
+
+    def rebuild(self, days_ahead):
+        """
+        Plan the current tenant's next `days_ahead` days from scratch and
+        save the plan, whether or not the saved one is current. Returns the
+        Plan and how long planning took, in milliseconds.
+        """
+        today = datetime.now().date()
+        version = get_data_version()
+        items = self._load_items(today, days_ahead)
+        plan, elapsed_ms = self._plan(items, today, days_ahead)
+        self._save(days_ahead, today, version, plan, elapsed_ms)
+        self._store((tenant_id(), days_ahead, today), version, items, plan, 'misses')
+        return plan, elapsed_ms
+
+    def _plan(self, items, today, days_ahead):
+        started = time.perf_counter()
+        plan = plan_schedule(chain.from_iterable(items.values()), today,
+                             work_capacities(today, days_ahead))
+        return plan, (time.perf_counter() - started) * 1000
+
+    def _save(self, days_ahead, today, version, plan, elapsed_ms):
+        """Materialize a plan. Losing a race with another process saving it too is fine."""
+        storage = get_storage()
+        try:
+            storage.schedules.save(days_ahead, today, version, plan, elapsed_ms)
+        except storage.Error:
+            pass
+
+    def _store(self, key, version, items, plan, counter):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+            # Drop entries left over from previous days
+            self.entries = {k: v for k, v in self.entries.items() if k[2] == key[2] and k != key}
+            self.entries[key] = {
+                'version': version,
+                'items': items,
+                'plan': plan
+            }
+            # Then the least recently computed ones
+            for stale in list(self.entries)[:max(0, len(self.entries) - self.max_entries)]:
+                del self.entries[stale]
+
+    def _load_items(self, today, days_ahead):
+        """Read the work items of every open task, as work_items() returns them."""
+        return work_items(get_storage().tasks.open(), today, days_ahead)
+
+    def _refresh(self, entry, today, days_ahead):
+        """Re-read only the tasks changed since the entry was computed."""
+        storage = get_storage()
+        changed = storage.tasks.changed_since(entry['version'])
+
+        # A bulk change is cheaper to pick up with a single full read
+        if len(changed) > self.max_changed_tasks:
+            return self._load_items(today, days_ahead)
+
+        items = dict(entry['items'])
+        for task_id in changed:
+            items.pop(task_id, None)
+
+        items.update(work_items(storage.tasks.by_ids(changed), today, days_ahead))
+        return items
+
+    def stats(self):
+        """Return the hit/miss counters."""
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'refreshes': self.refreshes,
+                'materialized_hits': self.materialized_hits,
+                'entries': len(self.entries)
+            }
+
+
+schedule_cache = ScheduleCache()
+
+
+def get_work_plan(days_ahead=14):
+    """Return the work Plan for the next X days, served from the cache."""
+    return schedule_cache.get(days_ahead)
+
+
+def get_work_schedule(days_ahead=14):
+    """Return the work schedule for the next X days, served from the cache."""
+    return get_work_plan(days_ahead).schedule
+
+
+def get_today_schedule(days_ahead=7):
+    """
+    Return today's sessions of the plan for the next X days: the
+    materialized rows when they are current, otherwise just today's part
+    planned from the open tasks due in the window.
+    """
+    today = datetime.now().date()
+    sessions = get_storage().schedules.day(days_ahead, today, get_data_version())
+    if sessions is None:
+        sessions = calculate_today_schedule(days_ahead)
+    return sessions
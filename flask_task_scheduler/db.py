@@ -0,0 +1,318 @@
+import functools
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import click
+from flask import current_app, g, has_app_context
+from flask.cli import with_appcontext
+
+from profiling import ProfiledConnection
+from querylog import QueryLogConnection
+
+# Migration files are named like 0001_description.sql and applied in order.
+# The database's PRAGMA user_version records the last one applied.
+MIGRATIONS_FOLDER = 'migrations'
+MIGRATION_NAME = re.compile(r'^(\d+)_(\w+)\.sql$')
+
+# Guards each app's dict of pools
+_pools_lock = threading.Lock()
+
+
+class ConnectionPool:
+    """
+    A per-process pool of SQLite connections to one database file.
+
+    Connections are set up once, with the pragmas from the app config, and
+    handed back to the pool at the end of each request instead of being
+    closed. At most `size` idle connections are kept. `factory` is the
+    connection class, as for sqlite3.connect().
+    """
+
+    def __init__(self, path, size=8, pragmas=None, factory=sqlite3.Connection):
+        self.path = path
+        self.size = size
+        self.pragmas = pragmas or {}
+        self.factory = factory
+        self.pid = os.getpid()
+        self.idle = []
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def connect(self):
+        """Open a new connection with the pool's pragmas applied."""
+        db = sqlite3.connect(
+            self.path,
+            detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES,
+            check_same_thread=False,
+            factory=self.factory
+        )
+        db.row_factory = sqlite3.Row
+        for name, value in self.pragmas.items():
+            if value is not None:
+                db.execute(f'PRAGMA {name} = {value}')
+        return db
+
+    def acquire(self):
+        """Return an idle connection, or a new one if none is available."""
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+        return self.connect()
+
+    def release(self, db):
+        """Hand a connection back to the pool."""
+        # Leave nothing behind from the previous request
+        if db.in_transaction:
+            db.rollback()
+        db.set_trace_callback(None)
+
+        with self.lock:
+            if not self.closed and len(self.idle) < self.size:
+                self.idle.append(db)
+                return
+        db.close()
+
+    def close(self):
+        """
+        Close every idle connection. Connections still in use are closed
+        when they are released.
+        """
+        with self.lock:
+            self.closed = True
+            idle, self.idle = self.idle, []
+        for db in idle:
+            db.close()
+
+
+def connection_factory():
+    """Return the connection class for the pool, instrumented as configured."""
+    query_log = current_app.extensions.get('query_log')
+    if query_log is not None:
+        return functools.partial(QueryLogConnection, query_log=query_log)
+    if current_app.config['PROFILING']:
+        return ProfiledConnection
+    return sqlite3.Connection
+
+
+def database_path():
+    """
+    Return the database file for the current user: their own file when
+    tenants are sharded, otherwise the shared DATABASE.
+    """
+    config = current_app.config
+    user = g.get('user') if has_app_context() else None
+    if user is not None and config['MULTI_TENANT'] and config['TENANT_STORAGE'] == 'sharded':
+        return os.path.join(config['TENANT_FOLDER'], f"{user['id']}.db")
+    return config['DATABASE']
+
+
+def get_pool(path=None):
+    """
+    Return this process's connection pool for a database file, by default
+    the current user's (see database_path()).
+
+    Pools for tenant files are kept in least recently used order, and only
+    the TENANT_DATABASES most recent stay open. A tenant file is created,
+    or brought up to date, when its pool is opened.
+    """
+    config = current_app.config
+    path = path or database_path()
+    pools = current_app.extensions.setdefault('db_pools', OrderedDict())
+
+    with _pools_lock:
+        pool = pools.get(path)
+        # Connections must not be shared with a parent process after a fork
+        if pool is not None and pool.pid == os.getpid():
+            pools.move_to_end(path)
+            return pool
+
+        pool = ConnectionPool(
+            path,
+            size=config['SQLITE_POOL_SIZE'],
+            pragmas={
+                'journal_mode': config['SQLITE_JOURNAL_MODE'],
+                'synchronous': config['SQLITE_SYNCHRONOUS'],
+                'cache_size': config['SQLITE_CACHE_SIZE'],
+                'mmap_size': config['SQLITE_MMAP_SIZE'],
+                'busy_timeout': config['SQLITE_BUSY_TIMEOUT'],
+            },
+            factory=connection_factory()
+        )
+        pools[path] = pool
+
+        # Close the least recently used tenant databases
+        tenants = [key for key in pools if key != config['DATABASE']]
+        for key in tenants[:max(0, len(tenants) - config['TENANT_DATABASES'])]:
+            pools.pop(key).close()
+
+    if path != config['DATABASE']:
+        open_tenant_database(pool)
+    return pool
+
+
+def open_tenant_database(pool):
+    """Create a tenant's database file, or apply pending migrations to it."""
+    db = pool.acquire()
+    try:
+        if get_schema_version(db) == 0:
+            init_db(db)
+        else:
+            migrate_db(db)
+    finally:
+        pool.release(db)
+
+
+# Database helper functions
+def get_db():
+    """Connect to the database, reusing a pooled connection."""
+    if 'db' not in g:
+        g.db_pool = get_pool()
+        g.db = g.db_pool.acquire()
+
+        # Count the request's statements when it is being profiled
+        profile = g.get('profile')
+        if profile is not None:
+            g.db.set_trace_callback(profile.count_query)
+    return g.db
+
+
+def get_users_db():
+    """
+    Connect to the database holding the user accounts. That is the shared
+    DATABASE, even when each tenant's tasks are in a file of their own.
+    """
+    config = current_app.config
+    if not (config['MULTI_TENANT'] and config['TENANT_STORAGE'] == 'sharded'):
+        return get_db()
+    if 'users_db' not in g:
+        g.users_db = get_pool(current_app.config['DATABASE']).acquire()
+    return g.users_db
+
+
+def close_db(e=None):
+    """Return the database connections to their pools."""
+    db = g.pop('db', None)
+    if db is not None:
+        g.pop('db_pool').release(db)
+
+    users_db = g.pop('users_db', None)
+    if users_db is not None:
+        get_pool(current_app.config['DATABASE']).release(users_db)
+
+
+def init_db(db=None):
+    """Initialize the database with schema and apply all migrations."""
+    db = db or get_db()
+    with current_app.open_resource('schema.sql') as f:
+        db.executescript(f.read().decode('utf8'))
+    db.commit()
+    migrate_db(db)
+
+
+# Schema migrations
+def get_migrations():
+    """Return the (version, name, path) of every migration, in order."""
+    folder = os.path.join(current_app.root_path, MIGRATIONS_FOLDER)
+    migrations = []
+    for filename in os.listdir(folder):
+        match = MIGRATION_NAME.match(filename)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2),
+                               os.path.join(folder, filename)))
+    return sorted(migrations)
+
+
+def get_schema_version(db=None):
+    """Return the version of the last migration applied to the database."""
+    return (db or get_db()).execute('PRAGMA user_version').fetchone()[0]
+
+
+def split_statements(script):
+    """Split an SQL script into complete statements."""
+    statements = []
+    statement = ''
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            statements.append(statement.strip())
+            statement = ''
+    if statement.strip():
+        statements.append(statement.strip())
+    return statements
+
+
+def migrate_db(db=None):
+    """
+    Apply pending migrations to the database, each in its own transaction.
+    Returns the (version, name) of the migrations applied.
+    """
+    db = db or get_db()
+    applied = []
+
+    for version, name, path in get_migrations():
+        if version <= get_schema_version(db):
+            continue
+
+        with open(path, encoding='utf8') as f:
+            statements = split_statements(f.read())
+
+        # Take the write lock first and check the version again, in case
+        # another process applied this migration in the meantime. The
+        # version bump commits together with the migration, so a failed
+        # migration leaves the database at the previous version.
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            if version <= get_schema_version(db):
+                db.rollback()
+                continue
+            for statement in statements:
+                db.execute(statement)
+            db.execute(f'PRAGMA user_version = {version}')
+            db.commit()
+        except sqlite3.Error:
+            db.rollback()
+            raise
+        applied.append((version, name))
+
+    return applied
+
+
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    """Clear the existing data and create new tables."""
+    init_db()
+    click.echo('Initialized the database.')
+
+
+@click.command('migrate-db')
+@with_appcontext
+def migrate_db_command():
+    """Upgrade the database schema to the latest version."""
+    applied = migrate_db()
+    for version, name in applied:
+        click.echo(f'Applied migration {version:04d} {name}.')
+    click.echo(f'Database is at schema version {get_schema_version()}.')
+
+
+# Automatically check if database exists, if not create it
+def init_app(app):
+    app.teardown_appcontext(close_db)
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(migrate_db_command)
+
+    if app.config['MULTI_TENANT'] and app.config['TENANT_STORAGE'] == 'sharded':
+        os.makedirs(app.config['TENANT_FOLDER'], exist_ok=True)
+
+    with app.app_context():
+        # Check if database exists, initialize if not
+        if not os.path.exists(app.config['DATABASE']):
+            init_db()
+            print("Database initialized.")
+        else:
+            # Upgrade existing databases in place
+            for version, name in migrate_db():
+                print(f"Applied migration {version:04d} {name}.")
@@ -0,0 +1,28 @@
+"""
+gunicorn settings, for `gunicorn -c gunicorn.conf.py wsgi:application`.
+
+Each worker is a process with its own connection pool and PDF renderers,
+and serves requests on a few threads; SQLite in WAL mode lets their reads
+run side by side.
+"""
+import multiprocessing
+import os
+
+bind = f"{os.environ.get('HOST', '0.0.0.0')}:{os.environ.get('PORT', 8000)}"
+
+workers = int(os.environ.get('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2 + 1, 8)))
+worker_class = 'gthread'
+threads = int(os.environ.get('THREADS', 4))
+
+# PDF exports wait up to PDF_RENDER_TIMEOUT (60 seconds) for a render
+timeout = 90
+graceful_timeout = 30
+keepalive = 5
+
+# Restart workers now and then so memory growth can't build up
+max_requests = 1000
+max_requests_jitter = 100
+
+# Each worker creates its own app, so none of them shares a database
+# connection or process pool with the master
+preload_app = False
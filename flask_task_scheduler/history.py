@@ -0,0 +1,77 @@
+"""
+Logged hours over time, read from the daily and weekly rollups of
+task_logs (see storage.history), and compaction of old raw logs.
+
+The rollups hold one row per task per day and per week, so a history of
+any length is a bounded number of rows. Raw logs only matter for the
+recent per-log listings; once they are older than LOG_RETENTION_DAYS
+they can be folded into the rollups and deleted:
+
+    flask compact-logs
+"""
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from storage import get_storage
+from storage.base import as_date
+from tenants import user_option
+
+# Longest history shown, in days and weeks
+MAX_HISTORY_DAYS = 366
+MAX_HISTORY_WEEKS = 260
+
+
+def log_history(days, weeks, task_id=None):
+    """
+    Return the hours logged per day over the last `days` days and per week
+    over the last `weeks` weeks, each with every day or week listed, and
+    per task over the weeks (unless for one task).
+    """
+    storage = get_storage()
+    today = datetime.now().date()
+
+    first_day = today - timedelta(days=days - 1)
+    logged = {as_date(row['day']): row for row in storage.history.per_day(first_day, today, task_id)}
+    per_day = [(day, logged[day]['hours'] if day in logged else 0)
+               for day in (first_day + timedelta(days=i) for i in range(days))]
+
+    this_week = today - timedelta(days=today.weekday())
+    first_week = this_week - timedelta(weeks=weeks - 1)
+    logged = {as_date(row['week']): row for row in storage.history.per_week(first_week, today, task_id)}
+    per_week = [(week, logged[week]['hours'] if week in logged else 0)
+                for week in (first_week + timedelta(weeks=i) for i in range(weeks))]
+
+    per_task = []
+    if task_id is None:
+        per_task = storage.history.per_task(first_week, today)
+
+    return {
+        'per_day': per_day,
+        'per_week': per_week,
+        'per_task': per_task,
+        'total': sum(hours for _, hours in per_week),
+    }
+
+
+@click.command('compact-logs')
+@click.option('--days', type=int, default=None,
+              help='Keep the raw logs of this many days (default LOG_RETENTION_DAYS).')
+@with_appcontext
+@user_option
+def compact_logs_command(days):
+    """Fold old progress logs into the daily and weekly rollups."""
+    if days is None:
+        days = current_app.config['LOG_RETENTION_DAYS']
+    if days < 0:
+        raise click.BadParameter('must not be negative.', param_hint='--days')
+
+    before = datetime.now().date() - timedelta(days=days)
+    logs, hours = get_storage().history.compact(before)
+    click.echo(f'Compacted {logs} logs ({hours:g} hours) dated before {before}.')
+
+
+def init_app(app):
+    app.cli.add_command(compact_logs_command)
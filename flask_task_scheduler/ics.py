@@ -0,0 +1,129 @@
+"""
+Streaming iCalendar writer for the calendar export.
+
+Writes the same bytes the icalendar package (4.0.7, as pinned in
+requirements.txt) produces for our events, one VEVENT block at a time,
+without building a Calendar object tree in memory first.
+"""
+from datetime import datetime, timedelta
+
+CRLF = '\r\n'
+FOLD_LIMIT = 75
+
+PRODID = '-//Flask Task Scheduler//example.com//'
+
+
+def escape_text(text):
+    """Escape a TEXT value as RFC 5545 requires."""
+    # Order matters, as in icalendar's escape_char()
+    return text.replace(r'\N', '\n')\
+               .replace('\\', '\\\\')\
+               .replace(';', r'\;')\
+               .replace(',', r'\,')\
+               .replace('\r\n', r'\n')\
+               .replace('\n', r'\n')
+
+
+def fold_line(line, limit=FOLD_LIMIT, fold_sep='\r\n '):
+    """Fold a content line so no physical line exceeds 75 octets."""
+    try:
+        line.encode('ascii')
+    except UnicodeEncodeError:
+        pass
+    else:
+        return fold_sep.join(
+            line[i:i + limit - 1] for i in range(0, len(line), limit - 1)
+        )
+
+    chars = []
+    byte_count = 0
+    for char in line:
+        char_byte_len = len(char.encode('utf-8'))
+        byte_count += char_byte_len
+        if byte_count >= limit:
+            chars.append(fold_sep)
+            byte_count = char_byte_len
+        chars.append(char)
+    return ''.join(chars)
+
+
+def content_line(name, value):
+    """Return a folded content line, with its line break."""
+    return fold_line(f'{name}:{value}') + CRLF
+
+
+def text_line(name, text):
+    """Return a content line for a TEXT property."""
+    return content_line(name, escape_text(str(text)))
+
+
+def date_line(name, value):
+    """Return a content line for a DATE or DATE-TIME property."""
+    if isinstance(value, datetime):
+        return content_line(f'{name};VALUE=DATE-TIME', value.strftime('%Y%m%dT%H%M%S'))
+    return content_line(f'{name};VALUE=DATE', value.strftime('%Y%m%d'))
+
+
+def calendar_header():
+    """Return the lines opening the calendar."""
+    return ('BEGIN:VCALENDAR' + CRLF
+            + 'VERSION:2.0' + CRLF
+            + text_line('PRODID', PRODID))
+
+
+def calendar_footer():
+    """Return the line closing the calendar."""
+    return 'END:VCALENDAR' + CRLF
+
+
+def due_event(title, description, due_date, rrule=None):
+    """
+    Return the all-day VEVENT for a task's due date, with a reminder the day
+    before. A recurring task's event repeats by its RRULE from the first due
+    date, so calendars expand the occurrences themselves.
+    """
+    return ('BEGIN:VEVENT' + CRLF
+            + text_line('SUMMARY', f"[DUE] {title}")
+            + date_line('DTSTART', due_date)
+            + date_line('DTEND', due_date + timedelta(days=1))
+            + (content_line('RRULE', rrule) if rrule else '')
+            + text_line('DESCRIPTION', description)
+            + content_line('PRIORITY', 5)
+            + 'BEGIN:VALARM' + CRLF
+            + text_line('ACTION', 'DISPLAY')
+            + text_line('DESCRIPTION', f"Reminder: {title} is due tomorrow!")
+            + content_line('TRIGGER', '-P1D')
+            + 'END:VALARM' + CRLF
+            + 'END:VEVENT' + CRLF)
+
+
+def study_event(day, title, hours):
+    """Return the VEVENT for a study session, from 9 AM for the given hours."""
+    start_time = datetime.combine(day, datetime.min.time()) + timedelta(hours=9)
+    end_time = start_time + timedelta(hours=hours)
+
+    return ('BEGIN:VEVENT' + CRLF
+            + text_line('SUMMARY', f"[STUDY] {title} ({hours} hours)")
+            + date_line('DTSTART', start_time)
+            + date_line('DTEND', end_time)
+            + 'END:VEVENT' + CRLF)
+
+
+def stream_calendar(tasks, schedule):
+    """
+    Yield the calendar as UTF-8 encoded chunks, one event at a time.
+
+    `tasks` is an iterable of (title, description, due_date, rrule) tuples,
+    such as a database cursor, and `schedule` maps dates to lists of study
+    sessions ({'title', 'hours'}).
+    """
+    yield calendar_header().encode('utf-8')
+
+    for title, description, due_date, rrule in tasks:
+        yield due_event(title, description, due_date, rrule).encode('utf-8')
+
+    for day, day_tasks in schedule.items():
+        for task_info in day_tasks:
+            yield study_event(day, task_info['title'], task_info['hours']).encode('utf-8')
+
+    yield calendar_footer().encode('utf-8')
@@ -0,0 +1,6 @@
+-- One row per task or log write; MAX(version) is the data version used
+-- to invalidate cached schedules
+CREATE TABLE IF NOT EXISTS task_changes (
+    version INTEGER PRIMARY KEY AUTOINCREMENT,
+    task_id INTEGER NOT NULL
+);
@@ -0,0 +1,5 @@
+-- The planner reads open tasks in due date order
+CREATE INDEX IF NOT EXISTS idx_tasks_status_due_date ON tasks (status, due_date);
+
+-- Logs are looked up, listed and deleted by task, newest first
+CREATE INDEX IF NOT EXISTS idx_task_logs_task_id_log_date ON task_logs (task_id, log_date);
@@ -0,0 +1,2 @@
+-- When each change was made (UTC), for Last-Modified on exports
+ALTER TABLE task_changes ADD COLUMN changed_at TIMESTAMP;
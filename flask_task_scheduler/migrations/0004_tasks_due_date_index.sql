@@ -0,0 +1,2 @@
+-- The API pages through all tasks in due date order
+CREATE INDEX IF NOT EXISTS idx_tasks_due_date ON tasks (due_date);
@@ -0,0 +1,20 @@
+-- Accounts for multi-tenant mode
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT UNIQUE NOT NULL,
+    password TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- The owner of each task when tenants share a database (NULL otherwise).
+-- Every task query is scoped by it, so the indexes lead with it.
+ALTER TABLE tasks ADD COLUMN user_id INTEGER REFERENCES users(id);
+ALTER TABLE task_changes ADD COLUMN user_id INTEGER;
+
+DROP INDEX IF EXISTS idx_tasks_status_due_date;
+DROP INDEX IF EXISTS idx_tasks_due_date;
+CREATE INDEX IF NOT EXISTS idx_tasks_user_status_due_date ON tasks (user_id, status, due_date);
+CREATE INDEX IF NOT EXISTS idx_tasks_user_due_date ON tasks (user_id, due_date);
+
+-- Each tenant's data version is the highest of its own changes
+CREATE INDEX IF NOT EXISTS idx_task_changes_user_version ON task_changes (user_id, version);
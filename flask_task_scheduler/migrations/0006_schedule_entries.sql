@@ -0,0 +1,39 @@
+-- The materialized schedule: each tenant's plan for each refreshed horizon
+-- (see refresher.py), one row per task per day, read by date range.
+
+CREATE TABLE IF NOT EXISTS schedule_entries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER,
+    days INTEGER NOT NULL,
+    date DATE NOT NULL,
+    task_id INTEGER NOT NULL,
+    hours REAL NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_schedule_entries_user_days_date ON schedule_entries (user_id, days, date);
+
+-- The tasks each plan can't finish by their due date
+CREATE TABLE IF NOT EXISTS schedule_late (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER,
+    days INTEGER NOT NULL,
+    task_id INTEGER NOT NULL,
+    due_date DATE NOT NULL,
+    shortfall REAL NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_schedule_late_user_days ON schedule_late (user_id, days);
+
+-- What each plan was computed from: its rows are current while start_date
+-- is today and version is the data version
+CREATE TABLE IF NOT EXISTS schedule_state (
+    user_id INTEGER,
+    days INTEGER NOT NULL,
+    start_date DATE NOT NULL,
+    version INTEGER NOT NULL,
+    refreshed_at TIMESTAMP NOT NULL,
+    elapsed_ms REAL NOT NULL
+);
+
+-- One plan per tenant and horizon, even when two processes save at once
+CREATE UNIQUE INDEX IF NOT EXISTS idx_schedule_state_user_days ON schedule_state (COALESCE(user_id, 0), days);
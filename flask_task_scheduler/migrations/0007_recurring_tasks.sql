@@ -0,0 +1,4 @@
+-- Recurring tasks: an RFC 5545 RRULE (e.g. FREQ=WEEKLY;BYDAY=MO) whose
+-- occurrences start on the due date. NULL for one-off tasks. Occurrences
+-- are expanded when planning (see recurrence.py), never stored.
+ALTER TABLE tasks ADD COLUMN rrule TEXT;
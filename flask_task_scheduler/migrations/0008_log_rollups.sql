@@ -0,0 +1,36 @@
+-- Hours logged per task per day and per week (weeks start on Monday),
+-- kept up to date as logs are written. History pages read these instead
+-- of task_logs, and `flask compact-logs` deletes old raw logs once they
+-- are counted here. `entries` is the number of logs folded into a row.
+CREATE TABLE IF NOT EXISTS task_log_daily (
+    task_id INTEGER NOT NULL,
+    user_id INTEGER,
+    day DATE NOT NULL,
+    hours REAL NOT NULL,
+    entries INTEGER NOT NULL
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_task_log_daily_task_day ON task_log_daily (task_id, day);
+CREATE INDEX IF NOT EXISTS idx_task_log_daily_user_day ON task_log_daily (user_id, day);
+
+CREATE TABLE IF NOT EXISTS task_log_weekly (
+    task_id INTEGER NOT NULL,
+    user_id INTEGER,
+    week DATE NOT NULL,
+    hours REAL NOT NULL,
+    entries INTEGER NOT NULL
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_task_log_weekly_task_week ON task_log_weekly (task_id, week);
+CREATE INDEX IF NOT EXISTS idx_task_log_weekly_user_week ON task_log_weekly (user_id, week);
+
+-- Count the logs already written
+INSERT INTO task_log_daily (task_id, user_id, day, hours, entries)
+SELECT l.task_id, t.user_id, l.log_date, SUM(l.hours), COUNT(*)
+FROM task_logs l JOIN tasks t ON t.id = l.task_id
+GROUP BY l.task_id, l.log_date;
+
+INSERT INTO task_log_weekly (task_id, user_id, week, hours, entries)
+SELECT task_id, user_id, date(day, 'weekday 0', '-6 days'), SUM(hours), SUM(entries)
+FROM task_log_daily
+GROUP BY task_id, date(day, 'weekday 0', '-6 days');
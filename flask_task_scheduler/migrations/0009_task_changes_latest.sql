@@ -0,0 +1,7 @@
+-- Keep only the latest change to each task. changed_since() needs no
+-- more than that, and the table no longer grows with every write.
+DELETE FROM task_changes WHERE version NOT IN (
+    SELECT MAX(version) FROM task_changes GROUP BY task_id
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_task_changes_task_id ON task_changes (task_id);
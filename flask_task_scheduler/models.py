@@ -0,0 +1,188 @@
+"""
+Helpers that turn tasks into work for the planner, and pagination cursors.
+The tasks themselves are read through the storage layer (see storage).
+"""
+import base64
+import binascii
+import heapq
+import json
+from datetime import date, datetime, timedelta
+from itertools import chain
+
+from flask import current_app
+
+from profiling import timed
+from recurrence import occurrences, previous_occurrence
+from storage import get_storage
+from scheduler import WorkItem, daily_capacities, plan_day, plan_schedule
+
+
+def encode_cursor(values):
+    """Return an opaque pagination cursor for a keyset, such as (due_date, id)."""
+    data = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, types):
+    """
+    Return the keyset in a cursor, raising ValueError if it isn't a valid one.
+    `types` gives the type of each value, e.g. (date, int) for (due_date, id);
+    dates are ISO strings in the cursor and stay strings in the keyset.
+    """
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(data.decode('utf-8'))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError('Invalid cursor.')
+    if not isinstance(values, list) or len(values) != len(types):
+        raise ValueError('Invalid cursor.')
+
+    for value, value_type in zip(values, types):
+        if value_type is date:
+            try:
+                date.fromisoformat(value)
+            except (TypeError, ValueError):
+                raise ValueError('Invalid cursor.')
+        # bool is an int subclass, so compare types exactly
+        elif type(value) is not value_type:
+            raise ValueError('Invalid cursor.')
+    return values
+
+
+def json_value(value):
+    """Return a column value as it goes into JSON, with dates as ISO strings."""
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def parse_due_date(value):
+    """Return a task's due date as a date, whether it's stored as a string or a date."""
+    if isinstance(value, str):
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    return value
+
+
+def work_item(task):
+    """Return the planner's WorkItem for a one-off task row, or None if nothing is left to do."""
+    # Skip completed tasks
+    if task['status'] == 'completed':
+        return None
+
+    # Calculate remaining hours
+    remaining_hours = task['estimated_hours'] - task['hours_completed']
+    if remaining_hours <= 0:
+        return None
+
+    return WorkItem(task['id'], task['title'], parse_due_date(task['due_date']),
+                    remaining_hours)
+
+
+def occurrence_items(tasks, start, end):
+    """
+    Return the WorkItems of recurring task rows for their occurrences due
+    from `start` to `end`, in (due date, task id) order. Each occurrence
+    needs the task's estimate, and is available from the due date of the
+    occurrence before it; hours logged since the occurrence before `start`
+    count towards the next one.
+    """
+    items = []
+    since = {}
+    for task in tasks:
+        if task['status'] == 'completed':
+            continue
+        first_due = parse_due_date(task['due_date'])
+        dates = occurrences(task['rrule'], first_due, start, end)
+        if not dates:
+            continue
+        previous = previous_occurrence(task['rrule'], first_due, start)
+        since[task['id']] = previous or date.min
+        items += [WorkItem(task['id'], task['title'], due, task['estimated_hours'], available)
+                  for due, available in zip(dates, [previous, *dates])]
+    if not items:
+        return items
+
+    logged = dict.fromkeys(since, 0)
+    for row in get_storage().history.hours_after(since, min(since.values())):
+        if parse_due_date(row['day']) > since[row['task_id']]:
+            logged[row['task_id']] += row['hours']
+
+    items.sort(key=lambda item: (item.due_date, item.task_id))
+    for i, item in enumerate(items):
+        if logged[item.task_id]:
+            items[i] = item._replace(hours=max(0, item.hours - logged[item.task_id]))
+            logged[item.task_id] = 0
+    return items
+
+
+def work_items(tasks, start, days_ahead):
+    """
+    Return the work in task rows for the planning window of `days_ahead`
+    days from `start`, as a dict mapping task ids to lists of WorkItems:
+    one for a one-off task, one per occurrence in the window for a
+    recurring task.
+    """
+    end = start + timedelta(days=days_ahead - 1)
+    items = {}
+    recurring = []
+    for task in tasks:
+        if task['rrule']:
+            recurring.append(task)
+            continue
+        item = work_item(task)
+        if item is not None:
+            items[item.task_id] = [item]
+
+    for item in occurrence_items(recurring, start, end):
+        items.setdefault(item.task_id, []).append(item)
+    return items
+
+
+def work_capacities(today, days_ahead):
+    """Return the hours available on each day of the planning window."""
+    return daily_capacities(
+        today, days_ahead,
+        capacity=current_app.config['DAILY_CAPACITY_HOURS'],
+        weekend_factor=current_app.config['WEEKEND_CAPACITY_FACTOR']
+    )
+
+
+@timed('planner')
+def calculate_work_plan(days_ahead=14):
+    """
+    Plan the next X days with the scheduling engine.
+    Returns a Plan with the schedule and the tasks that can't be finished
+    by their due date.
+    """
+    today = datetime.now().date()
+    items = work_items(get_storage().tasks.open(), today, days_ahead)
+    return plan_schedule(chain.from_iterable(items.values()), today,
+                         work_capacities(today, days_ahead))
+
+
+def calculate_work_schedule(days_ahead=14):
+    """
+    Calculate a work schedule for the next X days.
+    Returns a dictionary mapping dates to tasks and suggested hours.
+    """
+    return calculate_work_plan(days_ahead).schedule
+
+
+@timed('planner')
+def calculate_today_schedule(days_ahead=7):
+    """
+    Return today's part of the schedule for the next X days.
+
+    Gives the same allocations as today's entry of calculate_work_schedule(),
+    but only reads open tasks due within the window in due date order, and
+    stops as soon as today's capacity is filled. Occurrences of recurring
+    tasks in the window that are available today are merged in by due date.
+    """
+    today = datetime.now().date()
+    end = today + timedelta(days=days_ahead - 1)
+    storage = get_storage()
+    recurring = [item for item in occurrence_items(storage.tasks.recurring(end), today, end)
+                 if item.available is None or item.available <= today]
+    one_off = (item for item in map(work_item, storage.tasks.open_due_by(end)) if item is not None)
+    items = heapq.merge(one_off, recurring, key=lambda item: (item.due_date, item.task_id))
+    return plan_day(items, work_capacities(today, 1)[0])
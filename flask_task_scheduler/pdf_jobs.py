@@ -0,0 +1,240 @@
+"""
+Background PDF rendering.
+
+PDFs are rendered by a bounded pool of worker processes, so a long export
+doesn't hold a web worker's CPU. Rendered PDFs are kept in a size-bounded
+in-memory cache keyed by whatever the caller uses to identify the export
+(horizon, data version and renderer for the schedule). Repeat downloads are
+served from the cache, and concurrent requests for the same key share one
+render. Jobs get random ids, so a job can't be found from its key.
+"""
+import importlib.util
+import secrets
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+
+# PDF renderers in order of preference
+RENDERERS = ('xhtml2pdf', 'weasyprint')
+
+# Size above which a PDF being rendered spills from memory to disk
+DEFAULT_SPOOL_BYTES = 8 * 1024 * 1024
+
+
+class PDFRenderError(Exception):
+    """Raised when a renderer fails to convert HTML to PDF."""
+
+
+def available_renderer():
+    """Return the first installed PDF renderer, or None if there is none."""
+    for renderer in RENDERERS:
+        if importlib.util.find_spec(renderer) is not None:
+            return renderer
+    return None
+
+
+def render_pdf(html, renderer, spool_bytes=DEFAULT_SPOOL_BYTES):
+    """
+    Render HTML to PDF bytes. Runs in a worker process.
+
+    The PDF is written to an in-memory buffer, which only spills to an
+    anonymous temporary file (deleted as soon as it is closed) once it grows
+    past `spool_bytes`.
+    """
+    with tempfile.SpooledTemporaryFile(max_size=spool_bytes) as buffer:
+        if renderer == 'xhtml2pdf':
+            from xhtml2pdf import pisa
+
+            pisa_status = pisa.CreatePDF(html, dest=buffer)
+            if pisa_status.err:
+                raise PDFRenderError(f'xhtml2pdf reported {pisa_status.err} error(s)')
+        elif renderer == 'weasyprint':
+            from weasyprint import HTML
+
+            HTML(string=html).write_pdf(buffer)
+        else:
+            raise PDFRenderError(f'Unknown PDF renderer: {renderer}')
+
+        buffer.seek(0)
+        return buffer.read()
+
+
+class PDFJob:
+    """A render submitted to the pool, tracked so clients can poll it."""
+
+    def __init__(self, job_id, key, future=None):
+        self.id = job_id
+        self.key = key
+        self.future = future
+        self.state = 'pending' if future is not None else 'done'
+        self.error = None
+
+    @property
+    def status(self):
+        """Return 'pending', 'running', 'done' or 'failed'."""
+        future = self.future
+        if future is None:
+            return self.state
+        if not future.done():
+            return 'running' if future.running() else 'pending'
+        return 'failed' if future.exception() is not None else 'done'
+
+    @property
+    def in_flight(self):
+        """Whether the render is still queued or running."""
+        future = self.future
+        return future is not None and not future.done()
+
+    def finish(self, future):
+        """Record the outcome; from then on the PDF itself lives in the cache."""
+        if future.exception() is not None:
+            self.state = 'failed'
+            self.error = str(future.exception())
+        else:
+            self.state = 'done'
+        self.future = None
+
+
+class PDFJobs:
+    """
+    Submits renders to a process pool and caches what they produce.
+
+    With `workers` set to 0 renders run synchronously in the calling
+    thread, which is handy for development and debugging.
+    """
+
+    # How many jobs to remember for polling
+    max_jobs = 256
+
+    def __init__(self, workers=2, cache_bytes=64 * 1024 * 1024,
+                 spool_bytes=DEFAULT_SPOOL_BYTES):
+        self.workers = workers
+        self.cache_bytes = cache_bytes
+        self.spool_bytes = spool_bytes
+        self.cache = OrderedDict()
+        self.cached_bytes = 0
+        self.jobs = OrderedDict()
+        # The latest job for each key
+        self.job_ids = {}
+        self.executor = None
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def new_job_id():
+        """Return an unguessable job id."""
+        return secrets.token_urlsafe(16)
+
+    def _job_for(self, key):
+        return self.jobs.get(self.job_ids.get(key))
+
+    def submit(self, key, build_html, renderer):
+        """
+        Return a job for the PDF identified by `key`: the render already in
+        flight for it, a finished job if it is cached, or a new render.
+        `build_html` is only called when a render is actually needed.
+        """
+        with self.lock:
+            job = self._job_for(key)
+            if job is not None and job.in_flight:
+                return job
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                if job is not None and job.status == 'done':
+                    return job
+                return self._remember(PDFJob(self.new_job_id(), key))
+
+        html = build_html()
+
+        with self.lock:
+            # Another thread may have submitted the same render meanwhile
+            job = self._job_for(key)
+            if job is not None and (job.in_flight or key in self.cache):
+                return job
+
+            future = self._executor().submit(render_pdf, html, renderer, self.spool_bytes)
+            job = self._remember(PDFJob(self.new_job_id(), key, future))
+
+        future.add_done_callback(lambda future: self._finish(job, future))
+        return job
+
+    def result(self, job, timeout=None):
+        """
+        Wait for a job and return its PDF bytes. Raises the render error if
+        it failed, or LookupError if the PDF has since left the cache.
+        """
+        future = job.future
+        if future is not None:
+            return future.result(timeout)
+        if job.state == 'failed':
+            raise PDFRenderError(job.error)
+
+        pdf = self.get_cached(job.key)
+        if pdf is None:
+            raise LookupError(f'PDF for job {job.id} is no longer cached')
+        return pdf
+
+    def get_job(self, job_id):
+        """Return a job by id, or None if it is unknown or forgotten."""
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def get_cached(self, key):
+        """Return the cached PDF for a key, or None."""
+        with self.lock:
+            pdf = self.cache.get(key)
+            if pdf is not None:
+                self.cache.move_to_end(key)
+            return pdf
+
+    def _executor(self):
+        if self.executor is None:
+            if self.workers > 0:
+                self.executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self.executor = SynchronousExecutor()
+        return self.executor
+
+    def _remember(self, job):
+        self.jobs[job.id] = job
+        self.job_ids[job.key] = job.id
+        while len(self.jobs) > self.max_jobs:
+            _, forgotten = self.jobs.popitem(last=False)
+            if self.job_ids.get(forgotten.key) == forgotten.id:
+                del self.job_ids[forgotten.key]
+        return job
+
+    def _finish(self, job, future):
+        """Cache a finished render, evicting the least recently used PDFs."""
+        if future.exception() is None:
+            pdf = future.result()
+            with self.lock:
+                if len(pdf) <= self.cache_bytes and job.key not in self.cache:
+                    self.cache[job.key] = pdf
+                    self.cached_bytes += len(pdf)
+                    while self.cached_bytes > self.cache_bytes:
+                        _, evicted = self.cache.popitem(last=False)
+                        self.cached_bytes -= len(evicted)
+        job.finish(future)
+
+    def shutdown(self):
+        """Stop the worker processes."""
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+
+class SynchronousExecutor:
+    """Runs submitted calls immediately, for running without a process pool."""
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        future.set_running_or_notify_cancel()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self, wait=True):
+        pass
@@ -0,0 +1,236 @@
+"""
+Opt-in request profiling.
+
+With PROFILING enabled, every request records how long it spent in the
+database, the planner, template rendering and PDF/ICS serialization, and
+how many SQL statements it ran. The breakdown is sent back in a
+Server-Timing header, and collected per route into Prometheus histograms
+served at /metrics.
+
+When PROFILING is off, no hooks are registered and connections are plain
+sqlite3 connections; timed() sections just check for a profile on `g` and
+find none.
+
+Times are exclusive: a section nested in another (the queries a planner
+call makes, say) is counted only towards the inner one. Serialization that
+happens while a streamed response is sent (the calendar) is after the
+headers have gone, so it only shows up in /metrics.
+"""
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, current_app, g, has_app_context, request
+
+# What request time is broken down into; the rest is counted as 'other'
+CATEGORIES = ('db', 'planner', 'template', 'serialize')
+
+# Histogram buckets, in seconds for durations
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 1000)
+
+
+class RequestProfile:
+    """Times and statement count of one request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.times = dict.fromkeys(CATEGORIES, 0.0)
+        self.queries = 0
+        self.stack = []
+
+    def enter(self, category):
+        now = time.perf_counter()
+        if self.stack:
+            # Pause the enclosing section
+            outer, since = self.stack[-1]
+            self.times[outer] += now - since
+        self.stack.append((category, now))
+
+    def exit(self):
+        now = time.perf_counter()
+        category, since = self.stack.pop()
+        self.times[category] += now - since
+        if self.stack:
+            self.stack[-1] = (self.stack[-1][0], now)
+
+    def count_query(self, statement):
+        """sqlite3 trace callback: count every statement run."""
+        self.queries += 1
+
+    def total(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        """Return the Server-Timing header value for the time so far."""
+        metrics = []
+        for category, seconds in self.times.items():
+            metric = f'{category};dur={seconds * 1000:.2f}'
+            if category == 'db':
+                metric += f';desc="{self.queries} queries"'
+            metrics.append(metric)
+        metrics.append(f'total;dur={self.total() * 1000:.2f}')
+        return ', '.join(metrics)
+
+
+def current_profile():
+    """Return the profile of the current request, or None."""
+    if not has_app_context():
+        return None
+    return g.get('profile')
+
+
+@contextmanager
+def timed(category, profile=None):
+    """Count the time spent in a block (or decorated function) towards `category`."""
+    profile = profile or current_profile()
+    if profile is None:
+        yield
+        return
+    profile.enter(category)
+    try:
+        yield
+    finally:
+        profile.exit()
+
+
+def timed_iter(category, iterable):
+    """
+    Count the time spent producing each item of a streamed body towards
+    `category`. The profile is looked up now, as the body may be sent after
+    the request context is gone.
+    """
+    profile = current_profile()
+    if profile is None:
+        return iterable
+    return _timed_iter(category, iterable, profile)
+
+
+def _timed_iter(category, iterable, profile):
+    iterator = iter(iterable)
+    while True:
+        with timed(category, profile):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+class ProfiledConnection(sqlite3.Connection):
+    """A connection that counts the time its statements take as 'db'."""
+
+    def execute(self, *args):
+        with timed('db'):
+            return super().execute(*args)
+
+    def executemany(self, *args):
+        with timed('db'):
+            return super().executemany(*args)
+
+    def executescript(self, *args):
+        with timed('db'):
+            return super().executescript(*args)
+
+    def commit(self):
+        with timed('db'):
+            return super().commit()
+
+
+class Histogram:
+    """A Prometheus histogram with one series per label value."""
+
+    def __init__(self, name, description, buckets, label):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.label = label
+        self.series = {}
+
+    def observe(self, value, label_value):
+        series = self.series.get(label_value)
+        if series is None:
+            series = self.series[label_value] = [[0] * len(self.buckets), 0, 0.0]
+        counts = series[0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+        series[1] += 1
+        series[2] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        for label_value, (counts, count, total) in sorted(self.series.items()):
+            labels = f'{self.label}="{label_value}"'
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {bucket_count}')
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f'{self.name}_sum{{{labels}}} {total}')
+            lines.append(f'{self.name}_count{{{labels}}} {count}')
+        return lines
+
+
+class Metrics:
+    """Per-route request metrics of this process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.durations = Histogram(
+            'http_request_duration_seconds', 'Time to handle and send a request.',
+            DURATION_BUCKETS, 'route'
+        )
+        self.queries = Histogram(
+            'http_request_sql_statements', 'SQL statements run per request.',
+            QUERY_BUCKETS, 'route'
+        )
+        self.phases = {category: Histogram(
+            f'http_request_{category}_seconds', f'Time per request spent in {category}.',
+            DURATION_BUCKETS, 'route'
+        ) for category in CATEGORIES}
+
+    def observe(self, route, profile):
+        with self.lock:
+            self.durations.observe(profile.total(), route)
+            self.queries.observe(profile.queries, route)
+            for category, seconds in profile.times.items():
+                self.phases[category].observe(seconds, route)
+
+    def render(self):
+        with self.lock:
+            lines = self.durations.render() + self.queries.render()
+            for histogram in self.phases.values():
+                lines += histogram.render()
+        return '\n'.join(lines) + '\n'
+
+
+def start_profile():
+    g.profile = RequestProfile()
+
+
+def finish_profile(response):
+    """Add the Server-Timing header, and record the request once it is sent."""
+    profile = g.get('profile')
+    if profile is None:
+        return response
+
+    response.headers['Server-Timing'] = profile.server_timing()
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    metrics = current_app.extensions['metrics']
+    response.call_on_close(lambda: metrics.observe(route, profile))
+    return response
+
+
+def init_app(app):
+    """Register the profiling hooks and /metrics, if PROFILING is enabled."""
+    if not app.config['PROFILING']:
+        return
+
+    metrics = app.extensions['metrics'] = Metrics()
+    app.before_request(start_profile)
+    app.after_request(finish_profile)
+
+    @app.route('/metrics')
+    def metrics_endpoint():
+        """Request metrics in the Prometheus text format."""
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
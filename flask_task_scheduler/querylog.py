@@ -0,0 +1,216 @@
+"""
+Slow-query log and per-statement timings for the SQLite layer.
+
+With QUERY_STATS enabled, connections from the pool time every statement
+they run. Statements slower than SLOW_QUERY_MS are logged with their
+parameters and EXPLAIN QUERY PLAN output, so full-table scans show up as
+`SCAN tasks` without attaching a profiler. Every statement's call count and
+total and longest time are also kept per process, and flushed every
+QUERY_STATS_FLUSH_SECONDS to a separate SQLite file (so the statistics
+never contend with the application's own writes), where
+`flask query-stats` reads them back from all processes:
+
+    flask query-stats --top 20 --explain
+
+Only the time to run a statement to its first row is measured; rows a
+caller fetches afterwards from the cursor are not.
+"""
+import atexit
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from profiling import ProfiledConnection
+
+WHITESPACE = re.compile(r'\s+')
+
+STATS_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS query_stats (
+    sql TEXT PRIMARY KEY,
+    calls INTEGER NOT NULL,
+    total_ms REAL NOT NULL,
+    max_ms REAL NOT NULL,
+    last_seen TIMESTAMP NOT NULL
+)
+'''
+
+
+class QueryLog:
+    """
+    Collects statement timings for one database and logs the slow ones.
+    Shared by every connection of a process's pool.
+    """
+
+    def __init__(self, stats_path, slow_ms=100, flush_seconds=10, logger=None):
+        self.stats_path = stats_path
+        self.slow_ms = slow_ms
+        self.flush_seconds = flush_seconds
+        self.logger = logger
+        self.stats = {}
+        self.flushed_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def record(self, db, sql, params, elapsed_ms):
+        """Count a statement, and log it if it was slow."""
+        sql = WHITESPACE.sub(' ', sql).strip()
+        with self.lock:
+            stats = self.stats.get(sql)
+            if stats is None:
+                stats = self.stats[sql] = [0, 0.0, 0.0]
+            stats[0] += 1
+            stats[1] += elapsed_ms
+            stats[2] = max(stats[2], elapsed_ms)
+            flush = time.monotonic() - self.flushed_at >= self.flush_seconds
+
+        if self.slow_ms is not None and elapsed_ms >= self.slow_ms:
+            self.log_slow(db, sql, params, elapsed_ms)
+        if flush:
+            self.flush()
+
+    def log_slow(self, db, sql, params, elapsed_ms):
+        plan = explain(db, sql, params)
+        message = f'Slow query ({elapsed_ms:.1f} ms): {sql}\n  params: {params!r}'
+        if plan:
+            message += '\n  plan:\n' + '\n'.join(f'    {line}' for line in plan)
+        if self.logger is not None:
+            self.logger.warning(message)
+        else:
+            print(message)
+
+    def flush(self):
+        """Add this process's statistics to the shared statistics file."""
+        with self.lock:
+            stats, self.stats = self.stats, {}
+            self.flushed_at = time.monotonic()
+        if not stats:
+            return
+
+        db = connect_stats(self.stats_path)
+        try:
+            with db:
+                db.executemany(
+                    'INSERT INTO query_stats (sql, calls, total_ms, max_ms, last_seen) '
+                    "VALUES (?, ?, ?, ?, datetime('now')) "
+                    'ON CONFLICT (sql) DO UPDATE SET calls = calls + excluded.calls, '
+                    'total_ms = total_ms + excluded.total_ms, '
+                    'max_ms = max(max_ms, excluded.max_ms), last_seen = excluded.last_seen',
+                    [(sql, *values) for sql, values in stats.items()]
+                )
+        except sqlite3.Error as e:
+            print(f"Could not save query statistics: {e}")
+        finally:
+            db.close()
+
+
+class QueryLogConnection(ProfiledConnection):
+    """A connection that reports the time of each statement to a QueryLog."""
+
+    def __init__(self, *args, query_log=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.query_log = query_log
+
+    def execute(self, sql, params=()):
+        started = time.perf_counter()
+        cursor = super().execute(sql, params)
+        self.query_log.record(self, sql, params, (time.perf_counter() - started) * 1000)
+        return cursor
+
+    def executemany(self, sql, seq_of_params):
+        started = time.perf_counter()
+        cursor = super().executemany(sql, seq_of_params)
+        self.query_log.record(self, sql, '<many>', (time.perf_counter() - started) * 1000)
+        return cursor
+
+
+def explain(db, sql, params=None):
+    """
+    Return the EXPLAIN QUERY PLAN lines for a statement, indented by depth,
+    or an empty list if it has no plan. Without `params`, every parameter
+    is NULL, which gives the same plan.
+    """
+    if params is None or params == '<many>':
+        params = [None] * sql.count('?')
+    try:
+        rows = sqlite3.Connection.execute(db, f'EXPLAIN QUERY PLAN {sql}', params).fetchall()
+    except sqlite3.Error:
+        return []
+
+    depths = {0: 0}
+    lines = []
+    for node, parent, _, detail in rows:
+        depths[node] = depths.get(parent, 0) + 1
+        lines.append('  ' * (depths[node] - 1) + detail)
+    return lines
+
+
+def connect_stats(path):
+    db = sqlite3.connect(path, timeout=5)
+    db.execute(STATS_SCHEMA)
+    return db
+
+
+def get_query_log():
+    """Return the app's QueryLog, or None if QUERY_STATS is off."""
+    return current_app.extensions.get('query_log')
+
+
+@click.command('query-stats')
+@click.option('--top', default=20, show_default=True,
+              help='How many statements to show.')
+@click.option('--explain', 'show_plans', is_flag=True,
+              help='Show the query plan of each statement.')
+@click.option('--reset', is_flag=True, help='Clear the statistics afterwards.')
+@with_appcontext
+def query_stats_command(top, show_plans, reset):
+    """Show the SQL statements that took the most time in total."""
+    query_log = get_query_log()
+    if query_log is not None:
+        query_log.flush()
+
+    path = current_app.config['QUERY_STATS_DATABASE']
+    if not os.path.exists(path):
+        click.echo('No query statistics yet. Set QUERY_STATS = True and run the app.')
+        return
+
+    stats_db = connect_stats(path)
+    rows = stats_db.execute(
+        'SELECT sql, calls, total_ms, max_ms FROM query_stats '
+        'ORDER BY total_ms DESC LIMIT ?', (top,)
+    ).fetchall()
+
+    db = sqlite3.connect(current_app.config['DATABASE']) if show_plans else None
+    click.echo(f"{'total ms':>12} {'calls':>8} {'mean ms':>9} {'max ms':>9}  statement")
+    for sql, calls, total_ms, max_ms in rows:
+        click.echo(f'{total_ms:>12.1f} {calls:>8} {total_ms / calls:>9.2f} {max_ms:>9.2f}  {sql}')
+        if db is not None:
+            for line in explain(db, sql):
+                click.echo(f"{'':>42}{line}")
+    if db is not None:
+        db.close()
+
+    if reset:
+        with stats_db:
+            stats_db.execute('DELETE FROM query_stats')
+        click.echo('Query statistics cleared.')
+    stats_db.close()
+
+
+def init_app(app):
+    """Register the query-stats command, and set up the QueryLog if enabled."""
+    app.cli.add_command(query_stats_command)
+    if not app.config['QUERY_STATS']:
+        return
+
+    query_log = app.extensions['query_log'] = QueryLog(
+        app.config['QUERY_STATS_DATABASE'],
+        slow_ms=app.config['SLOW_QUERY_MS'],
+        flush_seconds=app.config['QUERY_STATS_FLUSH_SECONDS'],
+        logger=app.logger
+    )
+    atexit.register(query_log.flush)
@@ -0,0 +1,68 @@
+"""
+Recurring tasks.
+
+A recurring task is a single row in tasks with an RRULE (RFC 5545) such as
+`FREQ=WEEKLY;BYDAY=MO` in its `rrule` column. Its due date is the first
+occurrence. Occurrences are never stored: the planner expands them only
+within its window, and the calendar export writes the rule itself, so a
+weekly problem set is one row and one VEVENT however long it runs.
+
+dateutil is only imported when a rule is first parsed.
+"""
+import functools
+from datetime import datetime
+
+# Occurrences are days, so rules can't repeat more often than daily
+FREQUENCIES = ('YEARLY', 'MONTHLY', 'WEEKLY', 'DAILY')
+
+
+def normalize_rule(rule):
+    """Return a rule as it is stored: upper case, without an RRULE: prefix."""
+    rule = rule.strip().upper()
+    if rule.startswith('RRULE:'):
+        rule = rule[len('RRULE:'):]
+    return rule
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_rule(rule, first_due):
+    """Return the dateutil rrule for a stored rule, starting on the first due date."""
+    from dateutil.rrule import rrulestr
+
+    return rrulestr(rule, dtstart=datetime.combine(first_due, datetime.min.time()))
+
+
+def check_rule(rule, first_due):
+    """
+    Validate a rule given for a task due on `first_due`, and return it
+    normalized, or None for a one-off task. Raises ValueError.
+    """
+    if rule is None or not rule.strip():
+        return None
+    rule = normalize_rule(rule)
+
+    fields = dict(part.partition('=')[::2] for part in rule.split(';'))
+    if 'DTSTART' in fields or '\n' in rule:
+        raise ValueError('Repeat rule must be a single RRULE; the due date is its start.')
+    if fields.get('FREQ') not in FREQUENCIES:
+        raise ValueError(f"Repeat rule FREQ must be one of {', '.join(FREQUENCIES)}.")
+    try:
+        parse_rule(rule, first_due)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f'Invalid repeat rule: {e}')
+    return rule
+
+
+def occurrences(rule, first_due, start, end):
+    """Return the due dates of a rule's occurrences from `start` to `end`, inclusive."""
+    return [due.date() for due in parse_rule(rule, first_due).between(
+        datetime.combine(start, datetime.min.time()),
+        datetime.combine(end, datetime.min.time()),
+        inc=True
+    )]
+
+
+def previous_occurrence(rule, first_due, day):
+    """Return the due date of the last occurrence before `day`, or None."""
+    due = parse_rule(rule, first_due).before(datetime.combine(day, datetime.min.time()))
+    return due.date() if due is not None else None
@@ -0,0 +1,160 @@
+"""
+Background refresh of the materialized schedule.
+
+Every plan computed is saved in schedule_entries (see storage.schedules),
+and requests read their dates from there while it is current. To keep it
+current without a request paying for the planning, each process runs a
+refresher thread that re-plans the SCHEDULE_HORIZONS of a tenant:
+
+- shortly after a request writes their tasks or logs, and
+- at midnight, when every plan starts a day later, for each tenant the
+  process has served.
+
+A plan that is not current when a request needs it (another process
+changed the data, say) is still planned in the request, exactly as
+before. To rebuild by hand and see how long planning takes:
+
+    flask rebuild-schedule
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app, g
+from flask.cli import with_appcontext
+
+from caching import schedule_cache
+from tenants import get_user, tenant_id, user_option
+
+
+def refresh_schedules(force=False):
+    """
+    Bring the current tenant's materialized plans up to date. With `force`,
+    plan them again even if they are current. Returns (days, Plan, planning
+    ms or None if the saved plan was current) per horizon.
+    """
+    results = []
+    for days in current_app.config['SCHEDULE_HORIZONS']:
+        if force:
+            plan, elapsed_ms = schedule_cache.rebuild(days)
+        else:
+            plan, elapsed_ms = schedule_cache.get(days), None
+        results.append((days, plan, elapsed_ms))
+    return results
+
+
+class ScheduleRefresher:
+    """
+    Re-plans tenants' schedules on a daemon thread. notify() queues a
+    tenant (None in single-user mode); changes arriving within
+    SCHEDULE_REFRESH_DELAY seconds of each other are refreshed together.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.delay = app.config['SCHEDULE_REFRESH_DELAY']
+        self.pending = set()
+        self.tenants = set()
+        self.wake = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+        self.refreshes = 0
+        self.errors = 0
+
+    def start(self):
+        """Start the thread, again in a forked worker process."""
+        with self.lock:
+            if self.thread is not None and self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.thread = threading.Thread(target=self.run, name='schedule-refresher', daemon=True)
+        self.thread.start()
+
+    def seen(self, tenant):
+        """Remember a tenant, to refresh their plans at midnight."""
+        if tenant not in self.tenants:
+            with self.lock:
+                self.tenants.add(tenant)
+        self.start()
+
+    def notify(self, tenant):
+        """
+        Queue a refresh of a tenant's plans. The thread is only started by
+        requests, so CLI commands just queue.
+        """
+        with self.lock:
+            self.tenants.add(tenant)
+            self.pending.add(tenant)
+        self.wake.set()
+
+    def run(self):
+        today = datetime.now().date()
+        while True:
+            midnight = datetime.combine(today + timedelta(days=1), datetime.min.time())
+            woken = self.wake.wait(max(0.0, (midnight - datetime.now()).total_seconds()))
+            if woken:
+                # Let a burst of writes settle
+                time.sleep(self.delay)
+            self.wake.clear()
+
+            with self.lock:
+                if datetime.now().date() != today:
+                    today = datetime.now().date()
+                    self.pending |= self.tenants
+                pending, self.pending = self.pending, set()
+
+            for tenant in pending:
+                self.refresh(tenant)
+
+    def refresh(self, tenant):
+        try:
+            with self.app.app_context():
+                user = get_user(user_id=tenant) if tenant is not None else None
+                # Visitors who haven't signed in have no schedule
+                if user is None and self.app.config['MULTI_TENANT']:
+                    return
+                g.user = user
+                refresh_schedules()
+            self.refreshes += 1
+        except Exception:
+            # Requests will plan for themselves until the next refresh
+            self.errors += 1
+            self.app.logger.exception('Could not refresh the schedule of tenant %s', tenant)
+
+
+def get_refresher():
+    """Return the app's ScheduleRefresher, or None if SCHEDULE_REFRESHER is off."""
+    return current_app.extensions.get('schedule_refresher')
+
+
+def note_tenant():
+    refresher = get_refresher()
+    if refresher is not None:
+        refresher.seen(tenant_id())
+
+
+@click.command('rebuild-schedule')
+@with_appcontext
+@user_option
+def rebuild_schedule_command():
+    """Plan and save the materialized schedule again, and time it."""
+    started = time.perf_counter()
+    for days, plan, elapsed_ms in refresh_schedules(force=True):
+        sessions = sum(len(day) for day in plan.schedule.values())
+        click.echo(f'{days:>4} days: {sessions} sessions, {len(plan.late)} late tasks, '
+                   f'planned in {elapsed_ms:.1f} ms')
+    click.echo(f'Rebuilt in {(time.perf_counter() - started) * 1000:.1f} ms.')
+
+
+def init_app(app):
+    """Register the rebuild command, and the refresher if enabled."""
+    app.cli.add_command(rebuild_schedule_command)
+    if not app.config['SCHEDULE_REFRESHER']:
+        return
+
+    app.extensions['schedule_refresher'] = ScheduleRefresher(app)
+    # After the signed-in user is loaded
+    app.before_request(note_tenant)
@@ -0,0 +1,346 @@
+"""
+Capacity-aware scheduling engine.
+
+The planner works on plain data only (no Flask or SQLite), so it can be
+tested and benchmarked on its own. Work is allocated earliest-deadline-first
+against a per-day capacity; whatever doesn't fit on a day carries forward to
+the next one instead of being dropped.
+"""
+import heapq
+import importlib.util
+import math
+from collections import namedtuple
+from datetime import date, timedelta
+
+# Default hours available per day, and the share of that kept on weekends
+DEFAULT_DAILY_CAPACITY = 5
+DEFAULT_WEEKEND_FACTOR = 0.8
+
+# A task's remaining work, as the planner sees it. `available` is the first
+# day it can be worked on (an occurrence of a recurring task can't be
+# started before the one before it is due), or None for straight away.
+WorkItem = namedtuple('WorkItem', 'task_id title due_date hours available', defaults=(None,))
+
+# A task that can't be finished by its due date, and the hours missing
+LateTask = namedtuple('LateTask', 'task_id title due_date shortfall')
+
+# Problem size (tasks x days) from which the vectorized backend is used
+VECTORIZE_MIN_CELLS = 1000000
+
+# The planner's output: a dict mapping dates to lists of allocations
+# ({'task_id', 'title', 'hours'}), and the list of late tasks
+Plan = namedtuple('Plan', 'schedule late')
+
+
+def round_up_half(hours):
+    """Round hours up to the next half hour."""
+    return math.ceil(round(hours * 2, 6)) / 2
+
+
+def round_down_half(hours):
+    """Round hours down to the previous half hour."""
+    return math.floor(round(hours * 2, 6)) / 2
+
+
+def daily_capacities(start, days, capacity=DEFAULT_DAILY_CAPACITY,
+                     weekend_factor=DEFAULT_WEEKEND_FACTOR):
+    """
+    Return the hours available on each of `days` days from `start`.
+    Weekend days get `weekend_factor` of the weekday capacity. Capacities are
+    rounded down to half hours so every allocation stays a multiple of 0.5.
+    """
+    weekday = round_down_half(capacity)
+    weekend = round_down_half(capacity * weekend_factor)
+    return [
+        weekend if (start + timedelta(days=i)).weekday() >= 5 else weekday
+        for i in range(days)
+    ]
+
+
+def plan_schedule(items, start, capacities, backend='auto'):
+    """
+    Plan work items earliest-deadline-first against per-day capacities.
+
+    `items` is an iterable of WorkItem with the remaining hours of each task,
+    `capacities` the hours available on each day from `start`. Items due after
+    the planning window are left for a later window. Overdue items have the
+    earliest deadlines, so they are scheduled first. An item with an
+    `available` date joins the queue on that day.
+
+    `backend` is 'python', 'numpy' or 'auto', which picks NumPy for large
+    problems when it is installed. Both backends give identical plans.
+    """
+    items = list(items)
+    if choose_backend(len(items), len(capacities), backend) == 'numpy':
+        return plan_schedules_vectorized([items], start, capacities)[0]
+    return plan_schedule_python(items, start, capacities)
+
+
+def plan_schedules(workloads, start, capacities, backend='auto'):
+    """
+    Plan many independent workloads (one per user, say) over the same days.
+    `workloads` maps keys to iterables of WorkItem; returns a dict mapping
+    the same keys to Plans.
+    """
+    keys = list(workloads)
+    groups = [list(workloads[key]) for key in keys]
+    size = sum(len(items) for items in groups)
+
+    if choose_backend(size, len(capacities), backend) == 'numpy':
+        plans = plan_schedules_vectorized(groups, start, capacities)
+    else:
+        plans = [plan_schedule_python(items, start, capacities) for items in groups]
+    return dict(zip(keys, plans))
+
+
+def have_numpy():
+    """
+    Whether NumPy is installed. It is optional, only the vectorized backend
+    needs it, and it is imported on first use rather than at startup.
+    """
+    return importlib.util.find_spec('numpy') is not None
+
+
+def choose_backend(tasks, days, backend='auto'):
+    """Return the backend to plan a tasks x days problem with."""
+    if backend not in ('auto', 'python', 'numpy'):
+        raise ValueError(f"Unknown planning backend: {backend}")
+    if backend == 'numpy' and not have_numpy():
+        raise RuntimeError('The numpy planning backend requires NumPy')
+    if backend == 'auto':
+        if tasks * days >= VECTORIZE_MIN_CELLS and have_numpy():
+            return 'numpy'
+        return 'python'
+    return backend
+
+
+def plan_day(items, capacity):
+    """
+    Return the first day of plan_schedule()'s plan without planning the
+    rest of the window.
+
+    `items` must hold only work due within the window and available on the
+    first day, in (due_date, task_id) order, as an index scan returns it.
+    Items are consumed lazily and only until the day's `capacity` is used up.
+    """
+    day = []
+    available = capacity
+    for item in items:
+        if available <= 0:
+            break
+        hours = min(available, round_up_half(item.hours))
+        if hours <= 0:
+            continue
+        day.append({
+            'task_id': item.task_id,
+            'title': item.title,
+            'hours': hours
+        })
+        available -= hours
+    return day
+
+
+def plan_schedule_python(items, start, capacities):
+    """
+    Pure-Python backend of plan_schedule().
+
+    Runs in O((tasks + days) log tasks): every day either finishes a task or
+    fills up, so there are at most tasks + days heap operations.
+    """
+    days = len(capacities)
+    end = start + timedelta(days=days - 1)
+
+    schedule = {}
+    for i in range(days):
+        schedule[start + timedelta(days=i)] = []
+
+    # Heap entries are [due_date, task_id, title, hours, hours left, hours done by due date]
+    queue = []
+    # Entries not available yet, as (available, entry), in release order
+    waiting = []
+    for item in items:
+        hours = round_up_half(item.hours)
+        if hours <= 0 or item.due_date > end:
+            continue
+        entry = [item.due_date, item.task_id, item.title, hours, hours, 0]
+        if item.available is not None and item.available > start:
+            waiting.append((item.available, entry))
+        else:
+            queue.append(entry)
+    heapq.heapify(queue)
+    waiting.sort(key=lambda pair: pair[0], reverse=True)
+
+    late = []
+
+    def finish(entry):
+        due_date, task_id, title, hours, left, done = entry
+        if done < hours:
+            late.append(LateTask(task_id, title, due_date, hours - done))
+
+    for i, capacity in enumerate(capacities):
+        current_date = start + timedelta(days=i)
+        day = schedule[current_date]
+        available = capacity
+
+        while waiting and waiting[-1][0] <= current_date:
+            heapq.heappush(queue, waiting.pop()[1])
+
+        while available > 0 and queue:
+            entry = queue[0]
+            hours = min(available, entry[4])
+
+            day.append({
+                'task_id': entry[1],
+                'title': entry[2],
+                'hours': hours
+            })
+            available -= hours
+            entry[4] -= hours
+            if current_date <= entry[0]:
+                entry[5] += hours
+
+            # Overflow stays at the top of the queue for the next day
+            if entry[4] <= 0:
+                heapq.heappop(queue)
+                finish(entry)
+
+    # Anything still queued didn't fit in the window at all
+    while queue:
+        finish(heapq.heappop(queue))
+    for _, entry in waiting:
+        finish(entry)
+
+    late.sort(key=lambda task: (task.due_date, task.task_id))
+    return Plan(schedule, late)
+
+
+def plan_schedules_vectorized(workloads, start, capacities):
+    """
+    NumPy backend of plan_schedule(), planning a list of workloads at once.
+
+    With every task available from the first day, earliest-deadline-first is
+    a sequential fill: task k occupies the interval between the cumulative
+    hours of the tasks before it and including it, and day d the interval
+    between the cumulative capacities. The task x day allocation matrix is
+    the overlap of those intervals. Only its non-zero cells are built, as
+    coordinate arrays, which keeps memory at O(tasks + days). Workloads are
+    laid end to end on one timeline, so thousands of them are planned with
+    the same handful of array operations.
+
+    All hours are multiples of 0.5, so the float arithmetic is exact and the
+    plans are identical to the pure-Python backend. Workloads with items
+    that only become available later don't fit the sequential fill, so they
+    are planned by the pure-Python backend.
+    """
+    import numpy as np
+
+    workloads = [list(items) for items in workloads]
+    staggered = {group for group, items in enumerate(workloads)
+                 if any(item.available is not None and item.available > start for item in items)}
+    if staggered:
+        plans = plan_schedules_vectorized(
+            [[] if group in staggered else items for group, items in enumerate(workloads)],
+            start, capacities
+        )
+        for group in staggered:
+            plans[group] = plan_schedule_python(workloads[group], start, capacities)
+        return plans
+
+    days = len(capacities)
+    dates = [start + timedelta(days=i) for i in range(days)]
+    first_ordinal = start.toordinal()
+    end_ordinal = first_ordinal + days - 1
+
+    # Flatten the work items; titles stay in a Python list
+    groups, dues, ids, hours, titles = [], [], [], [], []
+    for group, items in enumerate(workloads):
+        for item in items:
+            item_hours = round_up_half(item.hours)
+            due_ordinal = item.due_date.toordinal()
+            if item_hours <= 0 or due_ordinal > end_ordinal:
+                continue
+            groups.append(group)
+            dues.append(due_ordinal)
+            ids.append(item.task_id)
+            hours.append(item_hours)
+            titles.append(item.title)
+
+    # Without any days there is nothing to vectorize
+    if not days:
+        return [plan_schedule_python(items, start, capacities) for items in workloads]
+
+    plans = [Plan({day: [] for day in dates}, []) for _ in workloads]
+    if not hours:
+        return plans
+
+    groups = np.asarray(groups, dtype=np.int64)
+    dues = np.asarray(dues, dtype=np.int64)
+    ids = np.asarray(ids)
+    hours = np.asarray(hours, dtype=float)
+
+    # Earliest deadline first within each workload, ties broken by task id
+    order = np.lexsort((ids, dues, groups))
+    groups, dues, ids, hours = groups[order], dues[order], ids[order], hours[order]
+
+    # Day intervals on the shared timeline
+    caps = np.asarray(capacities, dtype=float)
+    cap_end = np.cumsum(caps)
+    total = cap_end[-1]
+    offsets = np.arange(len(workloads)) * total
+    day_end = (offsets[:, None] + cap_end[None, :]).ravel()
+    day_start = day_end - np.tile(caps, len(workloads))
+
+    # Task intervals: cumulative hours restarted for each workload, with
+    # anything past the window's total capacity left unallocated
+    cumulative = np.cumsum(hours)
+    first_in_group = np.searchsorted(groups, groups, 'left')
+    task_end = cumulative - (cumulative[first_in_group] - hours[first_in_group])
+    task_start = task_end - hours
+    task_lo = offsets[groups] + np.minimum(task_start, total)
+    task_hi = offsets[groups] + np.minimum(task_end, total)
+
+    # Non-zero cells of the allocation matrix
+    first_day = np.searchsorted(day_end, task_lo, 'right')
+    last_day = np.searchsorted(day_end, task_hi, 'left')
+    span = np.where(task_hi > task_lo, last_day - first_day + 1, 0)
+    cells = np.repeat(np.arange(len(hours)), span)
+    steps = np.arange(span.sum()) - np.repeat(np.cumsum(span) - span, span)
+    cell_day = np.repeat(first_day, span) + steps
+    cell_hours = (np.minimum(task_hi[cells], day_end[cell_day])
+                  - np.maximum(task_lo[cells], day_start[cell_day]))
+
+    keep = cell_hours > 0
+    cells, cell_day, cell_hours = cells[keep], cell_day[keep], cell_hours[keep]
+    cell_order = np.lexsort((cells, cell_day))
+
+    task_ids = ids.tolist()
+    task_titles = [titles[i] for i in order.tolist()]
+    for task, day, allocated in zip(cells[cell_order].tolist(),
+                                    cell_day[cell_order].tolist(),
+                                    cell_hours[cell_order].tolist()):
+        group, index = divmod(day, days)
+        plans[group].schedule[dates[index]].append({
+            'task_id': task_ids[task],
+            'title': task_titles[task],
+            'hours': allocated
+        })
+
+    # Hours done by the end of each task's due date
+    due_index = dues - first_ordinal
+    due_end = np.where(
+        due_index >= 0,
+        offsets[groups] + cap_end[np.clip(due_index, 0, days - 1)],
+        offsets[groups]
+    )
+    done = np.clip(np.minimum(task_hi, due_end) - task_lo, 0, None)
+    shortfall = hours - done
+
+    late = np.flatnonzero(shortfall > 0)
+    for task, group, due, missing in zip(late.tolist(), groups[late].tolist(),
+                                         dues[late].tolist(), shortfall[late].tolist()):
+        plans[group].late.append(
+            LateTask(task_ids[task], task_titles[task],
+                     date.fromordinal(due), missing)
+        )
+
+    return plans
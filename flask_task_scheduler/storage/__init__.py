@@ -0,0 +1,86 @@
+"""
+The storage layer: every read and write of tasks, logs and the
+materialized schedule goes through a Storage (see storage.base), never raw SQL.
+
+STORAGE_BACKEND picks where the data lives:
+
+- 'sqlite' (the default): the DATABASE file, or a file per tenant, through
+  the connection pools in db.py.
+- 'server': a PostgreSQL-compatible server at STORAGE_DSN, through a
+  per-process pool of STORAGE_POOL_SIZE connections. Needs psycopg2.
+- 'standin': the server backend on an in-process SQLite stand-in at
+  STORAGE_DSN (a file path), for trying it out without a server.
+
+    storage = get_storage()
+    task = storage.tasks.get(task_id)
+    storage.logs.add(task_id, log_date, hours)
+    storage.commit()
+"""
+from flask import current_app, g
+
+from storage.conformance import storage_check_command
+from tenants import owner_id, tenant_id
+
+BACKENDS = ('sqlite', 'server', 'standin')
+
+
+def create_backend(config):
+    """Return the storage backend the config asks for."""
+    name = config['STORAGE_BACKEND']
+    if name not in BACKENDS:
+        raise ValueError(f"STORAGE_BACKEND must be one of {', '.join(BACKENDS)}.")
+    if name != 'sqlite' and config['MULTI_TENANT'] and config['TENANT_STORAGE'] == 'sharded':
+        raise ValueError("TENANT_STORAGE = 'sharded' needs the sqlite storage backend.")
+
+    if name == 'sqlite':
+        from storage.sqlite import SQLiteBackend
+        return SQLiteBackend()
+    if not config['STORAGE_DSN']:
+        raise ValueError(f'STORAGE_DSN is required for the {name} storage backend.')
+    if name == 'server':
+        from storage.server import ServerBackend, psycopg2_connect
+        return ServerBackend(psycopg2_connect(config['STORAGE_DSN']),
+                             pool_size=config['STORAGE_POOL_SIZE'])
+
+    from storage.standin import prepare_standin, standin_backend
+    prepare_standin(config['STORAGE_DSN'])
+    return standin_backend(config['STORAGE_DSN'], pool_size=config['STORAGE_POOL_SIZE'])
+
+
+def get_backend():
+    return current_app.extensions['storage']
+
+
+def get_storage():
+    """Return the current user's Storage for this request, opening it on first use."""
+    if 'storage' not in g:
+        g.storage = get_backend().open(owner_id())
+    return g.storage
+
+
+def open_storage():
+    """
+    Open a Storage for the current user with a connection of its own, for
+    work that outlives the request. The caller closes it.
+    """
+    return get_backend().open(owner_id(), detached=True)
+
+
+def close_storage(e=None):
+    storage = g.pop('storage', None)
+    if storage is None:
+        return
+    storage.close()
+
+    # Tasks or logs were written, so the materialized schedule is out of date
+    refresher = current_app.extensions.get('schedule_refresher')
+    if storage.changed and refresher is not None:
+        refresher.notify(tenant_id())
+
+
+def init_app(app):
+    """Set up the configured backend and the storage-check command."""
+    with app.app_context():
+        app.extensions['storage'] = create_backend(app.config)
+    app.teardown_appcontext(close_storage)
+    app.cli.add_command(storage_check_command)
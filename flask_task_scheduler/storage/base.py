@@ -0,0 +1,667 @@
+"""
+The storage interface, and the SQL both backends share.
+
+A Storage is opened per request for one tenant (its `owner`, see
+tenants.owner_id()) and groups four repositories:
+
+- `tasks`: tasks and their hours, plus the task_changes data version
+- `logs`: progress logs
+- `history`: the daily and weekly rollups of the logs
+- `schedules`: the materialized schedule, shared between worker processes
+
+Every statement is written once, with `?` placeholders, in SQL that SQLite
+and PostgreSQL both accept. The backends only differ in how they get a
+connection, bind parameters, scope rows to an owner and return new ids.
+"""
+from datetime import date, timedelta
+
+from scheduler import LateTask, Plan
+
+# Dashboard sort orders: (column, direction)
+TASK_SORTS = {
+    'due': ('due_date', 'ASC'),
+    '-due': ('due_date', 'DESC'),
+    'title': ('title', 'ASC'),
+}
+
+# The task columns the dashboard shows (descriptions can be long)
+TASK_LIST_COLUMNS = ('id', 'title', 'due_date', 'estimated_hours', 'hours_completed', 'status',
+                     'rrule')
+
+# Keep IN (...) lists below SQLite's default host parameter limit
+MAX_PARAMETERS = 500
+
+
+class Storage:
+    """
+    A connection to the task data for one tenant.
+
+    Subclasses provide execute() and the dialect hooks below; the
+    repositories build all their SQL from those.
+    """
+
+    def __init__(self, owner=None):
+        self.owner = owner
+        # Whether tasks or logs were written, so the schedule needs refreshing
+        self.changed = False
+        self.tasks = TaskRepository(self)
+        self.logs = LogRepository(self)
+        self.history = HistoryRepository(self)
+        self.schedules = ScheduleRepository(self)
+
+    # Backend hooks
+    def execute(self, sql, params=()):
+        """Run a statement and return a cursor over its rows."""
+        raise NotImplementedError
+
+    def stream(self, sql, params=()):
+        """
+        Run a query whose rows are read from the database as they are
+        fetched, not all at once, for reads of every task or log. SQLite
+        cursors already work that way.
+        """
+        return self.execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        raise NotImplementedError
+
+    def commit(self):
+        raise NotImplementedError
+
+    def rollback(self):
+        raise NotImplementedError
+
+    def begin_write(self):
+        """Start a transaction that will write, taking the write lock up front."""
+
+    def close(self):
+        """Give the connection back; the storage can't be used afterwards."""
+
+    def owner_clause(self, column='user_id'):
+        """Return the (SQL, params) condition for rows of this storage's owner."""
+        raise NotImplementedError
+
+    def insert_id(self, sql, params):
+        """Run an INSERT and return the id of the new row."""
+        raise NotImplementedError
+
+    def insert_ids(self, table, sql, seq_of_params):
+        """Run an INSERT for each set of params and return the new ids, in order."""
+        return [self.insert_id(sql, params) for params in seq_of_params]
+
+    def sync_sequence(self, table):
+        """Move a table's id sequence past rows inserted with explicit ids."""
+
+    # Shared helpers
+    def scoped(self, where, params, column='user_id'):
+        """Add the owner condition to a list of conditions and their params."""
+        clause, owner_params = self.owner_clause(column)
+        return [clause, *where], [*owner_params, *params]
+
+    def in_chunks(self, ids):
+        """Split ids into lists short enough for an IN (...) list."""
+        ids = list(ids)
+        for start in range(0, len(ids), MAX_PARAMETERS):
+            yield ids[start:start + MAX_PARAMETERS]
+
+
+def where_sql(where):
+    return ' WHERE ' + ' AND '.join(where) if where else ''
+
+
+def as_date(value):
+    """Return a DATE column value, or an ISO date string, as a date."""
+    if isinstance(value, str):
+        return date.fromisoformat(value)
+    return value
+
+
+def week_of(day):
+    """Return the Monday starting the week of a date."""
+    return day - timedelta(days=day.weekday())
+
+
+class TaskRepository:
+    """Tasks, their hours, and the data version their writes bump."""
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    def _select(self, columns, where=(), params=(), order='due_date', limit=None, stream=False):
+        where, params = self.storage.scoped(list(where), list(params))
+        sql = f"SELECT {', '.join(columns)} FROM tasks{where_sql(where)}"
+        if order:
+            sql += f' ORDER BY {order}'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        if stream:
+            return self.storage.stream(sql, params)
+        return self.storage.execute(sql, params)
+
+    # Reading
+    def all(self):
+        """Every task, in due date order."""
+        return self._select(['*']).fetchall()
+
+    def open(self):
+        """The tasks still to be worked on, in due date order."""
+        return self._select(['*'], ["status = 'pending'"]).fetchall()
+
+    def open_due_by(self, end):
+        """A cursor over the open one-off tasks due by `end`, in (due date, id) order."""
+        return self._select(TASK_LIST_COLUMNS, ["status = 'pending'", 'rrule IS NULL', 'due_date <= ?'],
+                            [end.isoformat()], order='due_date, id')
+
+    def recurring(self, end):
+        """The open recurring tasks whose first occurrence is by `end`."""
+        return self._select(TASK_LIST_COLUMNS, ["status = 'pending'", 'rrule IS NOT NULL', 'due_date <= ?'],
+                            [end.isoformat()], order='due_date, id').fetchall()
+
+    def for_calendar(self):
+        """A cursor over the (title, description, due_date, rrule) of every task."""
+        return self._select(('title', 'description', 'due_date', 'rrule'), stream=True)
+
+    def get(self, task_id, columns=('*',)):
+        """One task, or None if there is no such task or it isn't the owner's."""
+        return self._select(columns, ['id = ?'], [task_id], order=None).fetchone()
+
+    def by_ids(self, ids):
+        """The tasks with the given ids."""
+        tasks = []
+        for chunk in self.storage.in_chunks(ids):
+            placeholders = ', '.join('?' * len(chunk))
+            tasks += self._select(['*'], [f'id IN ({placeholders})'], chunk, order=None).fetchall()
+        return tasks
+
+    def existing_ids(self, ids, owned=True):
+        """
+        Return which of the given ids are taken by tasks; with `owned`,
+        only those of the owner's tasks.
+        """
+        found = set()
+        for chunk in self.storage.in_chunks(ids):
+            placeholders = ', '.join('?' * len(chunk))
+            where, params = [f'id IN ({placeholders})'], chunk
+            if owned:
+                where, params = self.storage.scoped(where, params)
+            found.update(row[0] for row in self.storage.execute(
+                f'SELECT id FROM tasks{where_sql(where)}', params
+            ))
+        return found
+
+    def page(self, columns=TASK_LIST_COLUMNS, status=None, due_from=None, due_to=None,
+             overdue=False, sort='due', after=None, limit=25):
+        """
+        Get one page of tasks, filtered and sorted in SQL.
+
+        Pages are keyset paginated: `after` is the (sort value, id) of the last
+        task on the previous page. Returns up to `limit` + 1 rows, the extra
+        one telling whether there is another page.
+        """
+        column, direction = TASK_SORTS[sort]
+        where = []
+        params = []
+
+        if overdue:
+            where.append("status = 'pending' AND rrule IS NULL AND due_date < ?")
+            params.append(date.today().isoformat())
+        elif status is not None:
+            where.append('status = ?')
+            params.append(status)
+        if due_from is not None:
+            where.append('due_date >= ?')
+            params.append(due_from.isoformat())
+        if due_to is not None:
+            where.append('due_date <= ?')
+            params.append(due_to.isoformat())
+        if after is not None:
+            where.append(f"({column}, id) {'>' if direction == 'ASC' else '<'} (?, ?)")
+            params.extend(after)
+
+        columns = list(dict.fromkeys([*columns, column, 'id']))
+        return self._select(columns, where, params, order=f'{column} {direction}, id {direction}',
+                            limit=limit + 1).fetchall()
+
+    def export(self, columns):
+        """A cursor over every task, in id order."""
+        return self._select(columns, order='id', stream=True)
+
+    # Writing
+    def create(self, title, description, due_date, estimated_hours, rrule=None):
+        """Add a task, recurring if given an `rrule`, and return its id."""
+        task_id = self.storage.insert_id(
+            'INSERT INTO tasks (title, description, due_date, estimated_hours, rrule, user_id) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (title, description, due_date, estimated_hours, rrule, self.storage.owner)
+        )
+        self.record_change(task_id)
+        return task_id
+
+    def update(self, task_id, title, description, due_date, estimated_hours, status, rrule=None):
+        where, params = self.storage.scoped(['id = ?'], [task_id])
+        self.storage.execute(
+            'UPDATE tasks SET title = ?, description = ?, due_date = ?, '
+            f'estimated_hours = ?, status = ?, rrule = ?{where_sql(where)}',
+            (title, description, due_date, estimated_hours, status, rrule, *params)
+        )
+        self.record_change(task_id)
+
+    def delete(self, task_id):
+        """Delete a task, its logs and their rollups."""
+        where, params = self.storage.logs.owned(['task_id = ?'], [task_id])
+        self.storage.execute(f'DELETE FROM task_logs{where_sql(where)}', params)
+        self.storage.history.delete_task(task_id)
+        where, params = self.storage.scoped(['id = ?'], [task_id])
+        self.storage.execute(f'DELETE FROM tasks{where_sql(where)}', params)
+        self.record_change(task_id)
+
+    def add_hours(self, totals):
+        """
+        Add hours to tasks' totals, completing one-off tasks that reach
+        their estimate, in one statement per task so concurrent writes can't
+        lose hours. `totals` maps task ids to hours.
+        """
+        clause, owner_params = self.storage.owner_clause()
+        self.storage.executemany(
+            'UPDATE tasks SET hours_completed = hours_completed + ?, '
+            "status = CASE WHEN rrule IS NULL AND hours_completed + ? >= estimated_hours "
+            "THEN 'completed' ELSE status END "
+            f'WHERE id = ? AND {clause}',
+            [(hours, hours, task_id, *owner_params) for task_id, hours in totals.items()]
+        )
+        for task_id in totals:
+            self.record_change(task_id)
+
+    def insert_many(self, rows, columns):
+        """
+        Insert tasks given as value tuples in `columns` order, `id` first
+        (None to assign one), owned by this storage's owner. Returns the
+        ids of the new tasks.
+        """
+        owner = self.storage.owner
+        explicit = [(*values, owner) for values in rows if values[0] is not None]
+        assigned = [(*values[1:], owner) for values in rows if values[0] is None]
+
+        # Rows with explicit ids go first, so the ids assigned to the others
+        # can't collide with them
+        ids = [values[0] for values in explicit]
+        if explicit:
+            self.storage.executemany(
+                f"INSERT INTO tasks ({', '.join(columns)}, user_id) "
+                f"VALUES ({', '.join('?' * (len(columns) + 1))})",
+                explicit
+            )
+            self.storage.sync_sequence('tasks')
+        if assigned:
+            ids += self.storage.insert_ids(
+                'tasks',
+                f"INSERT INTO tasks ({', '.join(columns[1:])}, user_id) "
+                f"VALUES ({', '.join('?' * len(columns))})",
+                assigned
+            )
+        self.record_changes(ids)
+        return ids
+
+    # Data versions
+    def data_version(self):
+        """Return the current data version, bumped by every task or log write."""
+        where, params = self.storage.scoped([], [])
+        return self.storage.execute(
+            f'SELECT MAX(version) FROM task_changes{where_sql(where)}', params
+        ).fetchone()[0] or 0
+
+    def record_change(self, task_id):
+        """Bump the data version for a write touching the given task."""
+        self.record_changes([task_id])
+
+    def record_changes(self, task_ids):
+        """
+        Bump the data version for writes touching the given tasks. Only a
+        task's latest change is kept: its old row is replaced by one with a
+        new version, so task_changes holds one row per task however often
+        it is written.
+        """
+        self.storage.changed = True
+        task_ids = list(dict.fromkeys(task_ids))
+        for chunk in self.storage.in_chunks(task_ids):
+            placeholders = ', '.join('?' * len(chunk))
+            self.storage.execute(f'DELETE FROM task_changes WHERE task_id IN ({placeholders})', chunk)
+        self.storage.executemany(
+            'INSERT INTO task_changes (task_id, user_id, changed_at) '
+            'VALUES (?, ?, CURRENT_TIMESTAMP)',
+            [(task_id, self.storage.owner) for task_id in task_ids]
+        )
+
+    def last_changed(self):
+        """Return when the latest change was made (naive UTC), or None."""
+        where, params = self.storage.scoped([], [])
+        row = self.storage.execute(
+            f'SELECT changed_at FROM task_changes{where_sql(where)} '
+            'ORDER BY version DESC LIMIT 1', params
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    def changed_since(self, version):
+        """Return the ids of the tasks changed after a data version."""
+        where, params = self.storage.scoped(['version > ?'], [version])
+        return [row[0] for row in self.storage.execute(
+            f'SELECT DISTINCT task_id FROM task_changes{where_sql(where)}', params
+        )]
+
+
+class LogRepository:
+    """Progress logs. Logs belong to the owner of their task."""
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    def owned(self, where, params):
+        """Restrict to logs of the owner's tasks."""
+        clause, owner_params = self.storage.owner_clause()
+        return ([f'task_id IN (SELECT id FROM tasks WHERE {clause})', *where],
+                [*owner_params, *params])
+
+    def add(self, task_id, log_date, hours):
+        """
+        Log progress on a task and add the hours to its total and the
+        rollups. The caller makes sure the task is the owner's.
+        """
+        self.storage.execute(
+            'INSERT INTO task_logs (task_id, log_date, hours) VALUES (?, ?, ?)',
+            (task_id, log_date, hours)
+        )
+        self.storage.tasks.add_hours({task_id: hours})
+        self.storage.history.record([(task_id, log_date, hours, 1)])
+
+    def for_task(self, task_id, limit=None, offset=0):
+        """A task's logs, newest first, optionally one page at a time."""
+        where, params = self.owned(['task_id = ?'], [task_id])
+        sql = f'SELECT * FROM task_logs{where_sql(where)} ORDER BY log_date DESC, id DESC'
+        if limit is not None:
+            sql += ' LIMIT ? OFFSET ?'
+            params += [limit, offset]
+        return self.storage.execute(sql, params).fetchall()
+
+    def task_page(self, task_id, columns, after=None, limit=50):
+        """A page of a task's logs, newest first, keyset paginated on (log_date, id)."""
+        where, params = self.owned(['task_id = ?'], [task_id])
+        if after is not None:
+            where.append('(log_date, id) < (?, ?)')
+            params.extend(after)
+        columns = list(dict.fromkeys([*columns, 'log_date', 'id']))
+        return self.storage.execute(
+            f"SELECT {', '.join(columns)} FROM task_logs{where_sql(where)} "
+            'ORDER BY log_date DESC, id DESC LIMIT ?', [*params, limit + 1]
+        ).fetchall()
+
+    def page(self, columns, after=None, limit=50):
+        """A page of every log, in the order they were recorded."""
+        where, params = self.owned([], [])
+        if after is not None:
+            where.append('id > ?')
+            params.extend(after)
+        columns = list(dict.fromkeys([*columns, 'id']))
+        return self.storage.execute(
+            f"SELECT {', '.join(columns)} FROM task_logs{where_sql(where)} "
+            'ORDER BY id LIMIT ?', [*params, limit + 1]
+        ).fetchall()
+
+    def existing_ids(self, ids):
+        """Return which of the given ids are taken by logs."""
+        found = set()
+        for chunk in self.storage.in_chunks(ids):
+            placeholders = ', '.join('?' * len(chunk))
+            found.update(row[0] for row in self.storage.execute(
+                f'SELECT id FROM task_logs WHERE id IN ({placeholders})', chunk
+            ))
+        return found
+
+    def insert_many(self, rows, columns):
+        """Insert logs given as value tuples in `columns` order, and add them to the rollups."""
+        self.storage.executemany(
+            f"INSERT INTO task_logs ({', '.join(columns)}) "
+            f"VALUES ({', '.join('?' * len(columns))})",
+            rows
+        )
+        logs = (dict(zip(columns, values)) for values in rows)
+        self.storage.history.record([(log['task_id'], log['log_date'], log['hours'], 1) for log in logs])
+
+    def export(self, columns):
+        """A cursor over every log of the owner's tasks, in id order."""
+        where, params = self.owned([], [])
+        return self.storage.stream(
+            f"SELECT {', '.join(columns)} FROM task_logs{where_sql(where)} ORDER BY id", params
+        )
+
+
+class HistoryRepository:
+    """
+    The rollups of the logs: hours per task per day (task_log_daily) and
+    per week starting on Monday (task_log_weekly). Every log written
+    through the storage is added to both, so history reads at most one row
+    per task per day or week however many logs there were, and old logs
+    can be compacted away.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    def record(self, logs):
+        """Add (task_id, log_date, hours, entries) to the rollups."""
+        daily, weekly = {}, {}
+        for task_id, log_date, hours, entries in logs:
+            day = as_date(log_date)
+            for totals, key in ((daily, (task_id, day)), (weekly, (task_id, week_of(day)))):
+                total = totals.setdefault(key, [0, 0])
+                total[0] += hours
+                total[1] += entries
+
+        owner = self.storage.owner
+        for table, column, totals in (('task_log_daily', 'day', daily),
+                                      ('task_log_weekly', 'week', weekly)):
+            if not totals:
+                continue
+            self.storage.executemany(
+                f'INSERT INTO {table} (task_id, user_id, {column}, hours, entries) '
+                f'VALUES (?, ?, ?, ?, ?) ON CONFLICT (task_id, {column}) DO UPDATE SET '
+                f'hours = {table}.hours + excluded.hours, entries = {table}.entries + excluded.entries',
+                [(task_id, owner, day.isoformat(), hours, entries)
+                 for (task_id, day), (hours, entries) in totals.items()]
+            )
+
+    def delete_task(self, task_id):
+        where, params = self.storage.scoped(['task_id = ?'], [task_id])
+        for table in ('task_log_daily', 'task_log_weekly'):
+            self.storage.execute(f'DELETE FROM {table}{where_sql(where)}', params)
+
+    def _totals(self, table, column, first, last, task_id=None):
+        where, params = self.storage.scoped([f'{column} >= ?', f'{column} <= ?'],
+                                            [first.isoformat(), last.isoformat()])
+        if task_id is not None:
+            where.append('task_id = ?')
+            params.append(task_id)
+        return self.storage.execute(
+            f'SELECT {column}, SUM(hours) AS hours, SUM(entries) AS entries '
+            f'FROM {table}{where_sql(where)} GROUP BY {column} ORDER BY {column}', params
+        ).fetchall()
+
+    def per_day(self, first, last, task_id=None):
+        """(day, hours, entries) for each day from `first` to `last` with logs, in order."""
+        return self._totals('task_log_daily', 'day', first, last, task_id)
+
+    def per_week(self, first, last, task_id=None):
+        """(week, hours, entries) for each week from `first` to `last` with logs, in order."""
+        return self._totals('task_log_weekly', 'week', week_of(first), last, task_id)
+
+    def per_task(self, first, last, limit=50):
+        """
+        (task_id, title, hours, entries) of the weeks from `first` to
+        `last`, for the `limit` tasks with the most hours.
+        """
+        where, params = self.storage.scoped(['w.week >= ?', 'w.week <= ?'],
+                                            [week_of(first).isoformat(), last.isoformat()],
+                                            column='w.user_id')
+        return self.storage.execute(
+            'SELECT w.task_id, t.title, SUM(w.hours) AS hours, SUM(w.entries) AS entries '
+            f'FROM task_log_weekly w JOIN tasks t ON t.id = w.task_id{where_sql(where)} '
+            'GROUP BY w.task_id, t.title ORDER BY SUM(w.hours) DESC, w.task_id LIMIT ?',
+            [*params, limit]
+        ).fetchall()
+
+    def hours_after(self, task_ids, after):
+        """
+        Return the hours logged on each of the given tasks after a date, as
+        (task_id, day, hours) rows.
+        """
+        rows = []
+        for chunk in self.storage.in_chunks(task_ids):
+            placeholders = ', '.join('?' * len(chunk))
+            where, params = self.storage.scoped([f'task_id IN ({placeholders})', 'day > ?'],
+                                                [*chunk, after.isoformat()])
+            rows += self.storage.execute(
+                f'SELECT task_id, day, hours FROM task_log_daily{where_sql(where)}', params
+            ).fetchall()
+        return rows
+
+    def compact(self, before):
+        """
+        Fold the owner's logs dated before `before` into the rollups and
+        delete them, in one transaction. The rollups already count every
+        log written through the storage; any hours they are missing (logs
+        written around it) are added first, so the totals stay the same.
+        Returns the number of logs deleted and their hours.
+        """
+        storage = self.storage
+        storage.begin_write()
+        try:
+            where, params = storage.logs.owned(['log_date < ?'], [before.isoformat()])
+            logs = storage.execute(
+                'SELECT task_id, log_date, SUM(hours) AS hours, COUNT(*) AS entries '
+                f'FROM task_logs{where_sql(where)} GROUP BY task_id, log_date', params
+            ).fetchall()
+
+            rolled_where, rolled_params = storage.scoped(['day < ?'], [before.isoformat()])
+            rolled = {(row['task_id'], as_date(row['day'])): row['hours'] for row in storage.execute(
+                f'SELECT task_id, day, hours FROM task_log_daily{where_sql(rolled_where)}', rolled_params
+            )}
+            missing = []
+            for log in logs:
+                key = (log['task_id'], as_date(log['log_date']))
+                if key not in rolled:
+                    missing.append((*key, log['hours'], log['entries']))
+                elif rolled[key] < log['hours']:
+                    missing.append((*key, log['hours'] - rolled[key], 0))
+            self.record(missing)
+
+            storage.execute(f'DELETE FROM task_logs{where_sql(where)}', params)
+            if logs:
+                # The raw logs the API lists have changed
+                storage.tasks.record_changes({log['task_id'] for log in logs})
+            storage.commit()
+        except Exception:
+            storage.rollback()
+            raise
+        return sum(log['entries'] for log in logs), sum(log['hours'] for log in logs)
+
+
+class ScheduleRepository:
+    """
+    The materialized schedule: computed plans saved per horizon, one row
+    per task per day, so requests read a range of dates instead of
+    planning. A plan's rows are current for its start date and the data
+    version it was planned at; only the latest plan per horizon is kept.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    def is_current(self, days, start, version):
+        """Whether the saved plan for this horizon starts on `start` and is at `version`."""
+        where, params = self.storage.scoped(
+            ['days = ?', 'start_date = ?', 'version = ?'], [days, start.isoformat(), version]
+        )
+        return self.storage.execute(
+            f'SELECT 1 FROM schedule_state{where_sql(where)}', params
+        ).fetchone() is not None
+
+    def entries(self, days, first, last):
+        """Return the saved sessions from `first` to `last`, as a dict of dates to lists."""
+        where, params = self.storage.scoped(
+            ['e.days = ?', 'e.date >= ?', 'e.date <= ?'],
+            [days, first.isoformat(), last.isoformat()], column='e.user_id'
+        )
+        sessions = {}
+        for row in self.storage.execute(
+            'SELECT e.date, e.task_id, t.title, e.hours FROM schedule_entries e '
+            f'JOIN tasks t ON t.id = e.task_id{where_sql(where)} ORDER BY e.date, e.id', params
+        ):
+            sessions.setdefault(row['date'], []).append({
+                'task_id': row['task_id'],
+                'title': row['title'],
+                'hours': row['hours']
+            })
+        return sessions
+
+    def day(self, days, day, version):
+        """Return the sessions of the plan's first day, or None if it isn't current."""
+        if not self.is_current(days, day, version):
+            return None
+        return self.entries(days, day, day).get(day, [])
+
+    def load(self, days, start, version):
+        """Return the saved Plan for this horizon, or None if it isn't current."""
+        if not self.is_current(days, start, version):
+            return None
+
+        schedule = {start + timedelta(days=i): [] for i in range(days)}
+        schedule.update(self.entries(days, start, start + timedelta(days=days - 1)))
+
+        where, params = self.storage.scoped(['l.days = ?'], [days], column='l.user_id')
+        late = [LateTask(row['task_id'], row['title'], row['due_date'], row['shortfall'])
+                for row in self.storage.execute(
+                    'SELECT l.task_id, t.title, l.due_date, l.shortfall FROM schedule_late l '
+                    f'JOIN tasks t ON t.id = l.task_id{where_sql(where)} '
+                    'ORDER BY l.due_date, l.task_id', params
+                )]
+        return Plan(schedule, late)
+
+    def save(self, days, start, version, plan, elapsed_ms=0):
+        """Replace the saved plan for this horizon, and commit."""
+        owner = self.storage.owner
+        self.storage.begin_write()
+        try:
+            where, params = self.storage.scoped(['days = ?'], [days])
+            for table in ('schedule_entries', 'schedule_late', 'schedule_state'):
+                self.storage.execute(f'DELETE FROM {table}{where_sql(where)}', params)
+
+            self.storage.executemany(
+                'INSERT INTO schedule_entries (user_id, days, date, task_id, hours) '
+                'VALUES (?, ?, ?, ?, ?)',
+                [(owner, days, day.isoformat(), session['task_id'], session['hours'])
+                 for day, sessions in plan.schedule.items() for session in sessions]
+            )
+            if plan.late:
+                self.storage.executemany(
+                    'INSERT INTO schedule_late (user_id, days, task_id, due_date, shortfall) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    [(owner, days, task.task_id, task.due_date.isoformat(), task.shortfall)
+                     for task in plan.late]
+                )
+            self.storage.execute(
+                'INSERT INTO schedule_state (user_id, days, start_date, version, refreshed_at, elapsed_ms) '
+                'VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP, ?)',
+                (owner, days, start.isoformat(), version, elapsed_ms)
+            )
+            self.storage.commit()
+        except Exception:
+            self.storage.rollback()
+            raise
+
+    def state(self):
+        """The horizon, start date, version, refresh time and planning time of each saved plan."""
+        where, params = self.storage.scoped([], [])
+        return self.storage.execute(
+            'SELECT days, start_date, version, refreshed_at, elapsed_ms '
+            f'FROM schedule_state{where_sql(where)} ORDER BY days', params
+        ).fetchall()
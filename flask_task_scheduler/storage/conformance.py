@@ -0,0 +1,537 @@
+"""
+Conformance checks and a benchmark for storage backends.
+
+Every backend must give the same answers to the same calls. The checks
+here run the repositories through the behaviour the routes depend on
+(ownership, keyset pages, data versions, atomic hour totals under
+concurrent writers, the materialized schedule) against a fresh database,
+and the benchmark times the common operations, so backends can be
+compared like for like:
+
+    flask storage-check                      # sqlite and the stand-in
+    flask storage-check --benchmark 5000
+    flask storage-check --dsn postgresql://localhost/scratch
+
+The SQLite and stand-in databases are temporary files, so neither needs a
+server. A --dsn database must be an empty scratch database with
+storage/server_schema.sql applied; the checks leave their rows behind.
+"""
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+import click
+from flask.cli import with_appcontext
+
+from scheduler import LateTask, Plan
+
+TASK_COLUMNS = ('id', 'title', 'description', 'due_date', 'estimated_hours',
+                'hours_completed', 'status')
+
+CHECKS = []
+
+
+def check(function):
+    """Register a conformance check: a function of `open_storage(owner)`."""
+    CHECKS.append(function)
+    return function
+
+
+class CheckFailed(Exception):
+    pass
+
+
+def expect(condition, message):
+    if not condition:
+        raise CheckFailed(message)
+
+
+def add_tasks(storage, count, start=None, hours=2):
+    """Create `count` pending tasks due on consecutive days, returning their ids."""
+    start = start or date.today()
+    ids = [storage.tasks.create(f'Task {i}', '', (start + timedelta(days=i)).isoformat(), hours)
+           for i in range(count)]
+    storage.commit()
+    return ids
+
+
+# Checks. Each uses owners of its own, so they can share one database.
+@check
+def task_round_trip(open_storage):
+    storage = open_storage(101)
+    task_id = storage.tasks.create('Essay', 'Draft', '2030-01-15', 4)
+    storage.commit()
+
+    task = storage.tasks.get(task_id)
+    expect(task is not None, 'a created task can be read back')
+    expect((task['title'], task['description'], task['estimated_hours'], task['hours_completed'],
+            task['status']) == ('Essay', 'Draft', 4, 0, 'pending'),
+           f'task columns round-trip, got {tuple(task)}')
+    expect(task['due_date'] == date(2030, 1, 15), f"due dates read back as dates, got {task['due_date']!r}")
+
+    storage.tasks.update(task_id, 'Essay v2', 'Final', '2030-02-01', 6, 'completed')
+    storage.commit()
+    task = storage.tasks.get(task_id, ('title', 'status'))
+    expect((task['title'], task['status']) == ('Essay v2', 'completed'), 'updates are saved')
+
+    storage.logs.add(task_id, '2030-01-01', 1)
+    storage.tasks.delete(task_id)
+    storage.commit()
+    expect(storage.tasks.get(task_id) is None, 'deleted tasks are gone')
+    expect(storage.logs.for_task(task_id) == [], "a deleted task's logs are gone")
+    storage.close()
+
+
+@check
+def owners_are_isolated(open_storage):
+    alice, bob, nobody = open_storage(102), open_storage(103), open_storage(None)
+    task_id = add_tasks(alice, 1)[0]
+    alice.logs.add(task_id, date.today().isoformat(), 1)
+    alice.commit()
+
+    for other in (bob, nobody):
+        expect(other.tasks.get(task_id) is None, "other owners can't read a task")
+        expect(task_id not in [task['id'] for task in other.tasks.all()], "other owners don't list a task")
+        expect(other.logs.for_task(task_id) == [], "other owners can't read a task's logs")
+        expect(other.tasks.existing_ids([task_id]) == set(), "owned ids are only the owner's")
+        expect(other.tasks.existing_ids([task_id], owned=False) == {task_id}, 'ids are unique across owners')
+
+    bob.tasks.update(task_id, 'Hijacked', '', '2030-01-01', 1, 'pending')
+    bob.tasks.delete(task_id)
+    bob.commit()
+    expect(alice.tasks.get(task_id)['title'] == 'Task 0', "other owners can't change or delete a task")
+    for storage in (alice, bob, nobody):
+        storage.close()
+
+
+@check
+def keyset_pages(open_storage):
+    storage = open_storage(104)
+    start = date.today() - timedelta(days=5)
+    # Pairs of tasks sharing a due date, to exercise the id tie-breaker
+    for i in range(23):
+        storage.tasks.create(f'Task {i:02d}', '', (start + timedelta(days=i // 2)).isoformat(), 1)
+    storage.commit()
+    everything = storage.tasks.all()
+
+    for sort, key, reverse in (('due', 'due_date', False), ('-due', 'due_date', True),
+                               ('title', 'title', False)):
+        expected = [task['id'] for task in sorted(
+            everything, key=lambda task: (task[key], task['id']), reverse=reverse)]
+        seen = []
+        after = None
+        while True:
+            rows = storage.tasks.page(sort=sort, after=after, limit=5)
+            page = rows[:5]
+            seen += [row['id'] for row in page]
+            if len(rows) <= 5:
+                break
+            after = (page[-1][key], page[-1]['id'])
+        expect(seen == expected, f"pages sorted by {sort} list every task once, in order")
+
+    overdue = storage.tasks.page(overdue=True, limit=100)
+    expect(all(row['due_date'] < date.today() for row in overdue) and len(overdue) == 10,
+           f'overdue lists the pending tasks due before today, got {len(overdue)}')
+    ranged = storage.tasks.page(due_from=start + timedelta(days=2), due_to=start + timedelta(days=3), limit=100)
+    expect(len(ranged) == 4, f'due date ranges are inclusive, got {len(ranged)}')
+    storage.close()
+
+
+@check
+def open_tasks_in_due_order(open_storage):
+    storage = open_storage(105)
+    ids = add_tasks(storage, 10)
+    storage.tasks.update(ids[3], 'Done', '', date.today().isoformat(), 1, 'completed')
+    storage.commit()
+
+    end = date.today() + timedelta(days=6)
+    due = [row['id'] for row in storage.tasks.open_due_by(end)]
+    expect(due == [task_id for task_id in ids[:7] if task_id != ids[3]],
+           'open_due_by lists open tasks due by the date, in due date order')
+    expect([row['id'] for row in storage.tasks.open()] == [i for i in ids if i != ids[3]],
+           'open lists every pending task')
+    expect(len(storage.tasks.by_ids(ids[:4])) == 4, 'by_ids finds every task')
+    storage.close()
+
+
+@check
+def logs_add_up(open_storage):
+    storage = open_storage(106)
+    task_id = add_tasks(storage, 1, hours=3)[0]
+    for day in range(3):
+        storage.logs.add(task_id, (date.today() - timedelta(days=day)).isoformat(), 1)
+    storage.commit()
+
+    task = storage.tasks.get(task_id)
+    expect(task['hours_completed'] == 3 and task['status'] == 'completed',
+           'logged hours add up and complete the task at its estimate')
+    logs = storage.logs.for_task(task_id)
+    expect([log['log_date'] for log in logs] == sorted((log['log_date'] for log in logs), reverse=True),
+           'logs are listed newest first')
+    expect(len(storage.logs.for_task(task_id, limit=2, offset=2)) == 1, 'logs page by offset')
+
+    rows = storage.logs.task_page(task_id, ('hours',), limit=2)
+    expect(len(rows) == 3, 'log pages fetch one row past the limit')
+    rows = storage.logs.task_page(task_id, ('hours',), after=(rows[1]['log_date'], rows[1]['id']), limit=2)
+    expect(len(rows) == 1, 'log pages continue after the cursor')
+    expect(len(storage.logs.page(('hours',), limit=10)) == 3, 'every log of the owner is listed')
+    storage.close()
+
+
+@check
+def recurring_tasks(open_storage):
+    storage = open_storage(114)
+    today = date.today()
+    one_off = add_tasks(storage, 1)[0]
+    task_id = storage.tasks.create('Problem set', '', (today - timedelta(days=14)).isoformat(), 2,
+                                   'FREQ=WEEKLY')
+    storage.commit()
+
+    expect(storage.tasks.get(task_id)['rrule'] == 'FREQ=WEEKLY', 'rules round-trip')
+    end = today + timedelta(days=6)
+    expect([row['id'] for row in storage.tasks.open_due_by(end)] == [one_off],
+           'open_due_by lists only one-off tasks')
+    expect([row['id'] for row in storage.tasks.recurring(end)] == [task_id],
+           'recurring lists the open recurring tasks')
+
+    storage.logs.add(task_id, (today - timedelta(days=8)).isoformat(), 1)
+    storage.logs.add(task_id, today.isoformat(), 1.5)
+    storage.logs.add(task_id, today.isoformat(), 1)
+    storage.commit()
+    task = storage.tasks.get(task_id)
+    expect(task['hours_completed'] == 3.5 and task['status'] == 'pending',
+           "hours add up on a recurring task without completing it")
+    rows = storage.history.hours_after([task_id], today - timedelta(days=7))
+    expect([(row['task_id'], row['hours']) for row in rows] == [(task_id, 2.5)],
+           'hours_after totals the logs after the date per day')
+    storage.close()
+
+
+@check
+def log_rollups(open_storage):
+    storage = open_storage(115)
+    today = date.today()
+    monday = today - timedelta(days=today.weekday())
+    first, second = add_tasks(storage, 2, hours=100)
+    for day, task_id, hours in ((0, first, 1), (0, first, 2), (1, first, 0.5), (8, second, 1.5)):
+        storage.logs.add(task_id, (monday - timedelta(days=day)).isoformat(), hours)
+    storage.logs.insert_many([(second, (monday - timedelta(days=8)).isoformat(), 1)],
+                             ('task_id', 'log_date', 'hours'))
+    storage.commit()
+
+    start = monday - timedelta(days=14)
+    days = [(row['day'], row['hours'], row['entries']) for row in storage.history.per_day(start, today)]
+    expect(days == [(monday - timedelta(days=8), 2.5, 2), (monday - timedelta(days=1), 0.5, 1),
+                    (monday, 3, 2)], f'daily rollups total each day, got {days}')
+    weeks = [(row['week'], row['hours']) for row in storage.history.per_week(start, today)]
+    expect(weeks == [(monday - timedelta(days=14), 2.5), (monday - timedelta(days=7), 0.5), (monday, 3)],
+           f'weekly rollups total each week from Monday, got {weeks}')
+    tasks = [(row['task_id'], row['hours']) for row in storage.history.per_task(start, today)]
+    expect(tasks == [(first, 3.5), (second, 2.5)], f'per-task totals, most hours first, got {tasks}')
+    expect(open_storage(116).history.per_day(start, today) == [], "rollups are the owner's")
+
+    logs, hours = storage.history.compact(monday)
+    expect((logs, hours) == (3, 3), f'compaction deletes the logs before the date, got {(logs, hours)}')
+    expect(len(storage.logs.for_task(second)) == 0 and len(storage.logs.for_task(first)) == 2,
+           'only older logs are compacted')
+    expect([(row['task_id'], row['hours']) for row in storage.history.per_task(start, today)] == tasks,
+           'compaction keeps the totals')
+
+    storage.tasks.delete(first)
+    storage.commit()
+    expect([row['hours'] for row in storage.history.per_week(start, today)] == [2.5],
+           "a deleted task's rollups are gone")
+    storage.close()
+
+
+@check
+def data_versions(open_storage):
+    storage = open_storage(107)
+    version = storage.tasks.data_version()
+    ids = add_tasks(storage, 2)
+    after_create = storage.tasks.data_version()
+    expect(after_create > version, 'creating tasks moves the data version on')
+    expect(set(storage.tasks.changed_since(version)) == set(ids), 'changed_since lists the tasks written')
+
+    storage.logs.add(ids[0], date.today().isoformat(), 0.5)
+    storage.commit()
+    expect(storage.tasks.data_version() > after_create, 'logging moves the data version on')
+    expect(storage.tasks.changed_since(after_create) == [ids[0]], 'changed_since only lists later writes')
+    expect(storage.tasks.last_changed() is not None, 'the time of the last change is kept')
+
+    before_bulk = storage.tasks.data_version()
+    storage.tasks.record_changes([ids[0], ids[1], ids[0]])
+    storage.logs.add(ids[0], date.today().isoformat(), 0.5)
+    storage.commit()
+    expect(storage.tasks.data_version() > before_bulk, 'rewriting a task moves the data version on')
+    expect(set(storage.tasks.changed_since(version)) == set(ids), 'rewritten tasks are still listed')
+    rows = storage.execute(
+        'SELECT COUNT(*) FROM task_changes WHERE task_id IN (?, ?)', ids
+    ).fetchone()[0]
+    expect(rows == 2, 'only the latest change to each task is kept')
+
+    other = open_storage(108)
+    expect(other.tasks.data_version() == 0, "each owner's data version is its own")
+    storage.close()
+    other.close()
+
+
+@check
+def bulk_inserts(open_storage):
+    storage = open_storage(109)
+    storage.begin_write()
+    ids = storage.tasks.insert_many([
+        (900001, 'Explicit', '', '2030-01-01', 1, 0, 'pending'),
+        (None, 'Assigned', '', '2030-01-02', 1, 0, 'pending'),
+        (None, 'Assigned too', '', '2030-01-03', 1, 0, 'pending'),
+    ], TASK_COLUMNS)
+    storage.commit()
+
+    expect(len(ids) == len(set(ids)) == 3 and 900001 in ids, f'explicit and assigned ids are kept, got {ids}')
+    expect(storage.tasks.existing_ids(ids) == set(ids), 'every inserted task is there')
+    next_id = storage.tasks.create('After', '', '2030-01-04', 1)
+    storage.commit()
+    expect(next_id > 900001, 'new ids are assigned past explicit ones')
+
+    storage.logs.insert_many([(None, ids[1], '2030-01-01', 1.5), (None, ids[1], '2030-01-02', 1)],
+                             ('id', 'task_id', 'log_date', 'hours'))
+    storage.tasks.add_hours({ids[1]: 2.5})
+    storage.commit()
+    expect(storage.tasks.get(ids[1])['hours_completed'] == 2.5, 'bulk hours are added to the total')
+    exported = [row[0] for row in storage.logs.export(('id',))]
+    expect(len(exported) == 2 and storage.logs.existing_ids(exported) == set(exported), 'logs export')
+    storage.close()
+
+
+@check
+def rollback_discards(open_storage):
+    storage = open_storage(110)
+    storage.begin_write()
+    storage.tasks.create('Discarded', '', '2030-01-01', 1)
+    storage.rollback()
+    expect(storage.tasks.all() == [], 'rolled back writes are discarded')
+    storage.close()
+
+
+@check
+def concurrent_writers(open_storage):
+    storage = open_storage(111)
+    task_id = add_tasks(storage, 1, hours=1000)[0]
+    storage.close()
+
+    writers, logs_each = 4, 10
+    errors = []
+
+    def write():
+        try:
+            writer = open_storage(111)
+            for _ in range(logs_each):
+                for attempt in range(50):
+                    try:
+                        writer.begin_write()
+                        writer.logs.add(task_id, date.today().isoformat(), 0.5)
+                        writer.commit()
+                        break
+                    except writer.Error:
+                        writer.rollback()
+                        time.sleep(0.01)
+            writer.close()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write) for _ in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    storage = open_storage(111)
+    expect(not errors, f'writers succeed, got {errors!r}')
+    total = storage.tasks.get(task_id)['hours_completed']
+    expect(total == writers * logs_each * 0.5, f'concurrent writers lose no hours, got {total}')
+    storage.close()
+
+
+@check
+def materialized_schedule(open_storage):
+    storage = open_storage(112)
+    today = date.today()
+    first, second = add_tasks(storage, 2)
+    plan = Plan({today: [{'task_id': first, 'title': 'Task 0', 'hours': 2.5},
+                         {'task_id': second, 'title': 'Task 1', 'hours': 1}],
+                 today + timedelta(days=1): [],
+                 today + timedelta(days=2): [{'task_id': second, 'title': 'Task 1', 'hours': 1}]},
+                [LateTask(first, 'Task 0', today, 1.5)])
+    storage.schedules.save(3, today, 3, plan)
+    expect(storage.schedules.load(3, today, 3) == plan, 'a saved plan loads back equal')
+    expect(storage.schedules.day(3, today, 3) == plan.schedule[today], "the first day's sessions are read alone")
+    expect(storage.schedules.entries(3, today + timedelta(days=1), today + timedelta(days=2))
+           == {today + timedelta(days=2): plan.schedule[today + timedelta(days=2)]},
+           'date ranges list only the days in them with sessions')
+    expect(storage.schedules.load(3, today, 4) is None, 'plans of an older data version are not current')
+    expect(storage.schedules.load(3, today + timedelta(days=1), 3) is None, 'plans of another day are not current')
+    expect(open_storage(113).schedules.load(3, today, 3) is None, "plans are the owner's")
+
+    storage.schedules.save(3, today, 4, Plan({today + timedelta(days=i): [] for i in range(3)}, []))
+    expect(storage.schedules.entries(3, today, today + timedelta(days=2)) == {},
+           "saving a plan replaces the horizon's rows")
+    expect([row['days'] for row in storage.schedules.state()] == [3], 'one plan is kept per horizon')
+    storage.close()
+
+
+@check
+def streamed_reads(open_storage):
+    storage = open_storage(117)
+    ids = add_tasks(storage, 1200, hours=1)
+    storage.logs.insert_many([(None, task_id, '2030-01-01', 0.5) for task_id in ids],
+                             ('id', 'task_id', 'log_date', 'hours'))
+    storage.commit()
+
+    # More rows than a server-side cursor fetches at once
+    cursor = storage.tasks.export(('id', 'title'))
+    rows = []
+    while True:
+        batch = cursor.fetchmany(700)
+        if not batch:
+            break
+        rows += batch
+    expect([row['id'] for row in rows] == sorted(ids), 'exports read every task, in id order')
+    expect(rows[0]['title'] == 'Task 0', 'streamed rows are readable by column name')
+    expect(sum(1 for _ in storage.tasks.for_calendar()) == 1200, 'the calendar reads every task')
+    expect(len(list(storage.logs.export(('id',)))) == 1200, 'exports read every log')
+    storage.close()
+
+
+@check
+def sql_literals(open_storage):
+    storage = open_storage(118)
+    row = storage.execute("SELECT 'why?', '100%', ? || '%'", ['50']).fetchone()
+    expect(tuple(row) == ('why?', '100%', '50%'), f'? and % in string literals are kept, got {tuple(row)}')
+    storage.close()
+
+
+def run_checks(open_storage):
+    """Run every check, returning (name, error or None) pairs."""
+    results = []
+    for function in CHECKS:
+        try:
+            function(open_storage)
+            results.append((function.__name__, None))
+        except Exception as e:
+            results.append((function.__name__, e))
+    return results
+
+
+# Benchmark
+def timed_ops(label, count, run):
+    started = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - started
+    return label, count, elapsed * 1000 / count
+
+
+def run_benchmark(open_storage, size):
+    """Time the common operations on `size` tasks, returning (operation, count, ms each)."""
+    storage = open_storage(201)
+    today = date.today()
+    rows = [(None, f'Task {i}', '', (today + timedelta(days=i % 400)).isoformat(), 5, 0, 'pending')
+            for i in range(size)]
+    results = []
+
+    def insert():
+        storage.begin_write()
+        storage.tasks.insert_many(rows, TASK_COLUMNS)
+        storage.commit()
+    results.append(timed_ops('insert_many', size, insert))
+
+    ids = [row['id'] for row in storage.tasks.export(('id',))]
+    reads = min(size, 1000)
+    results.append(timed_ops('get', reads, lambda: [storage.tasks.get(task_id) for task_id in ids[:reads]]))
+
+    def pages():
+        after = None
+        while True:
+            page = storage.tasks.page(after=after, limit=50)
+            if len(page) <= 50:
+                return
+            after = (page[49]['due_date'], page[49]['id'])
+    results.append(timed_ops('page of 50', max(1, size // 50), pages))
+    results.append(timed_ops('open_due_by (14 days)', 1, lambda: list(storage.tasks.open_due_by(today + timedelta(days=13)))))
+
+    writes = min(size, 500)
+
+    def log():
+        for task_id in ids[:writes]:
+            storage.logs.add(task_id, today.isoformat(), 0.5)
+            storage.commit()
+    results.append(timed_ops('log and commit', writes, log))
+    results.append(timed_ops('data_version', 1000, lambda: [storage.tasks.data_version() for _ in range(1000)]))
+    storage.close()
+    return results
+
+
+# Targets
+def sqlite_target(folder):
+    """A fresh SQLite database, through SQLiteStorage. Needs an app context."""
+    from db import ConnectionPool, init_db
+    from storage.sqlite import SQLiteStorage
+
+    path = os.path.join(folder, 'sqlite.db')
+    db = sqlite3.connect(path)
+    init_db(db)
+    db.close()
+    pool = ConnectionPool(path, pragmas={'journal_mode': 'WAL', 'busy_timeout': 5000})
+    return (lambda owner: SQLiteStorage(pool.acquire(), owner, pool)), pool.close
+
+
+def standin_target(folder):
+    """A fresh stand-in database, through the server backend. Needs an app context."""
+    from storage.standin import prepare_standin, standin_backend
+
+    path = os.path.join(folder, 'standin.db')
+    prepare_standin(path)
+    backend = standin_backend(path)
+    return backend.open, backend.close
+
+
+def server_target(dsn):
+    from storage.server import ServerBackend, psycopg2_connect
+
+    backend = ServerBackend(psycopg2_connect(dsn))
+    return backend.open, backend.close
+
+
+@click.command('storage-check')
+@click.option('--dsn', help='Also check a scratch server database (with server_schema.sql applied).')
+@click.option('--benchmark', 'size', type=int, default=0,
+              help='Also time common operations on this many tasks.')
+@with_appcontext
+def storage_check_command(dsn, size):
+    """Check that the storage backends behave alike, and optionally time them."""
+    folder = tempfile.mkdtemp(prefix='storage_check_')
+    targets = [('sqlite', sqlite_target), ('standin', standin_target)]
+    if dsn:
+        targets.append(('server', lambda folder: server_target(dsn)))
+
+    failed = 0
+    try:
+        for name, target in targets:
+            open_storage, close = target(folder)
+            try:
+                for check_name, error in run_checks(open_storage):
+                    click.echo(f"{name:<8} {check_name:<24} {'ok' if error is None else f'FAILED: {error}'}")
+                    failed += error is not None
+                if size:
+                    for label, count, ms in run_benchmark(open_storage, size):
+                        click.echo(f'{name:<8} {label:<24} {ms:>9.3f} ms each ({count})')
+            finally:
+                close()
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    if failed:
+        raise click.ClickException(f'{failed} checks failed.')
@@ -0,0 +1,271 @@
+"""
+The server database backend, for PostgreSQL (or anything speaking its
+dialect, such as CockroachDB or YugabyteDB) through psycopg2.
+
+Unlike SQLite, a server database lets many processes and machines write
+at once, so this is the backend to use past one writer. Connections come
+from a per-process pool, as db.ConnectionPool does for SQLite files.
+psycopg2 is only imported when the first connection is opened.
+
+Tenants can only share the database (TENANT_STORAGE = 'shared'); user
+accounts stay in the SQLite DATABASE.
+"""
+import functools
+import itertools
+import os
+import re
+import threading
+
+from profiling import current_profile, timed
+from storage.base import Storage
+
+# Rows a server-side cursor fetches per round trip
+STREAM_BATCH_SIZE = 500
+
+# String literals, which hold no placeholders
+LITERAL = re.compile(r"('(?:[^']|'')*')")
+
+
+@functools.lru_cache(maxsize=1024)
+def server_sql(sql):
+    """
+    Return a statement written with `?` placeholders in the driver's `%s`
+    style. A `?` inside a string literal is left alone, and every `%` is
+    doubled, as the driver expects when it binds parameters.
+    """
+    parts = LITERAL.split(sql)
+    # Literals are the odd parts
+    return ''.join(part.replace('%', '%%') if i % 2 else part.replace('%', '%%').replace('?', '%s')
+                   for i, part in enumerate(parts))
+
+
+class Row:
+    """A result row, readable by column name or position like sqlite3.Row."""
+
+    __slots__ = ('names', 'values')
+
+    def __init__(self, names, values):
+        self.names = names
+        self.values = values
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, slice)):
+            return self.values[key]
+        return self.values[self.names[key]]
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __eq__(self, other):
+        return tuple(self) == tuple(other)
+
+    def __repr__(self):
+        return f'Row({dict(zip(self.names, self.values))!r})'
+
+    def keys(self):
+        return list(self.names)
+
+
+class Cursor:
+    """Wraps a DB-API cursor to return Rows."""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.names = None
+
+    def _row(self, values):
+        if values is None:
+            return None
+        # A server-side cursor only has a description once rows are fetched
+        if self.names is None:
+            self.names = {column[0]: i for i, column in enumerate(self.cursor.description)}
+        return Row(self.names, values)
+
+    def fetchone(self):
+        return self._row(self.cursor.fetchone())
+
+    def fetchmany(self, size):
+        return [self._row(values) for values in self.cursor.fetchmany(size)]
+
+    def fetchall(self):
+        return [self._row(values) for values in self.cursor.fetchall()]
+
+    def __iter__(self):
+        while True:
+            rows = self.fetchmany(100)
+            if not rows:
+                return
+            yield from rows
+
+
+class ServerPool:
+    """
+    A per-process pool of connections to a server database. `connect` opens
+    a new DB-API connection. At most `size` idle connections are kept.
+    """
+
+    def __init__(self, connect, size=8):
+        self.connect = connect
+        self.size = size
+        self.pid = os.getpid()
+        self.idle = []
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+        return self.connect()
+
+    def release(self, connection):
+        # Leave nothing behind from the previous request
+        try:
+            connection.rollback()
+        except Exception:
+            connection.close()
+            return
+
+        with self.lock:
+            if not self.closed and len(self.idle) < self.size:
+                self.idle.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            idle, self.idle = self.idle, []
+        for connection in idle:
+            connection.close()
+
+
+class ServerStorage(Storage):
+    """
+    Storage on a pooled server database connection, which it owns and
+    hands back on close(). Statements are written with `?` placeholders
+    and bound in the driver's `%s` style (see server_sql).
+    """
+
+    # Names for server-side cursors, unique within the process
+    cursor_names = itertools.count()
+
+    def __init__(self, pool, owner=None, error=Exception):
+        super().__init__(owner)
+        self.pool = pool
+        self.connection = pool.acquire()
+        self.Error = error
+
+    def _cursor(self):
+        return self.connection.cursor()
+
+    def _count(self, sql):
+        profile = current_profile()
+        if profile is not None:
+            profile.count_query(sql)
+
+    def execute(self, sql, params=()):
+        cursor = self._cursor()
+        self._count(sql)
+        with timed('db'):
+            cursor.execute(server_sql(sql), tuple(params))
+        return Cursor(cursor)
+
+    def stream(self, sql, params=()):
+        """
+        Run a query on a named (server-side) cursor, so its rows come
+        STREAM_BATCH_SIZE at a time instead of all being loaded into
+        memory. The cursor lasts until the transaction ends.
+        """
+        cursor = self.connection.cursor(name=f'stream_{next(self.cursor_names)}')
+        cursor.itersize = STREAM_BATCH_SIZE
+        self._count(sql)
+        with timed('db'):
+            cursor.execute(server_sql(sql), tuple(params))
+        return Cursor(cursor)
+
+    def executemany(self, sql, seq_of_params):
+        cursor = self._cursor()
+        self._count(sql)
+        with timed('db'):
+            cursor.executemany(server_sql(sql), [tuple(params) for params in seq_of_params])
+        return Cursor(cursor)
+
+    def commit(self):
+        with timed('db'):
+            self.connection.commit()
+
+    def rollback(self):
+        self.connection.rollback()
+
+    def close(self):
+        if self.connection is not None:
+            self.pool.release(self.connection)
+            self.connection = None
+
+    def owner_clause(self, column='user_id'):
+        # `IS ?` only compares with NULL in PostgreSQL
+        if self.owner is None:
+            return f'{column} IS NULL', []
+        return f'{column} = ?', [self.owner]
+
+    def insert_id(self, sql, params):
+        return self.execute(f'{sql} RETURNING id', params).fetchone()[0]
+
+    def sync_sequence(self, table):
+        self.execute(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+            f'(SELECT COALESCE(MAX(id), 0) + 1 FROM {table}), false)'
+        )
+
+
+def psycopg2_connect(dsn):
+    """Return a function opening connections to `dsn` with psycopg2."""
+    def connect():
+        import psycopg2
+        return psycopg2.connect(dsn, options='-c TimeZone=UTC')
+    return connect
+
+
+class ServerBackend:
+    """
+    Opens storages on a server database. `connect` opens a connection,
+    `error` is the driver's base exception and `storage_class` the Storage
+    to wrap connections in.
+    """
+
+    name = 'server'
+
+    def __init__(self, connect, pool_size=8, error=None, storage_class=ServerStorage):
+        self.connect = connect
+        self.pool_size = pool_size
+        self.error = error
+        self.storage_class = storage_class
+        self.pool = None
+        self.lock = threading.Lock()
+
+    def get_pool(self):
+        """Return this process's pool, opening a new one after a fork."""
+        with self.lock:
+            if self.pool is None or self.pool.pid != os.getpid():
+                self.pool = ServerPool(self.connect, self.pool_size)
+            return self.pool
+
+    def driver_error(self):
+        if self.error is None:
+            import psycopg2
+            self.error = psycopg2.Error
+        return self.error
+
+    def open(self, owner=None, detached=False):
+        """Open a storage for `owner`. Every storage has its own connection."""
+        return self.storage_class(self.get_pool(), owner, error=self.driver_error())
+
+    def close(self):
+        with self.lock:
+            if self.pool is not None:
+                self.pool.close()
+                self.pool = None
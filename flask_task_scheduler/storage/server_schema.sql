@@ -0,0 +1,89 @@
+-- Schema for the server database backend (PostgreSQL dialect). Apply it to
+-- an empty database once, e.g. psql "$DSN" -f storage/server_schema.sql
+-- It matches schema.sql with every migration applied, less the users
+-- table: accounts stay in the SQLite DATABASE.
+
+CREATE TABLE tasks (
+    id SERIAL PRIMARY KEY,
+    title TEXT NOT NULL,
+    description TEXT,
+    due_date DATE NOT NULL,
+    estimated_hours REAL NOT NULL,
+    hours_completed REAL DEFAULT 0,
+    status TEXT DEFAULT 'pending',
+    user_id INTEGER,
+    rrule TEXT
+);
+
+CREATE TABLE task_logs (
+    id SERIAL PRIMARY KEY,
+    task_id INTEGER NOT NULL REFERENCES tasks(id),
+    log_date DATE NOT NULL,
+    hours REAL NOT NULL
+);
+
+-- Hours logged per task per day and per week (weeks start on Monday)
+CREATE TABLE task_log_daily (
+    task_id INTEGER NOT NULL,
+    user_id INTEGER,
+    day DATE NOT NULL,
+    hours REAL NOT NULL,
+    entries INTEGER NOT NULL
+);
+
+CREATE TABLE task_log_weekly (
+    task_id INTEGER NOT NULL,
+    user_id INTEGER,
+    week DATE NOT NULL,
+    hours REAL NOT NULL,
+    entries INTEGER NOT NULL
+);
+
+-- The latest write to each task or its logs; MAX(version) is the data version
+CREATE TABLE task_changes (
+    version BIGSERIAL PRIMARY KEY,
+    task_id INTEGER NOT NULL,
+    changed_at TIMESTAMP,  -- UTC; connections are opened with TimeZone=UTC
+    user_id INTEGER
+);
+
+-- The materialized schedule (see refresher.py)
+CREATE TABLE schedule_entries (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER,
+    days INTEGER NOT NULL,
+    date DATE NOT NULL,
+    task_id INTEGER NOT NULL,
+    hours REAL NOT NULL
+);
+
+CREATE TABLE schedule_late (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER,
+    days INTEGER NOT NULL,
+    task_id INTEGER NOT NULL,
+    due_date DATE NOT NULL,
+    shortfall REAL NOT NULL
+);
+
+CREATE TABLE schedule_state (
+    user_id INTEGER,
+    days INTEGER NOT NULL,
+    start_date DATE NOT NULL,
+    version BIGINT NOT NULL,
+    refreshed_at TIMESTAMP NOT NULL,
+    elapsed_ms REAL NOT NULL
+);
+
+CREATE INDEX idx_tasks_user_status_due_date ON tasks (user_id, status, due_date);
+CREATE INDEX idx_tasks_user_due_date ON tasks (user_id, due_date);
+CREATE INDEX idx_task_logs_task_id_log_date ON task_logs (task_id, log_date);
+CREATE UNIQUE INDEX idx_task_log_daily_task_day ON task_log_daily (task_id, day);
+CREATE INDEX idx_task_log_daily_user_day ON task_log_daily (user_id, day);
+CREATE UNIQUE INDEX idx_task_log_weekly_task_week ON task_log_weekly (task_id, week);
+CREATE INDEX idx_task_log_weekly_user_week ON task_log_weekly (user_id, week);
+CREATE INDEX idx_task_changes_user_version ON task_changes (user_id, version);
+CREATE UNIQUE INDEX idx_task_changes_task_id ON task_changes (task_id);
+CREATE INDEX idx_schedule_entries_user_days_date ON schedule_entries (user_id, days, date);
+CREATE INDEX idx_schedule_late_user_days ON schedule_late (user_id, days);
+CREATE UNIQUE INDEX idx_schedule_state_user_days ON schedule_state (COALESCE(user_id, 0), days);
@@ -0,0 +1,80 @@
+"""
+The SQLite backend: the request's pooled connection from db.py, so tenant
+files, profiling and the slow-query log all keep working.
+"""
+import sqlite3
+
+from db import get_db, get_pool
+from storage.base import Storage
+
+
+class SQLiteStorage(Storage):
+    """
+    Storage on a SQLite connection. Given a `pool`, the storage owns its
+    connection and hands it back on close(); otherwise the connection is
+    the request's, released by db.close_db().
+    """
+
+    Error = sqlite3.Error
+
+    def __init__(self, db, owner=None, pool=None):
+        super().__init__(owner)
+        self.db = db
+        self.pool = pool
+
+    def execute(self, sql, params=()):
+        return self.db.execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.db.executemany(sql, seq_of_params)
+
+    def commit(self):
+        self.db.commit()
+
+    def rollback(self):
+        self.db.rollback()
+
+    def begin_write(self):
+        # Take the write lock now rather than at the first write, so reads
+        # in the transaction can't go stale before it
+        self.db.execute('BEGIN IMMEDIATE')
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.release(self.db)
+        self.db = None
+
+    def owner_clause(self, column='user_id'):
+        return f'{column} IS ?', [self.owner]
+
+    def insert_id(self, sql, params):
+        return self.db.execute(sql, params).lastrowid
+
+    def insert_ids(self, table, sql, seq_of_params):
+        # One executemany() is much faster than a statement per row. Under
+        # the write lock, the new rows are the ones past the old sequence.
+        row = self.db.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (table,)).fetchone()
+        last_id = row[0] if row is not None else 0
+        self.db.executemany(sql, seq_of_params)
+        return [row[0] for row in self.db.execute(
+            f'SELECT id FROM {table} WHERE id > ? ORDER BY id', (last_id,)
+        )]
+
+
+class SQLiteBackend:
+    """Opens storages on the app's SQLite databases."""
+
+    name = 'sqlite'
+
+    def open(self, owner=None, detached=False):
+        """
+        Open a storage for `owner`. A detached storage has a connection of
+        its own, for work that outlives the request (a streamed response).
+        """
+        if detached:
+            pool = get_pool()
+            return SQLiteStorage(pool.acquire(), owner, pool)
+        return SQLiteStorage(get_db(), owner)
+
+    def close(self):
+        """The pools in db.py are closed with the app; nothing to do."""
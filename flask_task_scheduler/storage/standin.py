@@ -0,0 +1,99 @@
+"""
+An in-process stand-in for a server database, so the server backend can be
+run and checked without one.
+
+It is a SQLite file behind a DB-API connection that takes the server
+driver's `%s` placeholders, so statements go through ServerStorage exactly
+as they would to PostgreSQL: `%s` binding, the `= ?` / `IS NULL` owner
+clauses, RETURNING ids and the pool. Only the sequence fix-up after
+explicit ids is left out, as SQLite's AUTOINCREMENT needs none.
+"""
+import re
+import sqlite3
+
+from storage.server import ServerBackend, ServerStorage
+
+
+# A placeholder or an escaped %, as server_sql writes them
+SERVER_MARKS = re.compile(r'%([s%])')
+
+
+def sqlite_sql(sql):
+    """Return a statement in the driver's style back in SQLite's."""
+    return SERVER_MARKS.sub(lambda mark: '?' if mark.group(1) == 's' else '%', sql)
+
+
+class StandInCursor:
+    """A sqlite3 cursor taking `%s` placeholders."""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    def execute(self, sql, params=()):
+        self.cursor.execute(sqlite_sql(sql), params)
+
+    def executemany(self, sql, seq_of_params):
+        self.cursor.executemany(sqlite_sql(sql), seq_of_params)
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchmany(self, size):
+        return self.cursor.fetchmany(size)
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+
+class StandInConnection:
+    """A sqlite3 connection with the parts of the DB-API ServerStorage uses."""
+
+    def __init__(self, path, timeout=5):
+        self.db = sqlite3.connect(path, timeout=timeout, check_same_thread=False,
+                                  detect_types=sqlite3.PARSE_DECLTYPES)
+
+    def cursor(self, name=None):
+        # sqlite3 cursors already read rows as they are fetched, so a named
+        # (server-side) cursor is just a cursor
+        return StandInCursor(self.db.cursor())
+
+    def commit(self):
+        self.db.commit()
+
+    def rollback(self):
+        self.db.rollback()
+
+    def close(self):
+        self.db.close()
+
+
+class StandInStorage(ServerStorage):
+    def sync_sequence(self, table):
+        """SQLite's AUTOINCREMENT already skips past explicit ids."""
+
+
+def prepare_standin(path):
+    """
+    Create a stand-in database file with the app's schema, or apply pending
+    migrations to it. Needs an app context.
+    """
+    from db import get_schema_version, init_db, migrate_db
+
+    db = sqlite3.connect(path)
+    try:
+        if get_schema_version(db) == 0:
+            init_db(db)
+        else:
+            migrate_db(db)
+    finally:
+        db.close()
+
+
+def standin_backend(path, pool_size=8):
+    """Return a ServerBackend on a stand-in database file."""
+    return ServerBackend(lambda: StandInConnection(path), pool_size=pool_size,
+                         error=sqlite3.Error, storage_class=StandInStorage)
@@ -0,0 +1,73 @@
+"""
+Multi-tenant mode.
+
+With MULTI_TENANT enabled every visitor signs in, and sees and plans only
+their own tasks. TENANT_STORAGE picks where each tenant's data lives:
+
+- 'shared': one database, with every task tagged with its owner's user id
+  and every task query scoped by it (owner_id()).
+- 'sharded': a SQLite file per tenant under TENANT_FOLDER, so one tenant's
+  writes and long exports never hold a lock another tenant needs. Tasks in
+  these files have no owner; the file is the partition.
+
+User accounts are always kept in the shared DATABASE. In single-user mode
+(the default) there are no accounts and every task has no owner.
+"""
+import functools
+
+import click
+from flask import current_app, g
+
+from db import get_users_db
+
+
+def current_user():
+    """Return the signed-in user's row, or None."""
+    return g.get('user')
+
+
+def tenant_id():
+    """
+    Return the id of the tenant whose data the current request works on,
+    or None in single-user mode. Caches are keyed by it.
+    """
+    user = current_user()
+    return user['id'] if user is not None else None
+
+
+def owner_id():
+    """
+    Return the user id to scope task queries by (`user_id IS ?`): the
+    tenant's id when tenants share a database, otherwise None.
+    """
+    config = current_app.config
+    if config['MULTI_TENANT'] and config['TENANT_STORAGE'] == 'shared':
+        return tenant_id()
+    return None
+
+
+def get_user(user_id=None, username=None):
+    """Look up a user by id or username."""
+    db = get_users_db()
+    if user_id is not None:
+        return db.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
+    return db.execute('SELECT * FROM users WHERE username = ?', (username,)).fetchone()
+
+
+def user_option(command):
+    """
+    Add a --user option to a CLI command, which then works on that user's
+    tasks. Multi-tenant mode requires it.
+    """
+    @click.option('--user', 'username', help='Username whose tasks to work on.')
+    @functools.wraps(command)
+    def wrapped(*args, username=None, **kwargs):
+        if username is not None:
+            user = get_user(username=username)
+            if user is None:
+                raise click.BadParameter(f'No user named {username}.', param_hint='--user')
+            g.user = user
+        elif current_app.config['MULTI_TENANT']:
+            raise click.UsageError('--user is required in multi-tenant mode.')
+        return command(*args, **kwargs)
+    return wrapped
@@ -0,0 +1,37 @@
+import os
+import sys
+
+import pytest
+
+# The app's modules are imported from the project folder, as `flask run` does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app  # noqa: E402
+from caching import schedule_cache  # noqa: E402
+
+
+@pytest.fixture
+def config(tmp_path):
+    """The app's test config; override it in a module to change settings."""
+    return {
+        'TESTING': True,
+        'DATABASE': str(tmp_path / 'database.db'),
+        'QUERY_STATS_DATABASE': str(tmp_path / 'query_stats.db'),
+        'TENANT_FOLDER': str(tmp_path / 'tenants'),
+        'SCHEDULE_REFRESHER': False,
+        'PDF_WORKERS': 0,
+    }
+
+
+@pytest.fixture
+def app(config):
+    app = create_app(config)
+    # Every test starts from data version 1, so plans cached by the last
+    # one would look current
+    schedule_cache.entries.clear()
+    yield app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
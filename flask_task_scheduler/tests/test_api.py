@@ -0,0 +1,46 @@
+from datetime import date
+
+import pytest
+
+from models import decode_cursor, encode_cursor
+
+
+@pytest.mark.parametrize('values', [
+    [{'a': 1}, 1],
+    ['2030-01-01', '1'],
+    ['2030-01-01', True],
+    ['2030-01-01', 1.5],
+    [None, 1],
+    ['not a date', 1],
+    ['2030-01-01'],
+])
+def test_decode_cursor_rejects_wrong_types(values):
+    with pytest.raises(ValueError):
+        decode_cursor(encode_cursor(values), (date, int))
+
+
+@pytest.mark.parametrize('path, values', [
+    ('/api/v1/tasks', [{'a': 1}, 1]),
+    ('/api/v1/tasks', ['2030-01-01', [1]]),
+    ('/api/v1/task_logs', ['1']),
+    ('/api/v1/task_logs', [None]),
+])
+def test_bad_cursor_is_a_bad_request(client, path, values):
+    response = client.get(path, query_string={'cursor': encode_cursor(values)})
+    assert response.status_code == 400
+
+
+def test_tasks_cursor_pages(client):
+    client.post('/api/v1/tasks/import?format=csv', data=(
+        'title,due_date,estimated_hours\n'
+        'Task 1,2030-01-01,1\n'
+        'Task 2,2030-01-02,1\n'
+        'Task 3,2030-01-03,1\n'
+    ))
+
+    first = client.get('/api/v1/tasks?limit=2').get_json()
+    second = client.get('/api/v1/tasks', query_string={'limit': 2, 'cursor': first['next']}).get_json()
+
+    assert [task['title'] for task in first['data']] == ['Task 1', 'Task 2']
+    assert [task['title'] for task in second['data']] == ['Task 3']
+    assert second['next'] is None
@@ -0,0 +1,97 @@
+import asyncio
+import json
+
+import pytest
+
+import asgi
+
+# Sent a few rows per chunk, with no Content-Length
+ROWS = [b'title,due_date,estimated_hours\n'] + [
+    f'Task {n},2030-01-{1 + n % 28:02},1\n'.encode() for n in range(600)
+]
+CSV = [b''.join(ROWS[n:n + 50]) for n in range(0, len(ROWS), 50)]
+
+
+@pytest.fixture
+def config(config):
+    return {**config, 'PROFILING': True}
+
+
+@pytest.fixture
+def application(app, monkeypatch):
+    """asgi.application, serving the test app."""
+    monkeypatch.setattr(asgi, 'app', app)
+    yield asgi.application
+    if asgi._executor is not None:
+        asgi._executor.shutdown()
+        asgi._executor = None
+
+
+def call(application, method, path, query=b'', headers=(), chunks=(b'',)):
+    """Run one request through `application`; return the messages it sent."""
+    scope = {
+        'type': 'http',
+        'method': method,
+        'path': path,
+        'query_string': query,
+        'headers': list(headers),
+        'http_version': '1.1',
+        'scheme': 'http',
+        'server': ('localhost', 80),
+    }
+    chunks = list(chunks)
+    sent = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': chunks.pop(0), 'more_body': bool(chunks)}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(application(scope, receive, send))
+    return sent
+
+
+def import_csv(application):
+    return call(application, 'POST', '/api/v1/tasks/import', b'format=csv',
+                [(b'transfer-encoding', b'chunked'), (b'content-type', b'text/csv')], CSV)
+
+
+def test_chunked_post_body(application):
+    start, *body = import_csv(application)
+
+    assert start['status'] == 200
+    result = json.loads(b''.join(message['body'] for message in body))
+    assert result['imported'] == 600
+    assert result['rejected'] == 0
+
+
+def test_streamed_calendar(application):
+    import_csv(application)
+
+    start, *body = call(application, 'GET', '/calendar.ics')
+
+    assert start['status'] == 200
+    assert (b'content-type', b'text/calendar') in start['headers']
+    # A message per CALENDAR_EVENTS_PER_CHUNK events, then an empty one
+    # to end the body
+    assert len(body) == 600 // asgi.CALENDAR_EVENTS_PER_CHUNK + 2
+    assert all(message['more_body'] for message in body[:-1])
+    assert body[-1] == {'type': 'http.response.body', 'body': b''}
+    calendar = b''.join(message['body'] for message in body)
+    assert calendar.startswith(b'BEGIN:VCALENDAR')
+    assert calendar.rstrip().endswith(b'END:VCALENDAR')
+    assert calendar.count(b'SUMMARY:[DUE] Task ') == 600
+
+
+def test_async_routes_reach_metrics(application):
+    start, *_ = call(application, 'GET', '/calendar.ics')
+    etag = dict(start['headers'])[b'etag']
+    call(application, 'GET', '/calendar.ics', headers=[(b'if-none-match', etag)])
+    call(application, 'GET', '/export/pdf')
+
+    _, *body = call(application, 'GET', '/metrics')
+    metrics = b''.join(message['body'] for message in body).decode()
+
+    assert 'http_request_duration_seconds_count{route="/calendar.ics"} 2' in metrics
+    assert 'http_request_duration_seconds_count{route="/export/pdf"} 1' in metrics
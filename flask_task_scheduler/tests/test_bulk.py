@@ -0,0 +1,35 @@
+import pytest
+
+
+@pytest.mark.parametrize('value', ['inf', '-inf', 'nan', 'Infinity', 'NaN'])
+def test_import_rejects_non_finite_hours(client, value):
+    body = (
+        'title,due_date,estimated_hours\n'
+        'Good,2030-01-01,2\n'
+        f'Bad,2030-01-02,{value}\n'
+    )
+    response = client.post('/api/v1/tasks/import?format=csv', data=body)
+
+    assert response.status_code == 200
+    result = response.get_json()
+    assert result['imported'] == 1
+    assert result['rejected'] == 1
+    assert result['errors'][0]['line'] == 3
+    assert 'finite' in result['errors'][0]['error']
+
+    # The planner still works on what was imported
+    assert client.get('/schedule?days=7').status_code == 200
+    assert client.get('/api/v1/schedule').status_code == 200
+
+
+def test_import_rejects_non_finite_json_numbers(client):
+    # Python's JSON parser reads these literals as floats
+    body = (
+        '{"title": "Inf", "due_date": "2030-01-01", "estimated_hours": Infinity}\n'
+        '{"title": "NaN", "due_date": "2030-01-01", "estimated_hours": 2, "hours_completed": NaN}\n'
+    )
+    response = client.post('/api/v1/tasks/import?format=ndjson', data=body)
+
+    assert response.status_code == 200
+    assert response.get_json()['rejected'] == 2
+    assert client.get('/').status_code == 200
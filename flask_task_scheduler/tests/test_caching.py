@@ -0,0 +1,102 @@
+import pytest
+
+from db import get_db, migrate_db
+from storage import get_storage
+
+CONDITIONAL_PATHS = ['/calendar.ics', '/api/v1/tasks', '/api/v1/schedule?days=7']
+
+
+def get(client, path, **kwargs):
+    """GET a path, reading the whole (maybe streamed) body."""
+    response = client.get(path, **kwargs)
+    response.get_data()
+    response.close()
+    return response
+
+
+def add_task(client, title='Essay'):
+    response = client.post('/api/v1/tasks/import?format=csv',
+                           data=f'title,due_date,estimated_hours\n{title},2030-01-01,3\n')
+    assert response.get_json()['imported'] == 1
+
+
+@pytest.mark.parametrize('path', CONDITIONAL_PATHS)
+def test_if_none_match_returns_304_until_data_changes(client, path):
+    add_task(client)
+    first = get(client, path)
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+
+    again = get(client, path, headers={'If-None-Match': etag})
+    assert again.status_code == 304
+    assert again.headers['ETag'] == etag
+
+    add_task(client, 'Reading')
+    changed = get(client, path, headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+
+
+@pytest.mark.parametrize('path', CONDITIONAL_PATHS)
+def test_if_modified_since_returns_304_until_data_changes(client, path):
+    add_task(client)
+    last_modified = get(client, path).headers['Last-Modified']
+
+    assert get(client, path, headers={'If-Modified-Since': last_modified}).status_code == 304
+
+    # Last-Modified has a resolution of a second
+    add_task(client, 'Reading')
+    with client.application.test_request_context():
+        get_storage().execute("UPDATE task_changes SET changed_at = datetime('now', '+5 seconds')")
+        get_storage().commit()
+    assert get(client, path, headers={'If-Modified-Since': last_modified}).status_code == 200
+
+
+def test_pdf_fallback_is_not_revalidated(client):
+    response = get(client, '/export/pdf')
+    if response.mimetype == 'application/pdf':
+        pytest.skip('a PDF renderer is installed')
+
+    assert response.mimetype == 'text/html'
+    assert 'ETag' not in response.headers
+    assert 'Last-Modified' not in response.headers
+    assert response.cache_control.no_store
+
+
+def change_rows(db):
+    return [tuple(row) for row in db.execute(
+        'SELECT task_id, COUNT(*) FROM task_changes GROUP BY task_id ORDER BY task_id'
+    )]
+
+
+def test_task_changes_keep_one_row_per_task(client, app):
+    response = client.post('/api/v1/tasks/import?format=csv', data='title,due_date,estimated_hours\n'
+                           + ''.join(f'Task {n},2030-01-01,3\n' for n in range(300)))
+    assert response.get_json()['imported'] == 300
+
+    with app.app_context():
+        storage = get_storage()
+        ids = [row[0] for row in get_db().execute('SELECT id FROM tasks')]
+        first = storage.tasks.data_version()
+        for _ in range(3):
+            storage.tasks.record_changes(ids)
+            storage.commit()
+        storage.logs.add(ids[0], '2030-01-01', 1)
+        storage.commit()
+
+        assert storage.tasks.data_version() > first
+        assert set(storage.tasks.changed_since(first)) == set(ids)
+        assert {count for _, count in change_rows(get_db())} == {1}
+
+
+def test_migration_drops_superseded_changes(app):
+    with app.app_context():
+        db = get_db()
+        db.execute('DROP INDEX idx_task_changes_task_id')
+        db.executemany('INSERT INTO task_changes (task_id) VALUES (?)', [(1,), (2,), (1,), (1,)])
+        db.execute('PRAGMA user_version = 8')
+        db.commit()
+
+        assert migrate_db(db) == [(9, 'task_changes_latest')]
+        assert change_rows(db) == [(1, 1), (2, 1)]
+        assert db.execute('SELECT MAX(version) FROM task_changes WHERE task_id = 1').fetchone()[0] == 4
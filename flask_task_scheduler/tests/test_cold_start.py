@@ -0,0 +1,20 @@
+import json
+import os
+import subprocess
+import sys
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARKS = os.path.join(APP_DIR, 'benchmarks', 'run_benchmarks.py')
+
+
+def test_cold_start_is_within_target(tmp_path):
+    # Exits with an error when p95 is over the target or a lazy module was imported
+    completed = subprocess.run(
+        [sys.executable, BENCHMARKS, '--cold-start', '--repeat', '5', '--data-dir', str(tmp_path)],
+        cwd=APP_DIR, capture_output=True, text=True
+    )
+    assert completed.returncode == 0, completed.stderr
+
+    result = json.loads(completed.stdout)
+    assert result['imported'] == []
+    assert result['p95_ms'] <= result['target_ms']
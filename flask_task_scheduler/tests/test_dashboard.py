@@ -0,0 +1,42 @@
+import pytest
+
+from models import encode_cursor
+
+
+@pytest.fixture
+def tasks(app, client):
+    app.config['DASHBOARD_PAGE_SIZE'] = 2
+    # Completed, so they only show in the task list, not today's schedule
+    client.post('/api/v1/tasks/import?format=csv', data=(
+        'title,due_date,estimated_hours,status\n'
+        'Alpha,2030-01-03,1,completed\n'
+        'Bravo,2030-01-02,1,completed\n'
+        'Charlie,2030-01-01,1,completed\n'
+    ))
+
+
+@pytest.mark.parametrize('sort, values', [
+    ('due', [{'a': 1}, 1]),
+    ('due', ['Alpha', 1]),
+    ('title', ['Alpha', '1']),
+    ('title', [None, 1]),
+])
+def test_bad_cursor_starts_from_the_first_page(client, tasks, sort, values):
+    response = client.get('/', query_string={'sort': sort, 'cursor': encode_cursor(values)})
+
+    assert response.status_code == 200
+    first = client.get('/', query_string={'sort': sort}).get_data(as_text=True)
+    assert response.get_data(as_text=True) == first
+
+
+@pytest.mark.parametrize('sort, values, shown, hidden', [
+    ('due', ['2030-01-02', 2], 'Alpha', 'Bravo'),
+    ('title', ['Bravo', 2], 'Charlie', 'Bravo'),
+])
+def test_cursor_pages(client, tasks, sort, values, shown, hidden):
+    response = client.get('/', query_string={'sort': sort, 'cursor': encode_cursor(values)})
+
+    assert response.status_code == 200
+    page = response.get_data(as_text=True)
+    assert shown in page
+    assert hidden not in page
@@ -0,0 +1,87 @@
+from datetime import date, timedelta
+
+import pytest
+
+from history import compact_logs_command
+from storage import get_storage
+from storage.base import as_date
+
+# In the past, so compact-logs folds in all of them
+FIRST = date(2020, 1, 1)
+LAST = FIRST + timedelta(days=59)
+
+
+@pytest.fixture
+def storage(app):
+    with app.test_request_context():
+        yield get_storage()
+
+
+def add_logs(storage):
+    """Log hours on two tasks over two months, several a day on some days."""
+    tasks = [storage.tasks.create(title, '', '2030-06-01', 100) for title in ('Thesis', 'Course')]
+    for offset in range(0, 60, 3):
+        day = (FIRST + timedelta(days=offset)).isoformat()
+        storage.logs.add(tasks[0], day, 1.5)
+        storage.logs.add(tasks[0], day, 0.5)
+        if offset % 2:
+            storage.logs.add(tasks[1], day, 2)
+    storage.commit()
+    return tasks
+
+
+def totals(storage, tasks):
+    return {
+        'per_day': [tuple(row) for row in storage.history.per_day(FIRST, LAST)],
+        'per_week': [tuple(row) for row in storage.history.per_week(FIRST, LAST)],
+        'per_task': [tuple(row) for row in storage.history.per_task(FIRST, LAST)],
+        'per_day_of_task': [tuple(row) for row in storage.history.per_day(FIRST, LAST, tasks[1])],
+        'hours_completed': [storage.tasks.get(task_id)['hours_completed'] for task_id in tasks],
+    }
+
+
+def raw_log_dates(storage, task_id):
+    return sorted(as_date(row['log_date']) for row in storage.logs.for_task(task_id))
+
+
+def test_compaction_keeps_every_total(storage):
+    tasks = add_logs(storage)
+    before = totals(storage, tasks)
+    assert before['hours_completed'] == [40, 20]
+
+    cutoff = FIRST + timedelta(days=30)
+    logs, hours = storage.history.compact(cutoff)
+
+    assert (logs, hours) == (20 + 5, 20 + 10)
+    assert totals(storage, tasks) == before
+    # Only the raw logs before the cut-off are gone
+    assert all(day >= cutoff for day in raw_log_dates(storage, tasks[0]))
+    assert len(raw_log_dates(storage, tasks[0])) == 20
+
+    # Compacting again changes nothing
+    assert storage.history.compact(cutoff) == (0, 0)
+    assert totals(storage, tasks) == before
+
+
+def test_compaction_adds_logs_missing_from_the_rollups(storage):
+    tasks = add_logs(storage)
+    # A log written around the storage, which the rollups never saw
+    storage.execute('INSERT INTO task_logs (task_id, log_date, hours) VALUES (?, ?, ?)',
+                    (tasks[1], FIRST.isoformat(), 4))
+    storage.commit()
+
+    storage.history.compact(LAST + timedelta(days=1))
+
+    assert storage.history.per_day(FIRST, FIRST, tasks[1])[0]['hours'] == 4
+    assert raw_log_dates(storage, tasks[0]) == []
+
+
+def test_compact_logs_command(app, storage):
+    tasks = add_logs(storage)
+    before = totals(storage, tasks)
+
+    result = app.test_cli_runner().invoke(compact_logs_command, ['--days', '0'])
+
+    assert result.exit_code == 0, result.output
+    assert 'Compacted 50 logs (60 hours)' in result.output
+    assert totals(storage, tasks) == before
@@ -0,0 +1,112 @@
+from datetime import date, timedelta
+
+import pytest
+
+from models import occurrence_items
+from recurrence import check_rule, occurrences, previous_occurrence
+from scheduler import plan_schedule_python
+from storage import get_storage
+
+# Mondays
+FIRST_DUE = date(2030, 1, 7)
+WEEKLY = 'FREQ=WEEKLY;BYDAY=MO'
+
+
+def test_occurrences_in_a_window():
+    assert occurrences(WEEKLY, FIRST_DUE, date(2030, 1, 10), date(2030, 1, 28)) == [
+        date(2030, 1, 14), date(2030, 1, 21), date(2030, 1, 28)
+    ]
+    assert occurrences('FREQ=MONTHLY;BYMONTHDAY=-1', date(2030, 1, 31), date(2030, 1, 1), date(2030, 3, 31)) == [
+        date(2030, 1, 31), date(2030, 2, 28), date(2030, 3, 31)
+    ]
+    # Nothing before the first due date
+    assert occurrences(WEEKLY, FIRST_DUE, date(2029, 12, 1), date(2030, 1, 7)) == [FIRST_DUE]
+
+
+def test_previous_occurrence():
+    assert previous_occurrence(WEEKLY, FIRST_DUE, date(2030, 1, 16)) == date(2030, 1, 14)
+    assert previous_occurrence(WEEKLY, FIRST_DUE, date(2030, 1, 14)) == date(2030, 1, 7)
+    assert previous_occurrence(WEEKLY, FIRST_DUE, FIRST_DUE) is None
+
+
+def test_check_rule():
+    assert check_rule(' rrule:freq=weekly;byday=mo ', FIRST_DUE) == WEEKLY
+    assert check_rule('', FIRST_DUE) is None
+    for rule in ('FREQ=HOURLY', 'FREQ=WEEKLY;DTSTART=20300101', 'FREQ=WEEKLY;BYDAY=XX', 'BYDAY=MO'):
+        with pytest.raises(ValueError):
+            check_rule(rule, FIRST_DUE)
+
+
+@pytest.fixture
+def storage(app):
+    with app.test_request_context():
+        yield get_storage()
+
+
+def weekly_task(storage, hours=2):
+    task_id = storage.tasks.create('Problem set', '', FIRST_DUE.isoformat(), hours, rrule=WEEKLY)
+    storage.commit()
+    return task_id
+
+
+def test_occurrences_are_available_from_the_one_before(storage):
+    weekly_task(storage)
+    start = date(2030, 1, 10)
+    items = occurrence_items(storage.tasks.recurring(start + timedelta(days=20)), start,
+                             start + timedelta(days=20))
+
+    assert [(item.due_date, item.available, item.hours) for item in items] == [
+        (date(2030, 1, 14), date(2030, 1, 7), 2),
+        (date(2030, 1, 21), date(2030, 1, 14), 2),
+        (date(2030, 1, 28), date(2030, 1, 21), 2),
+    ]
+
+
+def test_next_occurrence_waits_for_this_one(storage):
+    weekly_task(storage)
+    start = date(2030, 1, 12)
+    end = start + timedelta(days=13)
+    items = occurrence_items(storage.tasks.recurring(end), start, end)
+    plan = plan_schedule_python(items, start, [5] * 14)
+
+    worked = {day: sum(session['hours'] for session in sessions)
+              for day, sessions in plan.schedule.items() if sessions}
+    # This week's occurrence on the first day, next week's once this one is due
+    assert worked == {start: 2, date(2030, 1, 14): 2}
+    assert plan.late == []
+
+
+def test_logged_hours_count_towards_the_next_occurrence(storage):
+    task_id = weekly_task(storage, hours=3)
+    # Before the previous occurrence (Jan 7): spent on that one
+    storage.logs.add(task_id, '2030-01-06', 1)
+    # Since the previous occurrence: towards the one due Jan 14
+    storage.logs.add(task_id, '2030-01-08', 1)
+    storage.logs.add(task_id, '2030-01-09', 0.5)
+    storage.commit()
+
+    start = date(2030, 1, 10)
+    end = start + timedelta(days=13)
+    items = occurrence_items(storage.tasks.recurring(end), start, end)
+
+    assert [(item.due_date, item.hours) for item in items] == [
+        (date(2030, 1, 14), 1.5),
+        (date(2030, 1, 21), 3),
+    ]
+    # A recurring task isn't completed by logging
+    assert storage.tasks.get(task_id)['status'] == 'pending'
+
+
+def test_calendar_has_the_rule(client):
+    client.post('/api/v1/tasks/import?format=csv', data=(
+        'title,due_date,estimated_hours,rrule\n'
+        f'Problem set,{FIRST_DUE},2,{WEEKLY}\n'
+        f'Essay,{FIRST_DUE},2,\n'
+    ))
+    calendar = client.get('/calendar.ics').get_data(as_text=True)
+    events = calendar.split('BEGIN:VEVENT')[1:]
+
+    problem_set = next(event for event in events if 'Problem set' in event)
+    essay = next(event for event in events if 'Essay' in event)
+    assert f'RRULE:{WEEKLY}\r\n' in problem_set
+    assert 'RRULE' not in essay
@@ -0,0 +1,100 @@
+from datetime import date, timedelta
+
+import pytest
+
+from scheduler import LateTask, WorkItem, daily_capacities, plan_schedule_python
+from storage import get_storage
+
+
+def saved_horizons(app):
+    with app.test_request_context():
+        return [row['days'] for row in get_storage().schedules.state()]
+
+
+def test_only_configured_horizons_are_materialized(app, client):
+    client.post('/api/v1/tasks/import?format=csv',
+                data='title,due_date,estimated_hours\nEssay,2030-01-01,3\n')
+
+    for days in (3, 7, 30, 14, 200):
+        assert client.get(f'/schedule?days={days}').status_code == 200
+        assert client.get(f'/api/v1/schedule?days={days}').status_code == 200
+
+    assert saved_horizons(app) == [7, 14]
+
+
+@pytest.mark.parametrize('days', ['0', '-5', '100000', 'many'])
+def test_schedule_days_out_of_range(app, client, days):
+    assert client.get(f'/schedule?days={days}').status_code == 200
+    # Limited to 1..API_MAX_SCHEDULE_DAYS, or the default 7 days
+    assert set(saved_horizons(app)) <= {7}
+
+
+# The planner on its own (see scheduler.plan_schedule_python)
+MONDAY = date(2030, 1, 7)
+
+
+def item(task_id, due_date, hours):
+    return WorkItem(task_id, f'Task {task_id}', due_date, hours)
+
+
+def hours_by_day(plan):
+    return {day: [(session['task_id'], session['hours']) for session in sessions]
+            for day, sessions in plan.schedule.items()}
+
+
+def test_overflow_carries_to_the_next_day():
+    items = [item(1, MONDAY + timedelta(days=1), 7), item(2, MONDAY + timedelta(days=2), 2)]
+    plan = plan_schedule_python(items, MONDAY, [5, 5, 5])
+
+    assert hours_by_day(plan) == {
+        MONDAY: [(1, 5)],
+        MONDAY + timedelta(days=1): [(1, 2), (2, 2)],
+        MONDAY + timedelta(days=2): [],
+    }
+    assert plan.late == []
+
+
+def test_earliest_due_date_goes_first():
+    plan = plan_schedule_python([item(1, MONDAY + timedelta(days=1), 2), item(2, MONDAY, 2)],
+                                MONDAY, [3, 3])
+
+    assert hours_by_day(plan) == {MONDAY: [(2, 2), (1, 1)], MONDAY + timedelta(days=1): [(1, 1)]}
+
+
+def test_zero_weekend_capacity():
+    friday = MONDAY - timedelta(days=3)
+    capacities = daily_capacities(friday, 4, capacity=4, weekend_factor=0)
+    assert capacities == [4, 0, 0, 4]
+
+    plan = plan_schedule_python([item(1, MONDAY, 6)], friday, capacities)
+    assert hours_by_day(plan) == {
+        friday: [(1, 4)],
+        friday + timedelta(days=1): [],
+        friday + timedelta(days=2): [],
+        MONDAY: [(1, 2)],
+    }
+
+
+def test_late_tasks_report_their_shortfall():
+    plan = plan_schedule_python([item(1, MONDAY, 3), item(2, MONDAY - timedelta(days=2), 1),
+                                 item(3, MONDAY + timedelta(days=1), 2.2)],
+                                MONDAY, [2, 2])
+
+    # Overdue task 2 goes first but is late by all of it; task 1 only gets
+    # 1 hour by its due date, and task 3's 2.5 hours (rounded up) don't fit
+    # in the window at all
+    assert hours_by_day(plan) == {MONDAY: [(2, 1), (1, 1)], MONDAY + timedelta(days=1): [(1, 2)]}
+    assert plan.late == [
+        LateTask(2, 'Task 2', MONDAY - timedelta(days=2), 1),
+        LateTask(1, 'Task 1', MONDAY, 2),
+        LateTask(3, 'Task 3', MONDAY + timedelta(days=1), 2.5),
+    ]
+
+
+def test_tasks_due_after_the_window_are_left_out():
+    items = [item(1, MONDAY + timedelta(days=2), 1), item(2, MONDAY + timedelta(days=3), 1)]
+    plan = plan_schedule_python(items, MONDAY, [5, 5, 5])
+
+    assert hours_by_day(plan) == {MONDAY: [(1, 1)], MONDAY + timedelta(days=1): [],
+                                  MONDAY + timedelta(days=2): []}
+    assert plan.late == []
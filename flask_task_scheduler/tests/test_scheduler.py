@@ -0,0 +1,70 @@
+import random
+from datetime import date, timedelta
+
+import pytest
+
+from scheduler import (
+    WorkItem, daily_capacities, plan_schedule, plan_schedule_python, plan_schedules
+)
+
+# A Friday, so every window has weekend days in it
+START = date(2030, 1, 4)
+
+
+def random_workload(rng, count, days):
+    """Work items with fractional hours, some overdue and some due after the window."""
+    return [
+        WorkItem(task_id, f'Task {task_id}', START + timedelta(days=rng.randint(-10, days + 5)),
+                 rng.choice([0, 0.3, 0.5, 1, 1.25, 2, 3.5, 8, 13]))
+        for task_id in rng.sample(range(1, 10 * count + 1), count)
+    ]
+
+
+def random_capacities(rng, days):
+    kind = rng.choice(['default', 'fractional', 'zero weekends', 'zeros'])
+    if kind == 'default':
+        return daily_capacities(START, days)
+    if kind == 'fractional':
+        return daily_capacities(START, days, capacity=rng.choice([0.5, 1.5, 2.5, 3.7]),
+                                weekend_factor=rng.choice([0.5, 0.8]))
+    if kind == 'zero weekends':
+        return daily_capacities(START, days, capacity=4, weekend_factor=0)
+    return [rng.choice([0, 0, 0.5, 2.5, 4]) for _ in range(days)]
+
+
+@pytest.mark.parametrize('seed', range(40))
+def test_numpy_backend_matches_python(seed):
+    pytest.importorskip('numpy')
+    rng = random.Random(seed)
+    days = rng.choice([1, 7, 14, 30, 90])
+    capacities = random_capacities(rng, days)
+    items = random_workload(rng, rng.randint(0, 60), days)
+
+    assert plan_schedule(items, START, capacities, backend='numpy') == \
+        plan_schedule_python(items, START, capacities)
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_numpy_backend_matches_python_for_many_workloads(seed):
+    pytest.importorskip('numpy')
+    rng = random.Random(seed)
+    days = rng.choice([7, 30])
+    capacities = random_capacities(rng, days)
+    workloads = {user: random_workload(rng, rng.randint(0, 20), days) for user in range(25)}
+
+    assert plan_schedules(workloads, START, capacities, backend='numpy') == \
+        plan_schedules(workloads, START, capacities, backend='python')
+
+
+def test_numpy_backend_plans_staggered_workloads_like_python():
+    pytest.importorskip('numpy')
+    rng = random.Random(0)
+    capacities = daily_capacities(START, 14)
+    workloads = {user: random_workload(rng, 10, 14) for user in range(10)}
+    # Some workloads have occurrences that only become available later
+    for user in (2, 5):
+        workloads[user] = [item._replace(available=START + timedelta(days=3)) if i % 2 else item
+                           for i, item in enumerate(workloads[user])]
+
+    assert plan_schedules(workloads, START, capacities, backend='numpy') == \
+        plan_schedules(workloads, START, capacities, backend='python')
@@ -0,0 +1,80 @@
+"""The storage conformance checks (see storage.conformance), run on each backend."""
+import pytest
+
+from storage.conformance import CHECKS, run_benchmark, sqlite_target, standin_target
+from storage.server import ServerStorage, server_sql
+
+
+@pytest.fixture(params=[sqlite_target, standin_target], ids=['sqlite', 'standin'])
+def open_storage(request, app, tmp_path):
+    with app.app_context():
+        open_storage, close = request.param(str(tmp_path))
+        try:
+            yield open_storage
+        finally:
+            close()
+
+
+@pytest.mark.parametrize('check', CHECKS, ids=[function.__name__ for function in CHECKS])
+def test_conformance(open_storage, check):
+    check(open_storage)
+
+
+def test_benchmark_runs(open_storage):
+    results = run_benchmark(open_storage, 50)
+    assert [label for label, _, _ in results][0] == 'insert_many'
+    assert all(ms >= 0 for _, _, ms in results)
+
+
+def test_server_sql_translates_only_placeholders():
+    assert server_sql("SELECT 'why?', x FROM t WHERE a = ? AND b LIKE 'a%' AND c = ?") == (
+        "SELECT 'why?', x FROM t WHERE a = %s AND b LIKE 'a%%' AND c = %s"
+    )
+    assert server_sql("SELECT 'it''s ?', ?") == "SELECT 'it''s ?', %s"
+
+
+class FakeCursor:
+    """A server-side cursor: the description only arrives with the rows."""
+
+    def __init__(self, name):
+        self.name = name
+        self.description = None
+        self.rows = [(1, 'a'), (2, 'b'), (3, 'c')]
+
+    def execute(self, sql, params):
+        self.sql = sql
+
+    def fetchmany(self, size):
+        self.description = (('id',), ('title',))
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+
+class FakeConnection:
+    def __init__(self):
+        self.cursors = []
+
+    def cursor(self, name=None):
+        self.cursors.append(FakeCursor(name))
+        return self.cursors[-1]
+
+
+class FakePool:
+    def __init__(self):
+        self.connection = FakeConnection()
+
+    def acquire(self):
+        return self.connection
+
+
+def test_server_streams_use_named_cursors(app):
+    pool = FakePool()
+    storage = ServerStorage(pool)
+    with app.test_request_context():
+        rows = list(storage.stream('SELECT id, title FROM tasks WHERE user_id = ?', [1]))
+
+    cursor = pool.connection.cursors[0]
+    assert cursor.name is not None
+    assert cursor.itersize > 0
+    assert cursor.sql == 'SELECT id, title FROM tasks WHERE user_id = %s'
+    assert [(row['id'], row['title']) for row in rows] == [(1, 'a'), (2, 'b'), (3, 'c')]
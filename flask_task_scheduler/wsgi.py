@@ -0,0 +1,25 @@
+"""
+WSGI entry point for production servers:
+
+    gunicorn -c gunicorn.conf.py wsgi:application
+    python wsgi.py    # waitress, which also runs on Windows
+
+Both read their settings from the environment: HOST, PORT, WEB_CONCURRENCY
+(gunicorn worker processes) and THREADS (threads per process).
+"""
+import os
+
+from app import create_app
+
+application = create_app()
+
+
+if __name__ == '__main__':
+    from waitress import serve
+
+    serve(
+        application,
+        host=os.environ.get('HOST', '0.0.0.0'),
+        port=int(os.environ.get('PORT', 8000)),
+        threads=int(os.environ.get('THREADS', 8))
+    )